@@ -0,0 +1,74 @@
+import random
+import time
+from modules.extract_text import native_split_text
+from modules.path import prompt_text_path
+
+# Chunk sizes and overlaps compared against langchain
+CHUNK_SIZES = (50, 200, 500, 2000, 5000)
+OVERLAP_RATIOS = (0, 0.1)
+
+# Build the golden corpus: PROMPT.txt plus seeded page-like texts mixing paragraph
+# breaks, line breaks, runs of spaces and words longer than the smallest chunk size
+def build_golden_corpus(seed=42, documents=20):
+    with open(prompt_text_path, encoding="utf-8") as f:
+        prompt_text = f.read()
+    vocabulary = prompt_text.split()
+    rng = random.Random(seed)
+
+    corpus = [prompt_text]
+    for _ in range(documents):
+        parts = []
+        for _ in range(rng.randint(200, 2000)):
+            roll = rng.random()
+            if roll < 0.02:
+                parts.append("\n\n")
+            elif roll < 0.08:
+                parts.append("\n")
+            elif roll < 0.09:
+                parts.append("  ")
+            elif roll < 0.095:
+                parts.append("x" * rng.randint(60, 300))
+            else:
+                parts.append(rng.choice(vocabulary) + " ")
+        corpus.append("".join(parts))
+    return corpus
+
+def time_splitter(split, corpus, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in corpus:
+            split(text)
+    return (time.perf_counter() - start) / repeat
+
+def run_benchmark(repeat=5):
+    """
+    Check that native_split_text gives the same chunks as langchain's
+    RecursiveCharacterTextSplitter on the golden corpus, and time both.
+    """
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    corpus = build_golden_corpus()
+    total_chars = sum(len(text) for text in corpus)
+    print(f"Golden corpus: {len(corpus)} texts, {total_chars} characters")
+
+    mismatches = 0
+    for chunk_size in CHUNK_SIZES:
+        for ratio in OVERLAP_RATIOS:
+            chunk_overlap = int(chunk_size * ratio)
+            splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+            for text in corpus:
+                if native_split_text(text, chunk_size, chunk_overlap) != splitter.split_text(text):
+                    mismatches += 1
+
+            langchain_time = time_splitter(splitter.split_text, corpus, repeat)
+            native_time = time_splitter(lambda text: native_split_text(text, chunk_size, chunk_overlap), corpus, repeat)
+            print(f"chunk_size={chunk_size:<5} overlap={chunk_overlap:<4} "
+                  f"langchain {total_chars / langchain_time / 1e6:7.2f} Mchar/s  "
+                  f"native {total_chars / native_time / 1e6:7.2f} Mchar/s  "
+                  f"speedup {langchain_time / native_time:5.2f}x")
+
+    print(f"Boundary mismatches: {mismatches}")
+    return mismatches
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,134 @@
+import json
+import random
+import re
+import fitz  # PyMuPDF
+from os import makedirs, listdir, remove
+from os.path import join, exists
+from modules.path import prompt_text_path
+
+# Corpus profiles: number of files, (min, max) pages per file and (min, max) words per page
+CORPUS_PROFILES = {
+    "tiny": {"files": 5, "pages": (1, 4), "words_per_page": (100, 300)},
+    "small": {"files": 40, "pages": (2, 20), "words_per_page": (150, 450)},
+    "medium": {"files": 200, "pages": (5, 60), "words_per_page": (200, 600)},
+    "large": {"files": 600, "pages": (10, 400), "words_per_page": (250, 700)},
+}
+
+# A4 page with 2 cm margins, in points
+PAGE_SIZE = (595, 842)
+MARGIN = 56
+FONT_SIZE = 8
+
+# Version of the page layout, recorded in corpus.json so corpora written by an older
+# layout are generated again
+CORPUS_LAYOUT = 2
+
+def load_vocabulary() -> list[str]:
+    with open(prompt_text_path, encoding="utf-8") as f:
+        return f.read().split()
+
+# Text of one page: words from the vocabulary with sentence ends and paragraph breaks
+def page_text(rng: random.Random, vocabulary: list[str], words: int) -> str:
+    parts = []
+    for _ in range(words):
+        parts.append(rng.choice(vocabulary))
+        roll = rng.random()
+        if roll < 0.01:
+            parts.append("\n\n")
+        elif roll < 0.06:
+            parts.append(".\n")
+        else:
+            parts.append(" ")
+    return "".join(parts)
+
+# Font the text is written in, embedded under this name: the base-14 fonts only encode
+# Latin-1 and would turn the quotes and dashes of the vocabulary into question marks
+BODY_FONT = "body"
+
+def new_text_page(doc, font_buffer: bytes):
+    page = doc.new_page(width=PAGE_SIZE[0], height=PAGE_SIZE[1])
+    page.insert_font(fontname=BODY_FONT, fontbuffer=font_buffer)
+    return page
+
+# Insert as much of text as fits in rect, cut between words, and return the rest. A
+# failed insert_textbox writes nothing and returns minus the height the text lacks, from
+# which the share of the text that fits is estimated.
+def insert_fitting_text(page, rect, text: str) -> str:
+    rc = page.insert_textbox(rect, text, fontsize=FONT_SIZE, fontname=BODY_FONT)
+    if rc >= 0:
+        return ""
+    cuts = [match.start() for match in re.finditer(r"\s+", text)]
+    keep = len(cuts)
+    while rc < 0:
+        keep = min(keep - 1, int(keep * rect.height / (rect.height - rc)))
+        if keep <= 0:
+            raise RuntimeError("A word does not fit on a page")
+        rc = page.insert_textbox(rect, text[:cuts[keep]], fontsize=FONT_SIZE, fontname=BODY_FONT)
+    return text[cuts[keep]:].lstrip()
+
+# Write the text of every page to a PDF file, continuing text that overflows a page on
+# the next one, and check the file gives back every word. Returns the pages written.
+def write_pdf(pdf_file: str, pages: list[str]) -> int:
+    text_rect = fitz.Rect(MARGIN, MARGIN, PAGE_SIZE[0] - MARGIN, PAGE_SIZE[1] - MARGIN)
+    font_buffer = fitz.Font("helv").buffer
+    doc = fitz.open()
+    try:
+        for text in pages:
+            text = insert_fitting_text(new_text_page(doc, font_buffer), text_rect, text)
+            while text:
+                text = insert_fitting_text(new_text_page(doc, font_buffer), text_rect, text)
+        written = [word for text in pages for word in text.split()]
+        extracted = [word for page in doc for word in page.get_text().split()]
+        if extracted != written:
+            raise RuntimeError(f"{pdf_file} gives back {len(extracted)} words of the {len(written)} written")
+        page_count = doc.page_count
+        # No dates and no random file id, so the same seed gives byte-identical files
+        doc.set_metadata({})
+        doc.save(pdf_file, garbage=3, deflate=True, no_new_id=True)
+    finally:
+        doc.close()
+    return page_count
+
+def generate_corpus(folder: str, profile: str = "small", seed: int = 42) -> dict:
+    """
+    Generate a reproducible synthetic PDF corpus from the PROMPT.txt vocabulary.
+
+    File i is generated from its own generator seeded with (seed, i), so page counts and
+    text are stable whatever the number of files. A corpus.json file records the
+    parameters; a folder already holding the same corpus is reused as is.
+
+    :param folder: Folder the PDF files are written to.
+    :param profile: Name of a CORPUS_PROFILES entry.
+    :param seed: Random seed of the corpus.
+    :return: Corpus description: profile, seed, files, pages, words and bytes.
+    """
+    settings = CORPUS_PROFILES[profile]
+    description_path = join(folder, "corpus.json")
+    if exists(description_path):
+        with open(description_path, encoding="utf-8") as f:
+            description = json.load(f)
+        if (description.get("profile") == profile and description.get("seed") == seed and description.get("layout") == CORPUS_LAYOUT
+                and description.get("settings") == json.loads(json.dumps(settings))):
+            return description
+
+    makedirs(folder, exist_ok=True)
+    for f in listdir(folder):
+        if f.endswith(".pdf") or f == "corpus.json":
+            remove(join(folder, f))
+
+    vocabulary = load_vocabulary()
+    total_pages = total_words = total_bytes = 0
+    for index in range(settings["files"]):
+        rng = random.Random(f"{seed}-{index}")
+        words = [rng.randint(*settings["words_per_page"]) for _ in range(rng.randint(*settings["pages"]))]
+        pdf_file = join(folder, f"synthetic_{index:05d}.pdf")
+        total_pages += write_pdf(pdf_file, [page_text(rng, vocabulary, count) for count in words])
+        total_words += sum(words)
+        with open(pdf_file, "rb") as f:
+            total_bytes += len(f.read())
+
+    description = {"profile": profile, "seed": seed, "layout": CORPUS_LAYOUT, "settings": settings, "files": settings["files"],
+                   "pages": total_pages, "words": total_words, "bytes": total_bytes}
+    with open(description_path, "w", encoding="utf-8") as f:
+        json.dump(description, f, indent=4)
+    return description
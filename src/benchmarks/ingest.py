@@ -0,0 +1,221 @@
+import io
+import json
+import logging
+import multiprocessing
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from os import remove
+from os.path import join, exists
+from benchmarks.corpus import CORPUS_PROFILES, generate_corpus
+from modules.path import prompt_text_path
+
+try:
+    import resource
+except ImportError:  # Windows has no getrusage, peak RSS is not reported there
+    resource = None
+
+STAGES = ("extract", "word_freq", "prompt")
+
+# Slowdown over the baseline reported as a regression
+REGRESSION_THRESHOLD = 0.10
+
+# Peak resident set size in MB of the current process and its finished children
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+# file_info rows normally written by the C++ indexer, derived here from pdf_chunks
+def build_file_info(db_name: str) -> None:
+    conn = sqlite3.connect(db_name)
+    try:
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS file_info")
+            conn.execute("""CREATE TABLE file_info (
+                id TEXT PRIMARY KEY,
+                file_name TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                epoch_time INTEGER NOT NULL,
+                chunk_count INTEGER NOT NULL,
+                starting_id INTEGER NOT NULL,
+                ending_id INTEGER NOT NULL)
+            """)
+            conn.execute("""
+                INSERT INTO file_info (id, file_name, file_path, epoch_time, chunk_count, starting_id, ending_id)
+                SELECT CAST(ROW_NUMBER() OVER (ORDER BY MIN(id)) AS TEXT), file_name, file_name, 0, COUNT(*), MIN(id), MAX(id)
+                FROM pdf_chunks GROUP BY file_name
+            """)
+    finally:
+        conn.close()
+
+def count_chunks(db_name: str) -> tuple[int, int]:
+    conn = sqlite3.connect(db_name)
+    try:
+        return conn.execute("SELECT COUNT(DISTINCT file_name), COUNT(*) FROM pdf_chunks").fetchone()
+    finally:
+        conn.close()
+
+def run_extract(corpus_folder, work_folder, chunk_size, mode, workers):
+    import modules.extract_text as extract_text
+    db_name = join(work_folder, "pdf_text.db")
+    if exists(db_name):
+        remove(db_name)
+    start = time.perf_counter()
+    extract_text.extract_text(FOLDER_PATH=corpus_folder, CHUNK_SIZE=chunk_size, chunk_database_path=db_name, reset_db=True, mode=mode, workers=workers)
+    seconds = time.perf_counter() - start
+    files, chunks = count_chunks(db_name)
+    return seconds, files, chunks
+
+def run_word_freq(corpus_folder, work_folder, chunk_size, mode, workers):
+    import modules.word_freq as word_freq
+    db_name = join(work_folder, "pdf_text.db")
+    # Missing NLTK corpora fail the stage here instead of once per title, silently
+    word_freq.get_stop_words()
+    build_file_info(db_name)
+    start = time.perf_counter()
+    word_freq.process_chunks_in_batches(db_name, token_folder=join(work_folder, "token_json"),
+                                        global_json_path=join(work_folder, "global_word_freq.json"))
+    seconds = time.perf_counter() - start
+    files, chunks = count_chunks(db_name)
+    return seconds, files, chunks
+
+# Clean every prompt of PROMPT.txt, repeated to get a measurable time
+def run_prompt(corpus_folder, work_folder, chunk_size, mode, workers, repeat=50):
+    import modules.word_freq as word_freq
+    with open(prompt_text_path, encoding="utf-8") as f:
+        prompts = [line for line in f.read().splitlines() if line.startswith("Prompt")]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for prompt in prompts:
+            word_freq.clean_text(prompt)
+    seconds = time.perf_counter() - start
+    return seconds, None, len(prompts) * repeat
+
+# Runs in a fresh process, so peak RSS and import costs belong to the stage alone
+def run_stage(stage, corpus_folder, work_folder, chunk_size, mode, workers) -> dict:
+    logging.basicConfig(filename=join(work_folder, "benchmark.log"), level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    runner = {"extract": run_extract, "word_freq": run_word_freq, "prompt": run_prompt}[stage]
+    # Per-file progress printed by the stages would dominate the benchmark output
+    with redirect_stdout(io.StringIO()):
+        seconds, files, chunks = runner(corpus_folder, work_folder, chunk_size, mode, workers)
+    return {"seconds": seconds, "files": files, "chunks": chunks, "peak_rss_mb": peak_rss_mb()}
+
+def run_benchmark(profile="small", seed=42, stages=STAGES, repeat=1, chunk_size=5000, mode="thread", workers=None,
+                  corpus_folder=None, output_path=None, baseline_path=None) -> dict:
+    """
+    Run the ingestion stages end to end on a synthetic PDF corpus and report, per stage,
+    the median seconds over repeat runs, files/s, chunks/s and peak RSS.
+
+    Every run of a stage executes in a new process. word_freq and prompt run on the
+    database of the last extraction. A stage that fails is reported with its error and
+    the following stages still run.
+
+    :param profile: Corpus profile, see benchmarks.corpus.CORPUS_PROFILES.
+    :param corpus_folder: Folder of the corpus (default: a folder per profile and seed
+                          under the temporary directory, reused across runs).
+    :param output_path: JSON file the results are written to, in addition to stdout.
+    :param baseline_path: Results of an earlier run; stages more than
+                          REGRESSION_THRESHOLD slower are reported as regressions.
+    :return: Results dictionary as written to output_path.
+    """
+    corpus_folder = corpus_folder or join(tempfile.gettempdir(), "studyapp_benchmark", f"{profile}-{seed}")
+    print(f"Generating {profile} corpus in {corpus_folder}...")
+    corpus = generate_corpus(corpus_folder, profile, seed)
+    print(f"Corpus: {corpus['files']} files, {corpus['pages']} pages, {corpus['words']} words, {corpus['bytes'] / 1e6:.1f} MB")
+
+    work_folder = tempfile.mkdtemp(prefix="studyapp_benchmark_")
+    results = {"corpus": corpus, "platform": platform.platform(), "python": platform.python_version(),
+               "mode": mode, "workers": workers, "chunk_size": chunk_size, "repeat": repeat, "stages": {}}
+
+    context = multiprocessing.get_context("spawn")
+    for stage in stages:
+        runs = []
+        try:
+            for _ in range(repeat):
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    runs.append(executor.submit(run_stage, stage, corpus_folder, work_folder, chunk_size, mode, workers).result())
+        except Exception as e:
+            # NLTK lookup errors span a framed block of lines
+            error = f"{type(e).__name__}: {' '.join(str(e).replace('*', ' ').split())}"
+            results["stages"][stage] = {"error": error}
+            print(f"{stage:<10} failed: {error}")
+            continue
+
+        seconds = statistics.median(run["seconds"] for run in runs)
+        files, chunks = runs[-1]["files"], runs[-1]["chunks"]
+        rss = [run["peak_rss_mb"] for run in runs if run["peak_rss_mb"] is not None]
+        results["stages"][stage] = {
+            "seconds": seconds,
+            "runs": [run["seconds"] for run in runs],
+            "files": files,
+            "chunks": chunks,
+            "files_per_second": files / seconds if files is not None and seconds > 0 else None,
+            "chunks_per_second": chunks / seconds if chunks is not None and seconds > 0 else None,
+            "peak_rss_mb": max(rss) if rss else None,
+        }
+        print(format_stage(stage, results["stages"][stage]))
+
+    if baseline_path is not None:
+        with open(baseline_path, encoding="utf-8") as f:
+            results["regressions"] = compare_results(json.load(f), results)
+        for regression in results["regressions"]:
+            print(f"REGRESSION {regression['stage']}: {regression['baseline_seconds']:.3f} s -> {regression['seconds']:.3f} s "
+                  f"({regression['slowdown']:+.0%})")
+
+    report = json.dumps(results, indent=4)
+    if output_path is not None:
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(report)
+        print(f"Results written to {output_path}")
+    else:
+        print(report)
+    return results
+
+def format_stage(stage, result) -> str:
+    def rate(value, unit):
+        return f"{value:10.1f} {unit}" if value is not None else f"{'-':>10} {unit}"
+    rss = f"{result['peak_rss_mb']:8.1f} MB" if result["peak_rss_mb"] is not None else f"{'-':>8} MB"
+    return (f"{stage:<10} {result['seconds']:9.3f} s  {rate(result['files_per_second'], 'files/s')}  "
+            f"{rate(result['chunks_per_second'], 'chunks/s')}  peak RSS {rss}")
+
+def compare_results(baseline: dict, current: dict, threshold=REGRESSION_THRESHOLD) -> list[dict]:
+    """
+    Stages of current more than threshold slower than in baseline. Results of different
+    corpora are not comparable and give no regressions.
+    """
+    if baseline.get("corpus", {}).get("settings") != current["corpus"]["settings"] or baseline.get("corpus", {}).get("seed") != current["corpus"]["seed"]:
+        print("Baseline was measured on a different corpus, skipping the comparison.")
+        return []
+    regressions = []
+    for stage, result in current["stages"].items():
+        previous = baseline.get("stages", {}).get(stage, {})
+        if "seconds" not in result or not previous.get("seconds"):
+            continue
+        slowdown = result["seconds"] / previous["seconds"] - 1
+        if slowdown > threshold:
+            regressions.append({"stage": stage, "baseline_seconds": previous["seconds"], "seconds": result["seconds"], "slowdown": slowdown})
+    return regressions
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="End-to-end ingestion benchmark on a synthetic PDF corpus")
+    parser.add_argument("--profile", choices=sorted(CORPUS_PROFILES), default="small")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--mode", choices=["thread", "process"], default="thread")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--baseline", default=None)
+    args = parser.parse_args()
+    run_benchmark(profile=args.profile, seed=args.seed, stages=args.stages, repeat=args.repeat, mode=args.mode, workers=args.workers,
+                  output_path=args.output, baseline_path=args.baseline)
@@ -0,0 +1,76 @@
+import io
+import random
+import sqlite3
+import tempfile
+import time
+from contextlib import redirect_stdout
+from os.path import getsize, join
+from modules.extract_text import create_chunk_table, process_files_in_parallel
+from modules.prefetch import Prefetcher
+from modules.schedule import LptDispatcher, estimate_costs, lpt_order
+
+# Synthetic files: sizes in KB, processed at SECONDS_PER_MB so a run takes a few seconds
+FILE_SIZES_KB = (8, 16, 24, 32, 48, 64, 96, 128, 160, 192, 256, 320, 384, 448, 512, 640, 768, 896, 1024, 1536)
+SECONDS_PER_MB = 0.5
+WORKERS = 3
+
+def write_files(folder, seed=42):
+    sizes = list(FILE_SIZES_KB)
+    random.Random(seed).shuffle(sizes)
+    pdf_files = []
+    for index, size in enumerate(sizes):
+        pdf_file = join(folder, f"{index:02d}.pdf")
+        with open(pdf_file, "wb") as f:
+            f.write(b"\0" * size * 1024)
+        pdf_files.append(pdf_file)
+    return pdf_files
+
+# Stands in for MuPDF: a file takes time in proportion to its size
+def timed_page_source(pdf_file):
+    time.sleep(getsize(pdf_file) / (1024 * 1024) * SECONDS_PER_MB)
+    yield f"Text of {pdf_file}."
+
+def run_schedule(pdf_files, db_name, costs=None, reserved=0, prefetch=0):
+    dispatcher = LptDispatcher(pdf_files, costs, WORKERS, reserved) if costs is not None else None
+    prefetcher = Prefetcher(prefetch) if prefetch else None
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        process_files_in_parallel(dispatcher or pdf_files, chunk_size=1000, db_name=db_name, workers=WORKERS,
+                                  page_source=timed_page_source, prefetcher=prefetcher)
+    makespan = time.perf_counter() - start
+    if prefetcher is not None:
+        prefetcher.close()
+    return makespan, dispatcher
+
+def run_benchmark():
+    """
+    Check that LptDispatcher hands files to the thread pool largest first, with and
+    without prefetching, and time it against the scan order on synthetic files.
+    """
+    mismatches = 0
+    with tempfile.TemporaryDirectory() as folder:
+        pdf_files = write_files(folder)
+        costs = estimate_costs(pdf_files)
+        db_name = join(folder, "pdf_text.db")
+        conn = sqlite3.connect(db_name)
+        create_chunk_table(conn)
+        conn.commit()
+        conn.close()
+
+        scan_makespan, _ = run_schedule(pdf_files, db_name)
+        print(f"Scan order on {WORKERS} workers: {scan_makespan:.2f} s")
+        for reserved, prefetch in ((0, 0), (0, 8), (1, 0), (1, 8)):
+            makespan, dispatcher = run_schedule(pdf_files, db_name, costs, reserved, prefetch)
+            # Without reserved workers the files must be submitted exactly in LPT order
+            checked = ""
+            if not reserved:
+                matches = dispatcher.order == lpt_order(costs)
+                mismatches += not matches
+                checked = ", order matches LPT" if matches else ", order DIFFERS from LPT"
+            print(f"LPT, {reserved} reserved, prefetch {prefetch}: {makespan:.2f} s{checked}")
+
+    print(f"Dispatch order mismatches: {mismatches}")
+    return mismatches
+
+if __name__ == "__main__":
+    run_benchmark()
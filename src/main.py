@@ -1,14 +1,45 @@
+import time
+process_start = time.perf_counter()
+
 import argparse
+import sqlite3
 from datetime import datetime
+from importlib import import_module
 import modules.path as path
-import modules.extract_text as extract_text
-import modules.word_freq as word_freq
+
+# (module, seconds) for every subsystem imported by a subcommand, see --startupProfile
+import_times = []
 
 def get_time_performance(start_time: datetime, message: str) -> None:
     end_time = datetime.now()
     time_diff = end_time - start_time
     print(f"{message} took {time_diff} seconds")
 
+# Import a subsystem only when a subcommand needs it, recording how long it took
+def lazy_import(name: str):
+    start = time.perf_counter()
+    module = import_module(name)
+    import_times.append((name, time.perf_counter() - start))
+    return module
+
+def print_startup_profile() -> None:
+    print("Startup profile (import time):")
+    for name, seconds in import_times:
+        print(f"  {name:<28} {seconds * 1000:9.1f} ms")
+    print(f"  {'total since start':<28} {(time.perf_counter() - process_start) * 1000:9.1f} ms")
+
+# Extraction settings shared by --extractText and --watch
+def extract_options(args, page_profile=None) -> dict:
+    return dict(mode=args.mode, workers=args.workers, memory_budget=args.memoryBudget * 1024 * 1024 if args.stream else None,
+                page_threshold=args.pageThreshold, pages_per_range=args.pagesPerRange, codec=args.chunkCodec or "none",
+                file_timeout=args.fileTimeout, file_memory_limit=args.fileMemoryLimit * 1024 * 1024 if args.fileMemoryLimit else None,
+                retry_quarantined=args.retryQuarantined, autotune=args.autotune,
+                worker_bounds=tuple(args.workerBounds) if args.workerBounds else None, batch_bounds=tuple(args.batchBounds),
+                profile=args.profileExtract, dedup_chunks=args.dedupChunks, max_in_flight_bytes=args.inFlightBudget * 1024 * 1024,
+                schedule=args.schedule, schedule_cost=args.scheduleCost, reserved_workers=args.reserveSmallWorkers,
+                prefetch=args.prefetch, prefetch_bytes=args.prefetchMemory * 1024 * 1024, cache_text=args.cacheText,
+                granularities=tuple(args.chunkLevels or ()), page_profile=page_profile)
+
 def app():
 
     parser = argparse.ArgumentParser(prog="Study Logging and Database",
@@ -18,11 +49,70 @@ def app():
     
     parser.add_argument("--displayHelp", action= 'store_true', help= 'Display help message')
     parser.add_argument("--extractText", action= 'store_true', help= 'Extract text from PDF files and store in database')
+    parser.add_argument("--scanCatalog", action= 'store_true', help="Catalog the page count, info dictionary and outline of every PDF file into the pdf_catalog table, without extracting any text")
+    parser.add_argument("--rescanCatalog", action= 'store_true', help="With --scanCatalog, read every PDF file again instead of only new or changed ones")
     parser.add_argument("--processWordFreq", action= 'store_true', help="Create index tables and analyze word frequencies all in one")
     parser.add_argument("--tokenizePrompt", action= 'store_true', help="Prompt to find references in full database based on context of search")
+    parser.add_argument("--benchmarkChunker", action= 'store_true', help="Compare the built-in chunker against langchain's splitter on the golden corpus")
+    parser.add_argument("--benchmarkSchedule", action= 'store_true', help="Check that --schedule lpt submits files largest first, with and without --prefetch, and time it against the scan order")
+    parser.add_argument("--benchmarkIngest", action= 'store_true', help="Run extraction, word frequency and prompt stages on a synthetic PDF corpus and report machine-readable timings")
+    parser.add_argument("--benchmarkProfile", choices= ["tiny", "small", "medium", "large"], default= "small", help="Synthetic corpus size for --benchmarkIngest (default: small)")
+    parser.add_argument("--benchmarkOutput", type= str, default= None, help="JSON file the --benchmarkIngest results are written to")
+    parser.add_argument("--benchmarkBaseline", type= str, default= None, help="Results JSON of an earlier --benchmarkIngest run to report regressions against")
+    parser.add_argument("--incremental", action= 'store_true', help="With --extractText, only extract new or modified PDF files and sync renamed or deleted ones instead of rebuilding the database")
+    parser.add_argument("--resume", action= 'store_true', help="With --extractText, finish the files an interrupted extraction run left pending or in progress")
+    parser.add_argument("--fileTimeout", type= float, default= None, help="Read each PDF file in a killable worker process and fail files taking longer than this many seconds")
+    parser.add_argument("--fileMemoryLimit", type= int, default= None, help="Memory limit in MB of the worker process reading a PDF file (Unix only, implies a watchdog worker)")
+    parser.add_argument("--retryQuarantined", "--retry-quarantined", action= 'store_true', help="With --extractText, extract quarantined PDF files again even if their content did not change")
+    parser.add_argument("--watch", action= 'store_true', help="Run as a daemon that ingests new, changed or removed PDF files of the reading list folder as they appear, using the --extractText options")
+    parser.add_argument("--watchSettle", type= float, default= 5.0, help="Seconds a changed PDF file must stay unchanged before --watch ingests it (default: 5)")
+    parser.add_argument("--watchPolling", action= 'store_true', help="With --watch, poll the folder every --watchInterval seconds instead of using inotify")
+    parser.add_argument("--watchInterval", type= float, default= 5.0, help="Seconds between folder snapshots when --watch polls (default: 5)")
+    parser.add_argument("--workers", type= int, default= None, help="Number of extraction workers (default: executor default)")
+    parser.add_argument("--profileExtract", action= 'store_true', help="With --extractText, time the open, page text, split and store stages of every PDF file, store them in the extract_metrics table and print a summary")
+    parser.add_argument("--autotune", action= 'store_true', help="Adjust the worker count and batch size of the extraction to the measured throughput, starting from --workers")
+    parser.add_argument("--workerBounds", type= int, nargs= 2, default= None, metavar= ("MIN", "MAX"), help="Worker count bounds for --autotune (default: 1 to 4x cores for threads, 1 to cores for processes)")
+    parser.add_argument("--batchBounds", type= int, nargs= 2, default= [10, 500], metavar= ("MIN", "MAX"), help="Files per batch bounds for --autotune (default: 10 500)")
+    parser.add_argument("--inFlightBudget", type= int, default= 256, help="Estimated MB of PDF files queued or being extracted at once in thread mode, from their sizes on disk (default: 256)")
+    parser.add_argument("--schedule", choices= ["scan", "lpt"], default= "scan", help="Order PDF files are extracted in: as found by the scan, or largest first once the scan completes (default: scan)")
+    parser.add_argument("--scheduleCost", choices= ["size", "pages"], default= "size", help="Cost --schedule lpt orders files by: file size, or page count read from the page tree (default: size)")
+    parser.add_argument("--reserveSmallWorkers", type= int, default= 0, help="With --schedule lpt in thread mode, workers that take the smallest files instead of the largest (default: 0)")
+    parser.add_argument("--prefetch", type= int, default= 0, help="In thread mode, read this many upcoming PDF files into memory ahead of the extraction workers (default: 0, off)")
+    parser.add_argument("--prefetchMemory", type= int, default= 256, help="MB of PDF files --prefetch may hold in memory before they are extracted (default: 256)")
+    parser.add_argument("--stream", action= 'store_true', help="Extract, split and store PDF files page by page with bounded memory per worker")
+    parser.add_argument("--memoryBudget", type= int, default= 64, help="Per-worker memory budget in MB for --stream (default: 64)")
+    parser.add_argument("--pageThreshold", type= int, default= None, help="Split PDF files with more pages than this into page ranges extracted in parallel processes")
+    parser.add_argument("--pagesPerRange", type= int, default= 100, help="Pages per range when a PDF file is split with --pageThreshold (default: 100)")
+    parser.add_argument("--chunkSize", "--chunk-size", type= int, default= 5000, help="Maximum number of characters per chunk for --extractText, --watch and --rechunk (default: 5000)")
+    parser.add_argument("--cacheText", action= 'store_true', help="Keep the extracted page text of every PDF file compressed in the database, keyed by content hash, for --rechunk")
+    parser.add_argument("--chunkLevels", type= int, nargs= '+', default= None, metavar= "SIZE", help="Also split every chunk into finer levels of these chunk sizes in the same pass, e.g. 500 200, linked to the chunk they lie in")
+    parser.add_argument("--chunkChildren", type= int, default= None, metavar= "ID", help="Print the finer level chunks lying in the chunk with this id")
+    parser.add_argument("--rechunk", action= 'store_true', help="Rebuild the chunks at --chunkSize from the cached text of the PDF files instead of parsing them again")
+    parser.add_argument("--pageProfile", type= str, default= "full", metavar= "PROFILE", help="Pages read from every PDF file: full, front (table of contents and introduction, from the outline), first:N or every:K. Chunks of a profile other than full go to their own database, which the commands reading or writing chunks (--extractText, --watch, --rechunk, --search, --processWordFreq, ...) use when given the same profile; --scanCatalog keeps one catalog for all profiles (default: full)")
+    parser.add_argument("--chunkCodec", choices= ["none", "zlib", "zstd"], default= None, help="Codec chunk text is compressed with when extracted (default: none) or rechunked (default: the codec of the existing chunks)")
+    parser.add_argument("--dedupChunks", action= 'store_true', help="Store identical chunks once in a content-addressed blob table; with --extractText after the ingest, alone on the existing database")
+    parser.add_argument("--compressChunks", choices= ["none", "zlib", "zstd"], default= None, help="Migrate the chunks of the existing database to the given codec")
+    parser.add_argument("--trainDictionary", action= 'store_true', help="With --compressChunks zstd, train a zstd dictionary on a sample of chunks first")
+    parser.add_argument("--benchmarkChunkStore", action= 'store_true', help="Report size reduction and decompression throughput of each codec on the existing chunks")
+    parser.add_argument("--search", type= str, default= None, metavar= "QUERY", help="Keyword search over the full-text index of the chunks, returns ranked files and snippets")
+    parser.add_argument("--chunkLocation", type= int, default= None, metavar= "ID", help="Print the file, page range and character offsets of the chunk with this id")
+    parser.add_argument("--buildSearchIndex", action= 'store_true', help="Build or rebuild the full-text index over the chunks")
+    parser.add_argument("--startupProfile", "--startup-profile", action= 'store_true', help="Print an import-time breakdown of the subsystems loaded by the command")
+    parser.add_argument("--mode", choices= ["thread", "process"], default= "thread", help="Extraction mode: threads sharing the database, or processes writing to shard databases merged at the end")
 
     args = parser.parse_args()
 
+    # Chunks of a page profile live in a database of their own
+    profile = None
+    chunk_database_path = path.chunk_database_path
+    if args.pageProfile != "full":
+        page_profile = lazy_import("modules.page_profile")
+        try:
+            profile = page_profile.parse_profile(args.pageProfile)
+        except ValueError as e:
+            parser.error(str(e))
+        chunk_database_path = page_profile.profile_database_path(chunk_database_path, profile)
+
     if args.displayHelp:
         print("""
               This project is to meant to store record of learning activities. 
@@ -35,6 +125,18 @@ def app():
               word stems to clean up textual data for processing cosine similarity search.
               """)
 
+    if args.scanCatalog:
+        start_time = datetime.now()
+
+        lazy_import("fitz")
+        catalog = lazy_import("modules.catalog")
+        print("Cataloging PDF files...")
+        catalog.scan_catalog(path.pdf_path, path.chunk_database_path, workers=args.workers, mode=args.mode, rescan=args.rescanCatalog)
+        print("Finished cataloging PDF files.")
+
+        # announce finish
+        get_time_performance(start_time, "Catalog scan time")
+
     if args.extractText: # function is functioning properly
         start_time = datetime.now()
         
@@ -54,19 +156,48 @@ def app():
         descriptions. They are more challenging to search but provide deeper 
         understanding.
         """
-        chunk_size = 5000
+        chunk_size = args.chunkSize
+        lazy_import("fitz")
+        extract_text = lazy_import("modules.extract_text")
         # extract_text
         print("Extracting text from PDF files...")
-        extract_text.extract_text(CHUNK_SIZE=chunk_size, FOLDER_PATH=path.pdf_path, chunk_database_path=path.chunk_database_path, reset_db=True)
+        extract_text.extract_text(CHUNK_SIZE=chunk_size, FOLDER_PATH=path.pdf_path, chunk_database_path=chunk_database_path, reset_db=not args.incremental,
+                                  resume=args.resume, **extract_options(args, profile))
         print("Finished extracting text from PDF files.")
         # announce finish
         get_time_performance(start_time, "Text extracting time")
     
+    if args.watch:
+        start_time = datetime.now()
+
+        lazy_import("fitz")
+        watch = lazy_import("modules.watch")
+        print("Watching the PDF folder...")
+        watch.watch_folder(path.pdf_path, chunk_database_path, chunk_size=args.chunkSize, settle=args.watchSettle, poll_interval=args.watchInterval,
+                           polling=args.watchPolling, **extract_options(args, profile))
+
+        # announce finish
+        get_time_performance(start_time, "Watch time")
+
+    if args.rechunk:
+        start_time = datetime.now()
+
+        rechunk = lazy_import("modules.rechunk")
+        print(f"Rechunking cached text into chunks of {args.chunkSize} characters...")
+        rechunk.rechunk(chunk_database_path, args.chunkSize, codec=args.chunkCodec, granularities=tuple(args.chunkLevels or ()),
+                        page_profile=profile)
+        print("Finished rechunking.")
+
+        # announce finish
+        get_time_performance(start_time, "Rechunking time")
+
     if args.processWordFreq:
         start_time = datetime.now()
 
+        lazy_import("nltk")
+        word_freq = lazy_import("modules.word_freq")
         print("Processing word frequencies...")
-        word_freq.process_word_frequencies_in_batches()
+        word_freq.process_word_frequencies_in_batches(database=chunk_database_path)
         print("Finished processing word frequencies.")
         
         # announce finish
@@ -75,6 +206,8 @@ def app():
     if args.tokenizePrompt: # function is functioning properly
         start_time = datetime.now()
         
+        lazy_import("nltk")
+        word_freq = lazy_import("modules.word_freq")
         print("Tokenizing prompt...")
         word_freq.promptFindingReference()
         print("Finished tokenizing prompt.")
@@ -82,5 +215,144 @@ def app():
         # announce finish
         get_time_performance(start_time, "Tokenizing prompt time")
 
+    if args.benchmarkChunker:
+        start_time = datetime.now()
+
+        chunker_benchmark = lazy_import("benchmarks.chunker")
+        print("Benchmarking chunker...")
+        chunker_benchmark.run_benchmark()
+        print("Finished benchmarking chunker.")
+
+        # announce finish
+        get_time_performance(start_time, "Chunker benchmark time")
+
+    if args.benchmarkSchedule:
+        start_time = datetime.now()
+
+        schedule_benchmark = lazy_import("benchmarks.schedule")
+        print("Benchmarking scheduling...")
+        schedule_benchmark.run_benchmark()
+        print("Finished benchmarking scheduling.")
+
+        # announce finish
+        get_time_performance(start_time, "Scheduling benchmark time")
+
+    if args.benchmarkIngest:
+        start_time = datetime.now()
+
+        ingest_benchmark = lazy_import("benchmarks.ingest")
+        print("Benchmarking ingestion...")
+        ingest_benchmark.run_benchmark(profile=args.benchmarkProfile, mode=args.mode, workers=args.workers,
+                                       output_path=args.benchmarkOutput, baseline_path=args.benchmarkBaseline)
+        print("Finished benchmarking ingestion.")
+
+        # announce finish
+        get_time_performance(start_time, "Ingestion benchmark time")
+
+    if args.compressChunks:
+        start_time = datetime.now()
+
+        chunk_codec = lazy_import("modules.chunk_codec")
+        print(f"Migrating chunks to {args.compressChunks}...")
+        chunk_codec.migrate_chunk_store(chunk_database_path, args.compressChunks, train_dict=args.trainDictionary)
+        # An index of an earlier version drops compressed chunks, it is rebuilt over the decoded text
+        search = lazy_import("modules.search")
+        conn = sqlite3.connect(chunk_database_path)
+        try:
+            if search.is_search_index_outdated(conn):
+                print("Rebuilding full-text index...")
+                search.build_search_index(conn)
+        finally:
+            conn.close()
+        print("Finished migrating chunks.")
+
+        # announce finish
+        get_time_performance(start_time, "Chunk migration time")
+
+    if args.dedupChunks and not args.extractText:
+        start_time = datetime.now()
+
+        dedup = lazy_import("modules.dedup")
+        print("Deduplicating chunks...")
+        conn = sqlite3.connect(chunk_database_path)
+        try:
+            print(dedup.format_report(dedup.dedup_chunk_store(conn)))
+        finally:
+            conn.close()
+        print("Finished deduplicating chunks.")
+
+        # announce finish
+        get_time_performance(start_time, "Chunk deduplication time")
+
+    if args.benchmarkChunkStore:
+        start_time = datetime.now()
+
+        chunk_codec = lazy_import("modules.chunk_codec")
+        print("Benchmarking chunk store...")
+        chunk_codec.benchmark_chunk_store(chunk_database_path)
+        print("Finished benchmarking chunk store.")
+
+        # announce finish
+        get_time_performance(start_time, "Chunk store benchmark time")
+
+    if args.buildSearchIndex:
+        start_time = datetime.now()
+
+        search = lazy_import("modules.search")
+        print("Building full-text index...")
+        conn = sqlite3.connect(chunk_database_path)
+        try:
+            search.build_search_index(conn)
+        finally:
+            conn.close()
+        print("Finished building full-text index.")
+
+        # announce finish
+        get_time_performance(start_time, "Full-text index build time")
+
+    if args.search:
+        start_time = datetime.now()
+
+        search = lazy_import("modules.search")
+        search.search(chunk_database_path, args.search)
+
+        # announce finish
+        get_time_performance(start_time, "Search time")
+
+    if args.chunkLocation is not None:
+        chunk_position = lazy_import("modules.chunk_position")
+        conn = sqlite3.connect(chunk_database_path)
+        try:
+            chunk_position.ensure_position_columns(conn)
+            conn.commit()
+            location = chunk_position.get_chunk_location(conn, args.chunkLocation)
+        finally:
+            conn.close()
+        if location is None:
+            print(f"No chunk with id {args.chunkLocation}.")
+        elif location["start_page"] is None:
+            print(f"{location['file_name']} #{location['chunk_index']}: no recorded location, extract the file again to record it")
+        else:
+            print(f"{location['file_name']} #{location['chunk_index']}: {chunk_position.format_pages(location['start_page'], location['end_page'])}, "
+                  f"characters {location['start_offset']}-{location['end_offset']}")
+
+    if args.chunkChildren is not None:
+        chunk_levels = lazy_import("modules.chunk_levels")
+        conn = sqlite3.connect(chunk_database_path)
+        try:
+            children = chunk_levels.child_chunks(conn, args.chunkChildren)
+        finally:
+            conn.close()
+        if children is None:
+            print(f"No chunk with id {args.chunkChildren}.")
+        elif not children:
+            print(f"Chunk {args.chunkChildren} has no finer levels, extract with --chunkLevels to build them.")
+        for child in children or ():
+            print(f"[{child['granularity']}] #{child['chunk_index']} in #{child['parent_index']}, "
+                  f"characters {child['start_offset']}-{child['end_offset']}: {' '.join(child['text'].split())}")
+
+    if args.startupProfile:
+        print_startup_profile()
+
 if __name__ == "__main__":
     app()
\ No newline at end of file
@@ -0,0 +1,135 @@
+import logging
+import time
+from collections import deque
+from os.path import getsize
+
+# Total size in bytes of the files of a batch, skipping files that vanished
+def batch_bytes(files: list[str]) -> int:
+    total = 0
+    for file in files:
+        try:
+            total += getsize(file)
+        except OSError:
+            continue
+    return total
+
+class Autotuner:
+    """
+    Hill-climbing controller for the worker count and batch size of the extraction pool.
+
+    The bottleneck of an extraction run depends on the machine: a slow network share
+    wants many workers waiting on reads, a local disk is CPU bound and stops gaining at
+    the core count, and past some point the single SQLite writer saturates. Instead of
+    guessing, the tuner measures throughput after every batch and moves the worker count
+    one step at a time, keeping the direction while throughput improves and reversing it
+    when throughput drops. Changes within the tolerance count as a plateau: workers added
+    without gain are given back once, then the setting is held.
+
+    Throughput is MB/s over a sliding window of the batches run with the current worker
+    count (files/s when the files have no size). The batch size is set so that a batch
+    takes about target_batch_seconds at the measured files/s: long enough to amortize
+    the pool start-up of each batch, short enough to react to the next measurement.
+
+    Every decision is logged.
+
+    :param workers: Starting worker count, clamped to the bounds.
+    :param worker_bounds: (min, max) worker count.
+    :param batch_size: Starting batch size, clamped to the bounds.
+    :param batch_bounds: (min, max) number of files per batch.
+    :param window: Number of batches in the sliding window (default is 3).
+    :param tolerance: Relative throughput change treated as noise (default is 0.05).
+    :param target_batch_seconds: Wall time a batch should take (default is 20).
+    """
+
+    def __init__(self, workers: int, worker_bounds: tuple[int, int], batch_size: int, batch_bounds: tuple[int, int],
+                 window: int = 3, tolerance: float = 0.05, target_batch_seconds: float = 20.0):
+        self.min_workers, self.max_workers = worker_bounds
+        self.min_batch, self.max_batch = batch_bounds
+        if not 1 <= self.min_workers <= self.max_workers or not 1 <= self.min_batch <= self.max_batch:
+            raise ValueError(f"Invalid autotune bounds: workers {worker_bounds}, batch size {batch_bounds}")
+        self.workers = min(max(workers, self.min_workers), self.max_workers)
+        self.batch_size = min(max(batch_size, self.min_batch), self.max_batch)
+        self.tolerance = tolerance
+        self.target_batch_seconds = target_batch_seconds
+
+        # (files, bytes, seconds) of the batches run with the current worker count
+        self.samples = deque(maxlen=window)
+        self.direction = 1
+        self.previous_rate = None
+        self.last_step = 0
+        self.last_rates = (0.0, 0.0)
+        self.decisions = []
+
+    # Start timing a batch, returns the token to pass to record()
+    def start_batch(self) -> float:
+        return time.perf_counter()
+
+    def record(self, started: float, files: int, size: int) -> None:
+        """
+        Add the measurement of a finished batch and adjust the worker count and batch size.
+
+        :param started: Value returned by start_batch().
+        :param files: Number of files in the batch.
+        :param size: Total size of the files in bytes.
+        """
+        seconds = time.perf_counter() - started
+        if files == 0 or seconds <= 0:
+            return
+        self.samples.append((files, size, seconds))
+        files_per_second, mb_per_second = self.last_rates = self.window_rates()
+        rate = mb_per_second if mb_per_second > 0 else files_per_second
+
+        previous_workers, previous_batch = self.workers, self.batch_size
+        step = True
+        if self.previous_rate is None:
+            reason = "first measurement"
+        elif rate > self.previous_rate * (1 + self.tolerance):
+            reason = f"throughput up from {self.previous_rate:.2f}"
+        elif rate < self.previous_rate * (1 - self.tolerance):
+            self.direction = -self.direction
+            reason = f"throughput down from {self.previous_rate:.2f}, reversing"
+        elif self.last_step > 0:
+            self.direction = -1
+            reason = f"throughput flat against {self.previous_rate:.2f}, giving back the added workers"
+        else:
+            step = False
+            reason = f"throughput flat against {self.previous_rate:.2f}, holding"
+        if step:
+            self.workers = self._step_workers()
+        self.last_step = self.workers - previous_workers
+        self.batch_size = min(max(round(files_per_second * self.target_batch_seconds), self.min_batch), self.max_batch)
+
+        # A new worker count starts a new window, the rate of this one is the reference
+        if self.workers != previous_workers:
+            self.previous_rate = rate
+            self.samples.clear()
+        elif self.previous_rate is None:
+            self.previous_rate = rate
+
+        decision = (f"Autotune: {files_per_second:.2f} files/s, {mb_per_second:.2f} MB/s with {previous_workers} workers ({reason}); "
+                    f"workers {previous_workers} -> {self.workers}, batch size {previous_batch} -> {self.batch_size}")
+        self.decisions.append(decision)
+        logging.info(decision)
+
+    # Files/s and MB/s over the sliding window
+    def window_rates(self) -> tuple[float, float]:
+        files = sum(sample[0] for sample in self.samples)
+        size = sum(sample[1] for sample in self.samples)
+        seconds = sum(sample[2] for sample in self.samples)
+        if seconds <= 0:
+            return 0.0, 0.0
+        return files / seconds, size / seconds / (1024 * 1024)
+
+    # Next worker count in the current direction; bouncing off a bound reverses it
+    def _step_workers(self) -> int:
+        step = max(1, self.workers // 4) if self.last_step <= 0 else self.last_step
+        workers = self.workers + self.direction * step
+        if workers > self.max_workers or workers < self.min_workers:
+            self.direction = -self.direction
+            workers = self.workers + self.direction * step
+        return min(max(workers, self.min_workers), self.max_workers)
+
+    def summary(self) -> str:
+        files_per_second, mb_per_second = self.last_rates
+        return (f"Autotune: settled on {self.workers} workers and batches of {self.batch_size} files "
+                f"({files_per_second:.2f} files/s, {mb_per_second:.2f} MB/s) after {len(self.decisions)} decisions.")
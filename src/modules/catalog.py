@@ -0,0 +1,143 @@
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from os import stat
+from os.path import join
+import fitz  # PyMuPDF
+import modules.scan as scan
+from modules.extract_text import setup_logging
+
+# Keys of doc.metadata stored in pdf_catalog, and their columns
+METADATA_KEYS = ("title", "author", "subject", "keywords", "creator", "producer", "creationDate", "modDate")
+METADATA_COLUMNS = ("title", "author", "subject", "keywords", "creator", "producer", "creation_date", "mod_date")
+
+CATALOG_COLUMNS = ("file_path", "file_size", "mtime_ns", "page_count", *METADATA_COLUMNS, "toc", "encrypted", "error", "scanned_at")
+
+# Catalog rows written per transaction
+CATALOG_BATCH_ROWS = 500
+
+# Files handed to a worker process at once; a catalog read takes milliseconds
+PROCESS_CHUNKSIZE = 16
+
+def create_catalog_table(conn: sqlite3.Connection) -> None:
+    # toc holds the outline as a JSON list of [level, title, page] entries
+    conn.execute("""CREATE TABLE IF NOT EXISTS pdf_catalog (
+        file_path TEXT PRIMARY KEY,
+        file_size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        page_count INTEGER,
+        title TEXT,
+        author TEXT,
+        subject TEXT,
+        keywords TEXT,
+        creator TEXT,
+        producer TEXT,
+        creation_date TEXT,
+        mod_date TEXT,
+        toc TEXT,
+        encrypted INTEGER,
+        error TEXT,
+        scanned_at REAL NOT NULL)
+    """)
+
+def read_catalog_entry(pdf_file: str):
+    """
+    Catalog row of a PDF file from its info dictionary, outline and page tree, without
+    reading any page. A file MuPDF cannot open gets a row with its error, a file that
+    disappeared gets None.
+    """
+    try:
+        info = stat(pdf_file)
+    except OSError as e:
+        logging.warning(f"Cannot catalog {pdf_file}: {e}")
+        return None
+    try:
+        with fitz.open(pdf_file) as doc:
+            metadata = doc.metadata or {}
+            # The outline of an encrypted document cannot be read without its password
+            toc = [] if doc.needs_pass else doc.get_toc(simple=True)
+            return (pdf_file, info.st_size, info.st_mtime_ns, doc.page_count, *(metadata.get(key) or None for key in METADATA_KEYS),
+                    json.dumps(toc), int(doc.needs_pass), None, time.time())
+    except Exception as e:
+        logging.error(f"Error cataloging {pdf_file}: {e}")
+        return (pdf_file, info.st_size, info.st_mtime_ns, None, *(None for _ in METADATA_KEYS),
+                None, None, f"{type(e).__name__}: {e}", time.time())
+
+# Catalog rows of the files under folder: file_path -> (file_size, mtime_ns)
+def load_catalog(conn: sqlite3.Connection, folder: str) -> dict:
+    prefix = join(folder, "")
+    return {row[0]: row[1:] for row in conn.execute(
+        "SELECT file_path, file_size, mtime_ns FROM pdf_catalog WHERE substr(file_path, 1, ?) = ?", (len(prefix), prefix))}
+
+def write_catalog_rows(conn: sqlite3.Connection, rows: list[tuple]) -> None:
+    with conn:
+        conn.executemany(f"INSERT OR REPLACE INTO pdf_catalog ({', '.join(CATALOG_COLUMNS)}) VALUES ({', '.join('?' * len(CATALOG_COLUMNS))})", rows)
+
+def scan_catalog(folder_path: str, db_name: str, workers: int = None, mode: str = "thread", rescan: bool = False) -> None:
+    """
+    Catalog every PDF file of a folder tree into the pdf_catalog table: file stats,
+    page count, info dictionary and outline (table of contents), with no page text.
+
+    Files are read in parallel on a thread pool, or a process pool in process mode.
+    Files whose size and mtime match their catalog row are not opened again unless
+    rescan is set, and rows of files no longer in the folder are deleted.
+
+    :param folder_path: Root of the tree.
+    :param db_name: Path to the database holding pdf_catalog.
+    :param workers: Number of workers (default: executor default).
+    :param mode: "thread" or "process".
+    :param rescan: Read every file again.
+    """
+    setup_logging()
+    started = time.perf_counter()
+    conn = sqlite3.connect(db_name)
+    try:
+        create_catalog_table(conn)
+        conn.commit()
+        cataloged = load_catalog(conn, folder_path)
+
+        on_disk = [pdf for pdf_batch in scan.scan_folder(folder_path, db_name=db_name) for pdf in pdf_batch]
+        to_read = []
+        for pdf_file in on_disk:
+            known = cataloged.get(pdf_file)
+            if not rescan and known is not None:
+                try:
+                    info = stat(pdf_file)
+                except OSError:
+                    continue
+                if known == (info.st_size, info.st_mtime_ns):
+                    continue
+            to_read.append(pdf_file)
+
+        read = failed = 0
+        batch = []
+        executor_class = ProcessPoolExecutor if mode == "process" else ThreadPoolExecutor
+        with executor_class(max_workers=workers) as executor:
+            for row in executor.map(read_catalog_entry, to_read, chunksize=PROCESS_CHUNKSIZE if mode == "process" else 1):
+                if row is None:
+                    continue
+                read += 1
+                failed += row[-2] is not None
+                batch.append(row)
+                if len(batch) == CATALOG_BATCH_ROWS:
+                    write_catalog_rows(conn, batch)
+                    batch = []
+        if batch:
+            write_catalog_rows(conn, batch)
+
+        removed = set(cataloged).difference(on_disk)
+        with conn:
+            conn.executemany("DELETE FROM pdf_catalog WHERE file_path = ?", [(pdf_file,) for pdf_file in removed])
+
+        prefix = join(folder_path, "")
+        files, pages, outlined = conn.execute("""
+            SELECT COUNT(*), COALESCE(SUM(page_count), 0), COALESCE(SUM(toc IS NOT NULL AND toc != '[]'), 0)
+            FROM pdf_catalog WHERE substr(file_path, 1, ?) = ?""", (len(prefix), prefix)).fetchone()
+        elapsed = time.perf_counter() - started
+        logging.info(f"Cataloged {folder_path}: {read} read, {failed} failed, {len(on_disk) - len(to_read)} unchanged, {len(removed)} removed.")
+        print(f"Catalog: {files} PDF files, {pages} pages, {outlined} with an outline "
+              f"({read} read, {failed} failed, {len(on_disk) - len(to_read)} unchanged, {len(removed)} removed) in {elapsed:.2f} s.")
+    finally:
+        conn.close()
@@ -0,0 +1,286 @@
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd codecs are optional, zlib is always available
+    zstandard = None
+
+# Codecs accepted for pdf_chunks.chunk_text. A NULL codec means plain text, and
+# "zstd:<id>" is zstd with the trained dictionary <id> of chunk_dictionaries. Rows of a
+# deduplicated store reference a chunk_blobs row by blob_id instead, with NULL
+# chunk_text and codec; the blob holds the stored value and its codec.
+CODECS = ("none", "zlib", "zstd")
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 9
+
+# Default dictionary training parameters
+DICTIONARY_SAMPLE_CHUNKS = 2000
+DICTIONARY_SIZE = 112 * 1024
+
+def require_zstd() -> None:
+    if zstandard is None:
+        raise RuntimeError("The zstd codec needs the 'zstandard' package (pip install zstandard)")
+
+def has_codec_column(conn: sqlite3.Connection) -> bool:
+    return any(row[1] == "codec" for row in conn.execute("PRAGMA table_info(pdf_chunks)"))
+
+# Add the codec column to pdf_chunks tables created before compression existed
+def ensure_codec_column(conn: sqlite3.Connection) -> None:
+    if not has_codec_column(conn):
+        conn.execute("ALTER TABLE pdf_chunks ADD COLUMN codec TEXT")
+    conn.execute("""CREATE TABLE IF NOT EXISTS chunk_dictionaries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        dict_data BLOB NOT NULL)
+    """)
+
+def has_blob_column(conn: sqlite3.Connection) -> bool:
+    return any(row[1] == "blob_id" for row in conn.execute("PRAGMA table_info(pdf_chunks)"))
+
+# Add the blob_id column and the chunk_blobs table of content-addressed chunks
+def ensure_blob_column(conn: sqlite3.Connection) -> None:
+    if not has_blob_column(conn):
+        conn.execute("ALTER TABLE pdf_chunks ADD COLUMN blob_id INTEGER")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pdf_chunks_blob_id ON pdf_chunks (blob_id)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS chunk_blobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        content_hash TEXT NOT NULL UNIQUE,
+        chunk_text,
+        codec TEXT,
+        ref_count INTEGER NOT NULL DEFAULT 0)
+    """)
+
+# Column list selecting chunk text and codec of pdf_chunks rows, for databases with or
+# without the codec column, resolving blob references. Only valid in queries selecting
+# FROM pdf_chunks without an alias.
+def chunk_columns(conn: sqlite3.Connection) -> str:
+    if not has_codec_column(conn):
+        return "chunk_text, NULL"
+    if not has_blob_column(conn):
+        return "chunk_text, codec"
+    return """CASE WHEN pdf_chunks.blob_id IS NULL THEN chunk_text ELSE (SELECT b.chunk_text FROM chunk_blobs b WHERE b.id = pdf_chunks.blob_id) END,
+        CASE WHEN pdf_chunks.blob_id IS NULL THEN codec ELSE (SELECT b.codec FROM chunk_blobs b WHERE b.id = pdf_chunks.blob_id) END"""
+
+class ChunkEncoder:
+    """
+    Compresses chunk texts for storage in pdf_chunks.
+
+    An encoder is not thread-safe: give each writer thread or worker process its own.
+
+    :param codec: One of CODECS.
+    :param dictionary: (dict_id, dict_data) of a trained zstd dictionary, or None.
+    """
+
+    def __init__(self, codec: str = "none", dictionary: tuple[int, bytes] = None):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown chunk codec: {codec}")
+        self.codec = None if codec == "none" else codec
+        if codec == "zstd":
+            require_zstd()
+            if dictionary is not None:
+                dict_id, dict_data = dictionary
+                self.codec = f"zstd:{dict_id}"
+                self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=zstandard.ZstdCompressionDict(dict_data))
+            else:
+                self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+
+    # Return the (stored value, codec) pair of a chunk
+    def encode(self, text: str):
+        if self.codec is None:
+            return text, None
+        data = text.encode("utf-8")
+        if self.codec == "zlib":
+            return zlib.compress(data, ZLIB_LEVEL), self.codec
+        return self._compressor.compress(data), self.codec
+
+# Stored codec of most chunks of a database (None for plain text), blobs of a
+# deduplicated store included, or None if it has no chunks
+def store_codec(conn: sqlite3.Connection):
+    row = conn.execute("""
+        SELECT codec FROM (SELECT codec FROM pdf_chunks WHERE blob_id IS NULL UNION ALL SELECT codec FROM chunk_blobs)
+        GROUP BY codec ORDER BY COUNT(*) DESC LIMIT 1""").fetchone()
+    return None if row is None else row[0]
+
+# Encoder writing chunks with the codec a database already stores them with, including its zstd dictionary
+def store_encoder(conn: sqlite3.Connection) -> ChunkEncoder:
+    codec = store_codec(conn)
+    if codec is None:
+        return ChunkEncoder()
+    name, _, dict_id = codec.partition(":")
+    if not dict_id:
+        return ChunkEncoder(name)
+    row = conn.execute("SELECT dict_data FROM chunk_dictionaries WHERE id = ?", (int(dict_id),)).fetchone()
+    if row is None:
+        raise ValueError(f"Missing zstd dictionary {dict_id}")
+    return ChunkEncoder(name, (int(dict_id), row[0]))
+
+# Decompressors are cached per thread since zstd objects are not thread-safe
+_local = threading.local()
+
+def _zstd_decompressor(codec: str, conn: sqlite3.Connection):
+    require_zstd()
+    cache = getattr(_local, "decompressors", None)
+    if cache is None:
+        cache = _local.decompressors = {}
+    if codec not in cache:
+        _, _, dict_id = codec.partition(":")
+        if dict_id:
+            if conn is None:
+                raise ValueError(f"Decoding {codec} chunks needs a connection to load the dictionary")
+            row = conn.execute("SELECT dict_data FROM chunk_dictionaries WHERE id = ?", (int(dict_id),)).fetchone()
+            if row is None:
+                raise ValueError(f"Missing zstd dictionary {dict_id}")
+            cache[codec] = zstandard.ZstdDecompressor(dict_data=zstandard.ZstdCompressionDict(row[0]))
+        else:
+            cache[codec] = zstandard.ZstdDecompressor()
+    return cache[codec]
+
+def decode_chunk(value, codec, conn: sqlite3.Connection = None) -> str:
+    """
+    Return the text of a stored chunk, whatever codec it was stored with.
+
+    :param value: chunk_text column value.
+    :param codec: codec column value (None for plain text).
+    :param conn: Connection used to load zstd dictionaries, when needed.
+    """
+    if codec is None:
+        return value
+    if codec == "zlib":
+        return zlib.decompress(value).decode("utf-8")
+    if codec.startswith("zstd"):
+        return _zstd_decompressor(codec, conn).decompress(value).decode("utf-8")
+    raise ValueError(f"Unknown chunk codec: {codec}")
+
+# Column selecting the blob_id of pdf_chunks rows whose blob is referenced more than
+# once, NULL otherwise. Same restrictions as chunk_columns.
+def shared_blob_column(conn: sqlite3.Connection) -> str:
+    if not has_blob_column(conn):
+        return "NULL"
+    return "CASE WHEN (SELECT b.ref_count FROM chunk_blobs b WHERE b.id = pdf_chunks.blob_id) > 1 THEN pdf_chunks.blob_id END"
+
+# Text of every chunk returned by a "SELECT chunk_text, codec ..." query, decoded lazily
+def iter_decoded(rows, conn: sqlite3.Connection = None):
+    for value, codec in rows:
+        yield decode_chunk(value, codec, conn)
+
+# Text of a single chunk by id, or None if there is no such chunk
+def get_chunk(conn: sqlite3.Connection, chunk_id: int):
+    row = conn.execute(f"SELECT {chunk_columns(conn)} FROM pdf_chunks WHERE id = ?", (chunk_id,)).fetchone()
+    return None if row is None else decode_chunk(row[0], row[1], conn)
+
+def sample_chunks(conn: sqlite3.Connection, sample_size: int) -> list[str]:
+    rows = conn.execute(f"SELECT {chunk_columns(conn)} FROM pdf_chunks ORDER BY RANDOM() LIMIT ?", (sample_size,))
+    return list(iter_decoded(rows, conn))
+
+def train_dictionary(conn: sqlite3.Connection, sample_size: int = DICTIONARY_SAMPLE_CHUNKS, dict_size: int = DICTIONARY_SIZE) -> tuple[int, bytes]:
+    """
+    Train a zstd dictionary on a random sample of chunks and store it in chunk_dictionaries.
+
+    :return: (dict_id, dict_data) to pass to ChunkEncoder.
+    """
+    require_zstd()
+    samples = [chunk.encode("utf-8") for chunk in sample_chunks(conn, sample_size)]
+    dict_data = zstandard.train_dictionary(dict_size, samples).as_bytes()
+    with conn:
+        dict_id = conn.execute("INSERT INTO chunk_dictionaries (dict_data) VALUES (?)", (dict_data,)).lastrowid
+    logging.info(f"Trained zstd dictionary {dict_id} ({len(dict_data)} bytes) on {len(samples)} chunks.")
+    return dict_id, dict_data
+
+# Re-encode the (chunk_text, codec) values of a table, returns the number of rows rewritten
+def reencode_table(conn: sqlite3.Connection, table: str, encoder: ChunkEncoder, batch_size: int, condition: str = "1") -> int:
+    # Walk the table by id ranges so no read cursor stays open across the writes
+    migrated = 0
+    last_id = 0
+    while batch := conn.execute(f"""
+            SELECT id, chunk_text, codec FROM {table}
+            WHERE id > ? AND {condition} ORDER BY id LIMIT ?""", (last_id, batch_size)).fetchall():
+        last_id = batch[-1][0]
+        updates = [(*encoder.encode(decode_chunk(value, old_codec, conn)), row_id)
+                   for row_id, value, old_codec in batch if old_codec != encoder.codec]
+        with conn:
+            conn.executemany(f"UPDATE {table} SET chunk_text = ?, codec = ? WHERE id = ?", updates)
+        migrated += len(updates)
+    return migrated
+
+def migrate_chunk_store(db_name: str, codec: str, train_dict: bool = False, batch_size: int = 1000, vacuum: bool = True) -> None:
+    """
+    Re-encode every chunk of an existing database with the given codec.
+
+    Rows are rewritten in batches in id order, ids are unchanged. In a deduplicated
+    store the chunk_blobs rows are re-encoded instead of the rows referencing them. Use
+    codec "none" to go back to plain text. The database is vacuumed afterwards to
+    release the space.
+
+    :param db_name: Path to the chunk database.
+    :param codec: Target codec, one of CODECS.
+    :param train_dict: Train a zstd dictionary on a sample of chunks first (zstd only).
+    :param batch_size: Rows rewritten per transaction.
+    :param vacuum: Run VACUUM after the migration.
+    """
+    conn = sqlite3.connect(db_name)
+    try:
+        ensure_codec_column(conn)
+        ensure_blob_column(conn)
+        conn.commit()
+        dictionary = train_dictionary(conn) if train_dict and codec == "zstd" else None
+        encoder = ChunkEncoder(codec, dictionary)
+
+        migrated = reencode_table(conn, "pdf_chunks", encoder, batch_size, "blob_id IS NULL")
+        migrated += reencode_table(conn, "chunk_blobs", encoder, batch_size)
+
+        # Dictionaries of previous migrations are no longer referenced by any chunk, nor
+        # by the deleted chunks a full-text index has yet to decode to remove them
+        referenced = ["SELECT DISTINCT codec FROM pdf_chunks WHERE codec LIKE 'zstd:%'",
+                      "SELECT DISTINCT codec FROM chunk_blobs WHERE codec LIKE 'zstd:%'"]
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'pdf_chunks_fts_removed'").fetchone():
+            referenced.append("SELECT DISTINCT codec FROM pdf_chunks_fts_removed WHERE codec LIKE 'zstd:%'")
+        with conn:
+            conn.execute(f"DELETE FROM chunk_dictionaries WHERE 'zstd:' || id NOT IN ({' UNION '.join(referenced)})")
+        logging.info(f"Migrated {migrated} chunks to codec {codec}.")
+        print(f"Migrated {migrated} chunks to codec {encoder.codec or 'none'}.")
+
+        if vacuum:
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+def benchmark_chunk_store(db_name: str, sample_size: int = 5000) -> None:
+    """
+    Report the size reduction and decompression throughput of every available codec on
+    a sample of the chunks of a database.
+    """
+    conn = sqlite3.connect(db_name)
+    try:
+        chunks = sample_chunks(conn, sample_size)
+        raw_bytes = sum(len(chunk.encode("utf-8")) for chunk in chunks)
+        print(f"Sample: {len(chunks)} chunks, {raw_bytes / 1e6:.2f} MB of text")
+        if not chunks:
+            return
+
+        # (name, encoder, decoder) for every available codec
+        candidates = [("zlib", ChunkEncoder("zlib"), lambda value: decode_chunk(value, "zlib"))]
+        if zstandard is not None:
+            candidates.append(("zstd", ChunkEncoder("zstd"), lambda value: decode_chunk(value, "zstd")))
+            # The dictionary is trained on the sample itself and never stored
+            samples = [chunk.encode("utf-8") for chunk in chunks]
+            dictionary = zstandard.ZstdCompressionDict(zstandard.train_dictionary(DICTIONARY_SIZE, samples).as_bytes())
+            dict_decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+            candidates.append(("zstd+dict", ChunkEncoder("zstd", (0, dictionary.as_bytes())),
+                               lambda value: dict_decompressor.decompress(value).decode("utf-8")))
+
+        for name, encoder, decode in candidates:
+            encoded = [encoder.encode(chunk)[0] for chunk in chunks]
+            stored_bytes = sum(len(value) for value in encoded)
+            start = time.perf_counter()
+            for value in encoded:
+                decode(value)
+            elapsed = time.perf_counter() - start
+            print(f"{name:<10} {stored_bytes / 1e6:8.2f} MB  "
+                  f"{100 * (1 - stored_bytes / raw_bytes):5.1f}% smaller  "
+                  f"decompress {raw_bytes / elapsed / 1e6:8.1f} MB/s")
+    finally:
+        conn.close()
@@ -0,0 +1,80 @@
+import sqlite3
+from modules.chunk_codec import chunk_columns, decode_chunk
+
+# Finer chunk levels of pdf_chunks. Every chunk is split again at each granularity (a
+# chunk size, in characters, smaller than the one of pdf_chunks), coarsest first, so a
+# chunk of a level always lies inside its parent: the chunk with chunk_index
+# parent_index of the next coarser level of the file, or of pdf_chunks for the
+# coarsest one. Rows hold only the location of a chunk, its text is the slice of the
+# pdf_chunks chunk it lies in between its document offsets.
+LEVEL_COLUMNS = ("file_name", "granularity", "chunk_index", "parent_index", "start_page", "end_page", "start_offset", "end_offset")
+
+# Granularities of the levels below chunk_size, coarsest first
+def check_granularities(granularities, chunk_size: int) -> tuple[int, ...]:
+    for granularity in granularities:
+        if not 0 < granularity < chunk_size:
+            raise ValueError(f"Chunk level granularity {granularity} must be between 0 and the chunk size {chunk_size}")
+    return tuple(sorted(set(granularities), reverse=True))
+
+def create_level_table(conn: sqlite3.Connection, schema="main") -> None:
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {schema}.chunk_levels (
+        file_name TEXT NOT NULL,
+        granularity INTEGER NOT NULL,
+        chunk_index INTEGER NOT NULL,
+        parent_index INTEGER NOT NULL,
+        start_page INTEGER,
+        end_page INTEGER,
+        start_offset INTEGER NOT NULL,
+        end_offset INTEGER NOT NULL,
+        PRIMARY KEY (file_name, granularity, chunk_index))
+    """)
+    # Levels follow the chunks of their file when they are purged or the file is renamed
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {schema}.chunk_levels_delete AFTER DELETE ON pdf_chunks BEGIN
+        DELETE FROM chunk_levels WHERE file_name = old.file_name;
+    END""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {schema}.chunk_levels_rename AFTER UPDATE OF file_name ON pdf_chunks BEGIN
+        UPDATE chunk_levels SET file_name = new.file_name WHERE file_name = old.file_name;
+    END""")
+
+def store_levels(conn: sqlite3.Connection, file_name: str, rows: list[tuple]) -> None:
+    conn.executemany(f"INSERT OR REPLACE INTO chunk_levels ({', '.join(LEVEL_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                     ((file_name, *row) for row in rows))
+
+# Granularities of the levels of a file, coarsest first
+def file_granularities(conn: sqlite3.Connection, file_name: str) -> list[int]:
+    return [row[0] for row in conn.execute(
+        "SELECT DISTINCT granularity FROM chunk_levels WHERE file_name = ? ORDER BY granularity DESC", (file_name,))]
+
+def child_chunks(conn: sqlite3.Connection, chunk_id: int):
+    """
+    Chunks of every finer level lying in a chunk of pdf_chunks, to drill into a coarse
+    search hit.
+
+    :return: List of {'granularity', 'chunk_index', 'parent_index', 'start_page',
+             'end_page', 'start_offset', 'end_offset', 'text'} dicts, coarsest level
+             first and in document order within a level, or None if there is no such
+             chunk.
+    """
+    row = conn.execute(f"SELECT file_name, chunk_index, start_offset, {chunk_columns(conn)} FROM pdf_chunks WHERE id = ?", (chunk_id,)).fetchone()
+    if row is None:
+        return None
+    file_name, chunk_index, base, value, codec = row
+    if base is None:
+        return []
+    text = decode_chunk(value, codec, conn)
+
+    children = []
+    parents = [chunk_index]
+    for granularity in file_granularities(conn, file_name):
+        marks = ", ".join("?" * len(parents))
+        level = [dict(zip(LEVEL_COLUMNS[1:], row)) for row in conn.execute(f"""
+            SELECT {', '.join(LEVEL_COLUMNS[1:])} FROM chunk_levels
+            WHERE file_name = ? AND granularity = ? AND parent_index IN ({marks}) ORDER BY chunk_index""",
+            (file_name, granularity, *parents))]
+        for child in level:
+            child["text"] = text[child["start_offset"] - base:child["end_offset"] - base]
+        children.extend(level)
+        parents = [child["chunk_index"] for child in level]
+        if not parents:
+            break
+    return children
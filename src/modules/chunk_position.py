@@ -0,0 +1,83 @@
+import sqlite3
+from bisect import bisect_right
+from collections.abc import Generator, Iterable
+
+# Location columns of pdf_chunks: first and last page of a chunk, numbered from 1 as in
+# PDF viewers, and its [start, end) character offsets in the extracted text of the
+# whole document. NULL for chunks stored before locations were recorded.
+POSITION_COLUMNS = ("start_page", "end_page", "start_offset", "end_offset")
+NO_POSITION = (None, None, None, None)
+
+# Add the location columns to pdf_chunks tables created before they existed
+def ensure_position_columns(conn: sqlite3.Connection, schema="main") -> None:
+    columns = {row[1] for row in conn.execute(f"PRAGMA {schema}.table_info(pdf_chunks)")}
+    for column in POSITION_COLUMNS:
+        if column not in columns:
+            conn.execute(f"ALTER TABLE {schema}.pdf_chunks ADD COLUMN {column} INTEGER")
+
+class PageIndex:
+    """
+    Page boundaries of a document's text, built while its pages are read, mapping a
+    character offset to the page it falls on.
+    """
+
+    def __init__(self):
+        self.page_starts = []
+        self.length = 0
+
+    def add_page(self, page_text: str) -> None:
+        self.page_starts.append(self.length)
+        self.length += len(page_text)
+
+    # Pass pages through, recording their boundaries
+    def track(self, pages: Iterable[str]) -> Generator[str, None, None]:
+        for page_text in pages:
+            self.add_page(page_text)
+            yield page_text
+
+    # Page number of an offset; empty pages share their start with the next page, which wins
+    def page_of(self, offset: int) -> int:
+        return bisect_right(self.page_starts, offset)
+
+def locate_chunks(text: str, chunks: list[str], pages: PageIndex, base: int = 0) -> list[tuple]:
+    """
+    Locate chunks produced by the splitter in the text they were split from.
+
+    Chunks are stripped, non-overlapping substrings of the text in document order, so
+    each one is searched from the end of the previous one.
+
+    :param text: Text the chunks were split from.
+    :param chunks: Chunks of text, in order.
+    :param pages: Page index of the whole document.
+    :param base: Document offset of text, when it is a window of the document.
+    :return: (start_page, end_page, start_offset, end_offset) of every chunk.
+    """
+    positions = []
+    search_from = 0
+    for chunk in chunks:
+        start = text.find(chunk, search_from)
+        if start < 0:
+            positions.append(NO_POSITION)
+            continue
+        end = start + len(chunk)
+        positions.append((pages.page_of(base + start), pages.page_of(base + end - 1), base + start, base + end))
+        search_from = end
+    return positions
+
+def get_chunk_location(conn: sqlite3.Connection, chunk_id: int):
+    """
+    Source location of a chunk by id, a primary key lookup.
+
+    :return: {'file_name', 'chunk_index', 'start_page', 'end_page', 'start_offset',
+             'end_offset'}, or None if there is no such chunk.
+    """
+    row = conn.execute(f"SELECT file_name, chunk_index, {', '.join(POSITION_COLUMNS)} FROM pdf_chunks WHERE id = ?", (chunk_id,)).fetchone()
+    if row is None:
+        return None
+    return dict(zip(("file_name", "chunk_index", *POSITION_COLUMNS), row))
+
+# "p. 3" or "pp. 3-4", or "" when the chunk has no recorded location
+def format_pages(start_page, end_page) -> str:
+    if start_page is None:
+        return ""
+    return f"p. {start_page}" if start_page == end_page else f"pp. {start_page}-{end_page}"
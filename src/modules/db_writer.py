@@ -0,0 +1,211 @@
+import logging
+import sqlite3
+import threading
+import time
+from queue import Queue, Empty
+from modules.chunk_codec import ChunkEncoder
+from modules.chunk_position import NO_POSITION
+import modules.journal as journal
+import modules.text_cache as text_cache
+import modules.chunk_levels as chunk_levels
+
+# Marker pushed onto the queue to stop the writer thread
+_STOP = object()
+
+class ChunkWriter:
+    """
+    Single dedicated SQLite writer for chunk ingestion.
+
+    Extraction workers push the (file_name, chunk_index, chunk_text, position) records
+    of a file onto a bounded queue. One writer thread owns the only write connection, drains the
+    queue and inserts the records with executemany in large WAL-mode transactions, so
+    workers never contend for the database lock.
+
+    Records of one file are queued together and written in order, which keeps the ids
+    of a file contiguous in pdf_chunks. Files streamed in sub-batches are staged in a
+    temporary table and copied to pdf_chunks in one statement once finished, for the
+    same reason.
+
+    Journal state changes are queued on the same queue, so a file is only marked done
+    in the transaction that commits its last chunks. So are the chunk_levels rows of a
+    file and its text_cache row when its text is cached.
+
+    :param db_name: Path to the SQLite database holding pdf_chunks.
+    :param max_queue: Maximum number of files waiting to be written (default is 64).
+    :param batch_rows: Rows collected before a transaction is committed (default is 5000).
+    :param codec: Codec chunks are compressed with before they are written (default is "none").
+    """
+
+    def __init__(self, db_name: str, max_queue: int = 64, batch_rows: int = 5000, codec: str = "none"):
+        self.db_name = db_name
+        self.batch_rows = batch_rows
+        self.encoder = ChunkEncoder(codec)
+        self.queue = Queue(maxsize=max_queue)
+        self.error = None
+
+        # Commit statistics, only touched by the writer thread
+        self.batches = 0
+        self.rows = 0
+        self.total_commit_time = 0.0
+        self.max_commit_time = 0.0
+
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="ChunkWriter", daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # Start the writer thread and wait until its connection is set up
+    def start(self) -> None:
+        self._thread.start()
+        self._ready.wait()
+
+    def _put(self, op: str, payload) -> None:
+        if self.error is not None:
+            raise RuntimeError("Chunk writer stopped") from self.error
+        self.queue.put((op, payload))
+
+    # Queue all chunks of a file with their locations, blocks while the queue is full
+    def put_chunks(self, file_name: str, chunks: list[str], positions: list[tuple] = None) -> None:
+        positions = positions or [NO_POSITION] * len(chunks)
+        self._put("insert", [(file_name, index, chunk, position) for index, (chunk, position) in enumerate(zip(chunks, positions))])
+
+    # Queue a sub-batch of a streamed file, numbered from start_index
+    def stage_chunks(self, file_name: str, start_index: int, chunks: list[str], positions: list[tuple] = None) -> None:
+        positions = positions or [NO_POSITION] * len(chunks)
+        self._put("stage", [(file_name, start_index + index, chunk, position) for index, (chunk, position) in enumerate(zip(chunks, positions))])
+
+    # Queue the chunk_levels rows of a file, see extract_text.LevelSplitter
+    def put_levels(self, file_name: str, rows: list[tuple]) -> None:
+        self._put("levels", (file_name, rows))
+
+    # Move the staged chunks of a streamed file into pdf_chunks
+    def finish_file(self, file_name: str) -> None:
+        self._put("finish", file_name)
+
+    # Drop the staged chunks of a streamed file that failed midway
+    def discard_file(self, file_name: str) -> None:
+        self._put("discard", file_name)
+
+    # Queue the text_cache row of a file, see text_cache.cache_pages()
+    def cache_text(self, entry: tuple) -> None:
+        self._put("text", entry)
+
+    # Queue a journal state change of a file, committed in order with its chunks
+    def set_state(self, file_name: str, state: str, error: str = None) -> None:
+        self._put("journal", (file_name, state, error))
+
+    # Flush the remaining records and wait for the writer thread to exit
+    def close(self) -> None:
+        self.queue.put(_STOP)
+        self._thread.join()
+        logging.info(self.summary())
+        if self.error is not None:
+            raise RuntimeError("Chunk writer failed") from self.error
+
+    def summary(self) -> str:
+        average = self.total_commit_time / self.batches if self.batches else 0.0
+        return (f"Chunk writer: {self.rows} rows in {self.batches} batches, "
+                f"commit latency avg {average * 1000:.1f} ms, max {self.max_commit_time * 1000:.1f} ms")
+
+    def _collect_batch(self):
+        items = []
+        rows = 0
+        stop = False
+        item = self.queue.get()
+        while True:
+            if item is _STOP:
+                stop = True
+                break
+            items.append(item)
+            if item[0] in ("insert", "stage"):
+                rows += len(item[1])
+            elif item[0] == "levels":
+                rows += len(item[1][1])
+            if rows >= self.batch_rows:
+                break
+            try:
+                item = self.queue.get_nowait()
+            except Empty:
+                break
+        return items, stop
+
+    def _encode(self, records):
+        return [(file_name, index, *self.encoder.encode(chunk), *position) for file_name, index, chunk, position in records]
+
+    def _write_batch(self, conn, items) -> None:
+        rows = 0
+        start = time.perf_counter()
+        with conn:
+            for op, payload in items:
+                if op == "insert":
+                    conn.executemany(
+                        "INSERT INTO pdf_chunks (file_name, chunk_index, chunk_text, codec, start_page, end_page, start_offset, end_offset) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        self._encode(payload))
+                    rows += len(payload)
+                elif op == "stage":
+                    conn.executemany(
+                        "INSERT INTO temp.staged_chunks (file_name, chunk_index, chunk_text, codec, start_page, end_page, start_offset, end_offset) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        self._encode(payload))
+                elif op == "finish":
+                    rows += conn.execute("""
+                        INSERT INTO pdf_chunks (file_name, chunk_index, chunk_text, codec, start_page, end_page, start_offset, end_offset)
+                        SELECT file_name, chunk_index, chunk_text, codec, start_page, end_page, start_offset, end_offset FROM temp.staged_chunks
+                        WHERE file_name = ? ORDER BY chunk_index
+                    """, (payload,)).rowcount
+                    conn.execute("DELETE FROM temp.staged_chunks WHERE file_name = ?", (payload,))
+                elif op == "discard":
+                    conn.execute("DELETE FROM temp.staged_chunks WHERE file_name = ?", (payload,))
+                    conn.execute("DELETE FROM chunk_levels WHERE file_name = ?", (payload,))
+                elif op == "levels":
+                    chunk_levels.store_levels(conn, *payload)
+                elif op == "text":
+                    text_cache.store_entries(conn, [payload])
+                elif op == "journal":
+                    file_name, state, error = payload
+                    journal.update_states(conn, [file_name], state, error)
+        elapsed = time.perf_counter() - start
+
+        self.batches += 1
+        self.rows += rows
+        self.total_commit_time += elapsed
+        self.max_commit_time = max(self.max_commit_time, elapsed)
+        logging.info(f"Committed batch of {rows} chunks in {elapsed * 1000:.1f} ms")
+
+    def _run(self) -> None:
+        conn = sqlite3.connect(self.db_name, timeout=60)
+        stop = False
+        try:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            # Staged sub-batches of streamed files spill to disk instead of memory
+            conn.execute("PRAGMA temp_store = FILE")
+            conn.execute("""CREATE TEMP TABLE staged_chunks (
+                file_name TEXT,
+                chunk_index INTEGER,
+                chunk_text TEXT,
+                codec TEXT,
+                start_page INTEGER,
+                end_page INTEGER,
+                start_offset INTEGER,
+                end_offset INTEGER)
+            """)
+            conn.execute("CREATE INDEX temp.idx_staged_chunks ON staged_chunks (file_name, chunk_index)")
+            self._ready.set()
+            while not stop:
+                items, stop = self._collect_batch()
+                if items:
+                    self._write_batch(conn, items)
+        except Exception as e:
+            logging.error(f"Chunk writer error: {e}")
+            self.error = e
+            self._ready.set()
+            # Keep draining so producers blocked on a full queue can finish
+            while not stop:
+                stop = self.queue.get() is _STOP
+        finally:
+            conn.close()
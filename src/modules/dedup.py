@@ -0,0 +1,81 @@
+import hashlib
+import logging
+import sqlite3
+from modules.chunk_codec import decode_chunk, ensure_codec_column, ensure_blob_column
+import modules.search as search
+
+# Hash of the decoded chunk text, so the same text stored with different codecs matches
+def content_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+# A store is deduplicated once any chunk references a blob; ingests then keep it so
+def is_deduplicated(conn: sqlite3.Connection) -> bool:
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunk_blobs'").fetchone() is None:
+        return False
+    return conn.execute("SELECT 1 FROM chunk_blobs LIMIT 1").fetchone() is not None
+
+def dedup_chunk_store(conn: sqlite3.Connection, batch_size: int = 1000) -> dict:
+    """
+    Move the text of every inline pdf_chunks row into chunk_blobs, keyed by the hash of
+    its content, and turn the row into a reference to the blob. Identical chunks of
+    different files or editions are stored once.
+
+    Rows are converted in batches in id order, ids are unchanged. The stored value is
+    kept with its codec, so compressed chunks stay compressed. Reference counts are
+    refreshed and blobs no longer referenced by any row are deleted afterwards. A
+    full-text index is left alone, the text of the rows does not change.
+
+    :return: Dedup report, see dedup_report().
+    """
+    ensure_codec_column(conn)
+    ensure_blob_column(conn)
+    # Triggers of an index of an earlier version cannot follow rows turning into
+    # references, it is rebuilt with the current schema instead
+    rebuild_index = search.is_search_index_outdated(conn)
+    if rebuild_index:
+        search.drop_search_index(conn)
+    conn.commit()
+
+    converted = 0
+    last_id = 0
+    while batch := conn.execute("""
+            SELECT id, chunk_text, codec FROM pdf_chunks
+            WHERE id > ? AND blob_id IS NULL ORDER BY id LIMIT ?""", (last_id, batch_size)).fetchall():
+        last_id = batch[-1][0]
+        rows = [(chunk_id, content_hash(decode_chunk(value, codec, conn)), value, codec) for chunk_id, value, codec in batch]
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO chunk_blobs (content_hash, chunk_text, codec) VALUES (?, ?, ?)",
+                             [(digest, value, codec) for _, digest, value, codec in rows])
+            conn.executemany("""
+                UPDATE pdf_chunks SET blob_id = (SELECT id FROM chunk_blobs WHERE content_hash = ?), chunk_text = NULL, codec = NULL
+                WHERE id = ?""", [(digest, chunk_id) for chunk_id, digest, _, _ in rows])
+        converted += len(rows)
+
+    with conn:
+        conn.execute("""
+            UPDATE chunk_blobs SET ref_count = (SELECT COUNT(*) FROM pdf_chunks WHERE blob_id = chunk_blobs.id)""")
+        released = conn.execute("DELETE FROM chunk_blobs WHERE ref_count = 0").rowcount
+    if rebuild_index:
+        search.build_search_index(conn)
+
+    report = dedup_report(conn)
+    logging.info(f"Deduplicated {converted} chunks, released {released} unreferenced blobs: "
+                 f"{report['chunks']} chunks share {report['unique_chunks']} unique chunks.")
+    return report
+
+def dedup_report(conn: sqlite3.Connection) -> dict:
+    """
+    :return: {'chunks', 'unique_chunks', 'ratio', 'stored_bytes', 'saved_bytes'}: chunk rows,
+             distinct blobs, rows per blob, stored bytes of the blobs, and bytes the
+             duplicates would take if every row held its own copy.
+    """
+    chunks, unique_chunks, stored_bytes, saved_bytes = conn.execute("""
+        SELECT COALESCE(SUM(ref_count), 0), COUNT(*), COALESCE(SUM(LENGTH(CAST(chunk_text AS BLOB))), 0),
+               COALESCE(SUM((ref_count - 1) * LENGTH(CAST(chunk_text AS BLOB))), 0)
+        FROM chunk_blobs""").fetchone()
+    return {"chunks": chunks, "unique_chunks": unique_chunks, "ratio": chunks / unique_chunks if unique_chunks else 1.0,
+            "stored_bytes": stored_bytes, "saved_bytes": saved_bytes}
+
+def format_report(report: dict) -> str:
+    return (f"Dedup: {report['chunks']} chunks share {report['unique_chunks']} unique chunks "
+            f"(ratio {report['ratio']:.2f}, {report['stored_bytes'] / 1e6:.1f} MB stored, {report['saved_bytes'] / 1e6:.1f} MB saved).")
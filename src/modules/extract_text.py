@@ -1,13 +1,36 @@
 import logging
 import fitz  # PyMuPDF
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from collections import deque
+from functools import partial
+from itertools import islice
+import signal
 import sqlite3
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 import time
-from os import walk
-from os.path import basename, join
-from modules.path import log_file_path, chunk_database_path, pdf_path
-from collections.abc import Generator
+from os import getpid, makedirs, listdir, remove, cpu_count
+from os.path import basename, join, exists, getsize
+from modules.db_writer import ChunkWriter
+import modules.manifest as manifest
+import modules.journal as journal
+import modules.quarantine as quarantine
+import modules.watchdog as watchdog
+import modules.metrics as metrics
+from modules.autotune import Autotuner, batch_bytes
+from modules.chunk_codec import ChunkEncoder, ensure_codec_column
+from modules.chunk_position import PageIndex, NO_POSITION, locate_chunks, ensure_position_columns
+import modules.chunk_levels as chunk_levels
+import modules.search as search
+import modules.dedup as dedup
+import modules.scan as scan
+import modules.text_cache as text_cache
+from modules.text_cache import cache_pages, cached_page_source
+from modules.schedule import LptDispatcher, estimate_costs, lpt_order, schedule_report
+from modules.prefetch import Prefetcher, DEFAULT_PREFETCH_BYTES
+from modules.page_profile import PageProfile, iter_page_numbers
+from modules.path import log_file_path, chunk_database_path, shard_folder_path
+from collections.abc import Generator, Iterable
 
 # Setup logging to log messages to a file, with the option to reset the log file
 def setup_logging(log_file= log_file_path):
@@ -19,8 +42,6 @@ def setup_logging(log_file= log_file_path):
         filemode='a'  # This will overwrite the log file each time the script runs
     )
 
-setup_logging()
-
 # Retry decorator with configurable retries and delays
 def retry_on_exception(retries=99, delay=5, retry_exceptions=(Exception,), log_message=None):
     def decorator(func):
@@ -32,49 +53,460 @@ def retry_on_exception(retries=99, delay=5, retry_exceptions=(Exception,), log_m
                     if attempt < retries - 1:
                         if log_message:
                             logging.warning(f"{log_message}. Attempt {attempt + 1}/{retries}, retrying in {delay} seconds...")
+                        metrics.current_span().add_retry(delay)
                         time.sleep(delay)
                     else:
                         raise
         return wrapper
     return decorator
 
-# Function to extract text from a PDF file
-def extract_text_from_pdf(pdf_file):
-    logging.info(f"Extracting text from {pdf_file}...")
-    text = ""
+# Generator yielding the text of a PDF file one page at a time, optionally limited to [start, end).
+# With data, the file is opened from the bytes already read instead of its path. With a
+# profile, the pages it skips are yielded as empty text, see page_profile.iter_page_numbers().
+# Errors are logged and raised, so the file fails in the journal and is quarantined.
+def iter_pdf_pages(pdf_file, start=0, end=None, data: bytes = None, profile: PageProfile = None) -> Generator[str, None, None]:
     try:
-        doc = fitz.open(pdf_file)
-        for page_num in range(len(doc)):
+        span = metrics.current_span()
+        started = span.clock()
+        doc = fitz.open(pdf_file) if data is None else fitz.open(stream=data, filetype="pdf")
+        span.add("open", started)
+        for page_num in iter_page_numbers(doc, start, end, profile):
+            if page_num is None:
+                yield ""
+                continue
             page = doc.load_page(page_num)
             page_text = page.get_text()
-            logging.debug(f"Extracted text from page {page_num} of {pdf_file}: {page_text[:50]}...")
-            text += page_text
-    except fitz.fitz_error as e:
+            # Lazy arguments: nothing is formatted unless debug logging is on
+            logging.debug("Extracted text from page %d of %s: %.50s...", page_num, pdf_file, page_text)
+            yield page_text
+    except RuntimeError as e:
+        # MuPDF errors derive from RuntimeError in every PyMuPDF release
         logging.error(f"MuPDF error in {pdf_file}: {e}")
+        raise
     except Exception as e:
         logging.error(f"Error extracting text from {pdf_file}: {e}")
+        raise
     finally:
         if 'doc' in locals():
             doc.close()
+
+# Page source opening a PDF file from the buffer a prefetcher read ahead, or by path on a miss
+def iter_prefetched_pages(pdf_file, prefetcher: Prefetcher, profile: PageProfile = None) -> Generator[str, None, None]:
+    return iter_pdf_pages(pdf_file, data=prefetcher.take(pdf_file), profile=profile)
+
+def signed_pages(pdf_file, pages: Iterable[str], sink, text_sink=None) -> Generator[str, None, None]:
+    """
+    Pass the pages of a PDF file through, handing its manifest signature to
+    sink(pdf_file, signature) once every page was read, so a run records the files it
+    extracted without reading them again afterwards. The worker hashes the file right
+    before its pages are read, like text_cache.cache_pages(); with text_sink the text
+    is cached under the same hash instead of hashing the file twice.
+    """
+    try:
+        signature = manifest.file_signature(pdf_file)
+    except OSError as e:
+        logging.warning(f"Cannot hash {pdf_file}: {e}")
+        yield from pages if text_sink is None else cache_pages(pdf_file, pages, text_sink)
+        return
+    if text_sink is not None:
+        pages = cache_pages(pdf_file, pages, text_sink, content_hash=signature[2])
+    yield from pages
+    sink(pdf_file, signature)
+
+# Page source signing every file it reads, see signed_pages()
+def signed_page_source(pdf_file, page_source, sink, text_sink=None) -> Generator[str, None, None]:
+    return signed_pages(pdf_file, page_source(pdf_file), sink, text_sink)
+
+# Default number of pages per range when a large PDF file is split across processes
+DEFAULT_PAGES_PER_RANGE = 100
+
+# Worker task: text of the pages [start, end) of a PDF file
+def extract_page_range(pdf_file, start, end) -> list[str]:
+    return list(iter_pdf_pages(pdf_file, start, end))
+
+def count_pdf_pages(pdf_file) -> int:
+    try:
+        with fitz.open(pdf_file) as doc:
+            return doc.page_count
+    except Exception as e:
+        logging.error(f"Error reading page count of {pdf_file}: {e}")
+        return 0
+
+# Queue the page ranges of a PDF file on a process pool, in page order
+def submit_page_ranges(pdf_file, page_count, executor: ProcessPoolExecutor, pages_per_range=DEFAULT_PAGES_PER_RANGE):
+    return [executor.submit(extract_page_range, pdf_file, start, min(start + pages_per_range, page_count))
+            for start in range(0, page_count, pages_per_range)]
+
+# Generator reassembling the pages of submitted ranges in document order
+def iter_page_ranges(futures) -> Generator[str, None, None]:
+    try:
+        for future in futures:
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+def iter_document_pages(pdf_file, page_pool: ProcessPoolExecutor = None, page_threshold=None, pages_per_range=DEFAULT_PAGES_PER_RANGE,
+                        page_source=iter_pdf_pages):
+    """
+    Page source of a PDF file: documents longer than page_threshold pages are split into
+    ranges of pages_per_range pages extracted concurrently on page_pool, and their pages
+    are yielded back in order so chunk indices stay deterministic. Other documents are
+    read page by page with page_source in the calling worker.
+    """
+    if page_pool is not None and page_threshold is not None:
+        page_count = count_pdf_pages(pdf_file)
+        if page_count > page_threshold:
+            logging.info(f"Splitting {pdf_file} ({page_count} pages) into ranges of {pages_per_range} pages.")
+            return iter_page_ranges(submit_page_ranges(pdf_file, page_count, page_pool, pages_per_range))
+    return page_source(pdf_file)
+
+# Function to extract text from a PDF file, recording page boundaries in page_index if given
+def extract_text_from_pdf(pdf_file, page_source=iter_pdf_pages, page_index: PageIndex = None):
+    logging.info(f"Extracting text from {pdf_file}...")
+    pages = page_source(pdf_file)
+    text = "".join(pages if page_index is None else page_index.track(pages))
     logging.info(f"Finished extracting text from {pdf_file}.")
     return text
 
+# Separator hierarchy of langchain's RecursiveCharacterTextSplitter
+DEFAULT_SEPARATORS = ("\n\n", "\n", " ", "")
+
+# Split on a separator, keeping it at the start of every piece but the first
+def _split_keep_separator(text, separator):
+    if not separator:
+        return list(text)
+    parts = text.split(separator)
+    pieces = [parts[0]] + [separator + part for part in parts[1:]]
+    return [piece for piece in pieces if piece]
+
+# Greedily merge pieces into chunks of at most chunk_size characters
+def _merge_pieces(pieces, chunk_size, chunk_overlap):
+    chunks = []
+    current = deque()
+    total = 0
+    for piece in pieces:
+        length = len(piece)
+        if total + length > chunk_size and current:
+            chunk = "".join(current).strip()
+            if chunk:
+                chunks.append(chunk)
+            # Keep the tail of the previous chunk as overlap
+            while total > chunk_overlap or (total + length > chunk_size and total > 0):
+                total -= len(current.popleft())
+        current.append(piece)
+        total += length
+    chunk = "".join(current).strip()
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def native_split_text(text, chunk_size, chunk_overlap=0, separators=DEFAULT_SEPARATORS):
+    """
+    Split text into chunks without langchain.
+
+    Same algorithm and boundaries as RecursiveCharacterTextSplitter with its defaults
+    (separators kept at the start of the next piece, whitespace stripped): the text is
+    split on the first separator it contains, pieces shorter than chunk_size are merged
+    greedily and longer ones are split again with the remaining separators. Only the
+    oversized pieces are visited again, so every character is scanned at most once per
+    separator level.
+
+    :param text: Text to split.
+    :param chunk_size: Maximum number of characters per chunk.
+    :param chunk_overlap: Characters shared between consecutive chunks (default is 0).
+    :param separators: Separators to try, from coarsest to finest.
+    :return: List of text chunks.
+    """
+    separator = separators[-1]
+    remaining = ()
+    for i, candidate in enumerate(separators):
+        if not candidate:
+            separator = candidate
+            break
+        if candidate in text:
+            separator = candidate
+            remaining = separators[i + 1:]
+            break
+
+    chunks = []
+    small_pieces = []
+    for piece in _split_keep_separator(text, separator):
+        if len(piece) < chunk_size:
+            small_pieces.append(piece)
+            continue
+        if small_pieces:
+            chunks.extend(_merge_pieces(small_pieces, chunk_size, chunk_overlap))
+            small_pieces = []
+        if remaining:
+            chunks.extend(native_split_text(piece, chunk_size, chunk_overlap, remaining))
+        else:
+            chunks.append(piece)
+    if small_pieces:
+        chunks.extend(_merge_pieces(small_pieces, chunk_size, chunk_overlap))
+    return chunks
+
 # Function to split text into chunks
 def split_text_into_chunks(text, chunk_size):
     logging.info(f"Splitting text into chunks of {chunk_size} characters...")
     if not isinstance(text, str):
         logging.error(f"Expected text to be a string but got {type(text)}: {text}")
         return []
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=0)
     try:
-        chunks = text_splitter.split_text(text)
-        logging.debug(f"First chunk: {chunks[0][:50]}..." if chunks else "No chunks.")
+        chunks = native_split_text(text, chunk_size)
+        if chunks:
+            logging.debug("First chunk: %.50s...", chunks[0])
     except Exception as e:
         logging.error(f"Error splitting text: {e}")
         chunks = []
     logging.info("Finished splitting text into chunks.")
     return chunks
 
+# Characters of page text buffered per worker for every byte of memory budget. A str
+# takes up to 4 bytes per character and the splitter holds one more copy while splitting.
+BYTES_PER_BUFFERED_CHAR = 8
+
+# Default per-worker memory budget of the streaming mode, in bytes
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024
+
+# Size of the page text window for a memory budget, never less than two chunks
+def stream_window_size(chunk_size, memory_budget=DEFAULT_MEMORY_BUDGET):
+    return max(2 * chunk_size, memory_budget // BYTES_PER_BUFFERED_CHAR)
+
+class _SplitLevel:
+    """
+    One separator level of StreamSplitter, splitting an open region of the document
+    on its separator as native_split_text() does: small pieces are merged greedily,
+    and a piece known to be large hands its text to a child level for the remaining
+    separators. Offsets are document offsets.
+    """
+
+    def __init__(self, separators, start):
+        self.separator = separators[0]
+        self.remaining = separators[1:]
+        # Where the next separator is searched from, and the piece it would end
+        self.scan = start
+        self.piece_start = start
+        # Start of the run of small pieces being merged, None when it is empty
+        self.run_start = None
+        # Level splitting the current piece once it is known to be large
+        self.child = None
+
+    # Earliest document offset whose text the level still needs
+    def needed(self) -> int:
+        if self.child is not None:
+            return self.child.needed()
+        return self.piece_start if self.run_start is None else self.run_start
+
+    def feed(self, text, base, limit, end, chunk_size, out) -> None:
+        """
+        Split the region as far as its text is known.
+
+        :param text: Text of the document from offset base.
+        :param limit: Offset up to which the region's text is known.
+        :param end: Offset the region ends at, None while it goes on.
+        :param out: List the finished (chunk, start offset) pairs are appended to.
+        """
+        if not self.separator:
+            self._feed_characters(text, base, limit if end is None else end, end, chunk_size, out)
+            return
+        width = len(self.separator)
+        while True:
+            found = text.find(self.separator, max(self.scan, base) - base, limit - base)
+            if found >= 0:
+                found += base
+            else:
+                # No separator starts before this offset, whatever text comes next
+                self.scan = max(self.scan, limit - width + 1)
+            if self.child is not None:
+                if found < 0:
+                    self.child.feed(text, base, limit if end is not None else limit - width + 1, end, chunk_size, out)
+                    if end is None:
+                        return
+                    self.child = None
+                    self.piece_start = end
+                    return
+                self.child.feed(text, base, found, found, chunk_size, out)
+                self.child = None
+            elif found >= 0:
+                self._add_piece(text, base, self.piece_start, found, chunk_size, out)
+            elif end is not None:
+                self._add_piece(text, base, self.piece_start, end, chunk_size, out)
+                self._flush(text, base, end, out)
+                self.piece_start = end
+                return
+            else:
+                # A piece already longer than a chunk is large wherever it ends
+                if self.remaining and limit - width + 1 - self.piece_start >= chunk_size:
+                    self._flush(text, base, self.piece_start, out)
+                    self.child = _SplitLevel(self.remaining, self.piece_start)
+                    continue
+                return
+            self.piece_start = found
+            self.scan = found + width
+
+    # Every character is a piece of the empty separator
+    def _feed_characters(self, text, base, stop, end, chunk_size, out) -> None:
+        if self.run_start is None and self.piece_start < stop:
+            self.run_start = self.piece_start
+        while self.run_start is not None and self.run_start + chunk_size < stop:
+            self._emit(text, base, self.run_start, self.run_start + chunk_size, out)
+            self.run_start += chunk_size
+        self.piece_start = stop
+        if end is not None:
+            self._flush(text, base, end, out)
+
+    def _add_piece(self, text, base, start, stop, chunk_size, out) -> None:
+        if stop - start < chunk_size:
+            if self.run_start is None:
+                self.run_start = start
+            elif stop - self.run_start > chunk_size:
+                self._emit(text, base, self.run_start, start, out)
+                self.run_start = start
+            return
+        self._flush(text, base, start, out)
+        if self.remaining:
+            _SplitLevel(self.remaining, start).feed(text, base, stop, stop, chunk_size, out)
+        else:
+            out.append((text[start - base:stop - base], start))
+
+    def _flush(self, text, base, stop, out) -> None:
+        if self.run_start is not None:
+            self._emit(text, base, self.run_start, stop, out)
+            self.run_start = None
+
+    @staticmethod
+    def _emit(text, base, start, stop, out) -> None:
+        piece = text[start - base:stop - base]
+        chunk = piece.strip()
+        if chunk:
+            out.append((chunk, start + len(piece) - len(piece.lstrip())))
+
+class StreamSplitter:
+    """
+    native_split_text() over a document given window by window, with the chunks and
+    offsets it gives for the whole text.
+
+    Splitting each window on its own would pick separators and piece boundaries from
+    the window alone. Instead a level per separator keeps the open piece it is in
+    across windows: the document is always split on the first separator (a region
+    without it is a single piece, which native_split_text() splits the same way), and
+    a piece that reached chunk_size characters is large wherever it ends, so its text
+    is split at the next level before its end is read. Only the open pieces and runs
+    are kept, see needed().
+
+    :param chunk_size: Maximum number of characters per chunk.
+    :param separators: Separators to try, from coarsest to finest.
+    """
+
+    def __init__(self, chunk_size, separators=DEFAULT_SEPARATORS):
+        self.chunk_size = chunk_size
+        self.root = _SplitLevel(separators, 0)
+
+    def split(self, text, base, final=False) -> list[tuple[str, int]]:
+        """
+        Chunks finished by the next window of the document.
+
+        :param text: Text of the document from offset base, starting at or before needed().
+        :param final: Whether the text runs to the end of the document.
+        :return: List of (chunk, start offset) in document order.
+        """
+        out = []
+        limit = base + len(text)
+        self.root.feed(text, base, limit, limit if final else None, self.chunk_size, out)
+        return out
+
+    # Earliest document offset the next window must start at
+    def needed(self) -> int:
+        return self.root.needed()
+
+def iter_located_chunks(pages, chunk_size, window_size, page_index: PageIndex = None) -> Generator[tuple[str, tuple], None, None]:
+    """
+    Incrementally split a stream of page texts into chunks.
+
+    Pages are buffered until window_size characters are pending, then the buffer is
+    handed to a StreamSplitter, which emits the chunks it finished, and the text the
+    splitter still needs is carried over as the start of the next buffer. Chunks and
+    locations are identical to those of the text joined and split at once.
+
+    :param pages: Iterable of page texts.
+    :param chunk_size: Maximum number of characters per chunk.
+    :param window_size: Number of buffered characters that triggers a split.
+    :param page_index: Page index the page boundaries are recorded in, if given.
+    :yield: (chunk, position) in document order, see chunk_position.locate_chunks().
+    """
+    page_index = page_index if page_index is not None else PageIndex()
+    splitter = StreamSplitter(chunk_size)
+    buffer = []
+    buffered = 0
+    # Document offset of the buffer start
+    base = 0
+    span = metrics.current_span()
+
+    def located(chunks):
+        for chunk, start in chunks:
+            end = start + len(chunk)
+            yield chunk, (page_index.page_of(start), page_index.page_of(end - 1), start, end)
+
+    for page_text in page_index.track(pages):
+        buffer.append(page_text)
+        buffered += len(page_text)
+        if buffered < window_size:
+            continue
+        text = "".join(buffer)
+        started = span.clock()
+        chunks = splitter.split(text, base)
+        span.add("split", started)
+        yield from located(chunks)
+        tail = splitter.needed() - base
+        buffer = [text[tail:]] if tail < len(text) else []
+        buffered = len(text) - tail
+        base += tail
+
+    text = "".join(buffer)
+    started = span.clock()
+    chunks = splitter.split(text, base, final=True)
+    span.add("split", started)
+    yield from located(chunks)
+
+class LevelSplitter:
+    """
+    Splits the chunks of a document again at finer granularities, for chunk_levels.
+
+    Each level is split from the chunks of the next coarser one, so every chunk lies in
+    its parent and the text is only scanned once per level. Chunk indices of a level
+    run on across calls, for documents whose chunks come in sub-batches.
+
+    :param granularities: Chunk sizes of the levels, coarsest first, see chunk_levels.check_granularities().
+    :param page_index: Page index of the whole document.
+    """
+
+    def __init__(self, granularities, page_index: PageIndex):
+        self.granularities = list(granularities)
+        self.page_index = page_index
+        self.counts = [0] * len(self.granularities)
+
+    # chunk_levels rows of chunks numbered from start_index, without their file name
+    def split(self, chunks: list[str], positions: list[tuple], start_index: int = 0) -> list[tuple]:
+        rows = []
+        span = metrics.current_span()
+        started = span.clock()
+        parents = [(start_index + index, chunk, position[2]) for index, (chunk, position) in enumerate(zip(chunks, positions))
+                   if position[2] is not None]
+        for level, granularity in enumerate(self.granularities):
+            children = []
+            for parent_index, text, base in parents:
+                pieces = native_split_text(text, granularity)
+                for piece, position in zip(pieces, locate_chunks(text, pieces, self.page_index, base)):
+                    if position[2] is None:
+                        continue
+                    rows.append((granularity, self.counts[level], parent_index, *position))
+                    children.append((self.counts[level], piece, position[2]))
+                    self.counts[level] += 1
+            parents = children
+        span.add("split", started)
+        return rows
+
 # Reusable database operation with retry logic
 @retry_on_exception(retries=999, delay=5, retry_exceptions=(sqlite3.OperationalError,), log_message="Database is locked")
 def execute_db_operation(db_name, operation, *args):
@@ -87,51 +519,241 @@ def execute_db_operation(db_name, operation, *args):
         conn.close()
 
 # Function to store text chunks in the SQLite database
-def store_chunks_in_db(file_name, chunks, db_name):
+def store_chunks_in_db(file_name, chunks, db_name, positions=None):
     def _store_chunks(cursor, file_name, chunks):
         for index, chunk in enumerate(chunks):
             cursor.execute('''
-                INSERT INTO pdf_chunks (file_name, chunk_index, chunk_text) VALUES (?, ?, ?)
-            ''', (basename(file_name), index, chunk))
+                INSERT INTO pdf_chunks (file_name, chunk_index, chunk_text, start_page, end_page, start_offset, end_offset) VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (basename(file_name), index, chunk, *(positions[index] if positions else NO_POSITION)))
     
     execute_db_operation(db_name, _store_chunks, file_name, chunks)
     logging.info(f"Stored {len(chunks)} chunks for {file_name} in the database.")
 
+# Files submitted to the pool per batch when batch sizes are not autotuned
+DEFAULT_BATCH_SIZE = 100
+
+# Default (min, max) files per batch when batch sizes are autotuned
+DEFAULT_BATCH_BOUNDS = (10, 500)
+
+# Default (min, max) worker count when it is autotuned: threads mostly wait on reads from
+# slow disks and can outnumber the cores, processes cannot
+def default_worker_bounds(mode: str) -> tuple[int, int]:
+    cores = cpu_count() or 1
+    return (1, cores) if mode == "process" else (1, 4 * cores)
+
+# Default seconds a watchdog worker may spend reading one PDF file
+DEFAULT_FILE_TIMEOUT = 300.0
+
+# Journal error text of a failed file, "<error class>: <message>"
+def describe_error(e: Exception) -> str:
+    return f"{getattr(e, 'error_class', type(e).__name__)}: {e}"
+
 # Function to extract, split, and store text from a PDF file
-def extract_split_and_store_pdf(pdf_file, chunk_size, db_name):
+def extract_split_and_store_pdf(pdf_file, chunk_size, db_name, writer: ChunkWriter = None, page_source=iter_pdf_pages, granularities=()):
+    with metrics.file_span(pdf_file) as span:
+        _extract_split_and_store_pdf(pdf_file, chunk_size, db_name, writer, page_source, granularities, span)
+
+def _extract_split_and_store_pdf(pdf_file, chunk_size, db_name, writer, page_source, granularities, span):
+    if writer is not None:
+        writer.set_state(pdf_file, journal.IN_PROGRESS)
     try:
-        text = extract_text_from_pdf(pdf_file)
+        page_index = PageIndex()
+        text = extract_text_from_pdf(pdf_file, lambda f: metrics.timed_pages(span, page_source(f)), page_index)
+        started = span.clock()
+        chunks = split_text_into_chunks(text, chunk_size=chunk_size) if text else []
+        positions = locate_chunks(text, chunks, page_index)
+        span.add("split", started)
+        levels = LevelSplitter(granularities, page_index).split(chunks, positions) if granularities and writer is not None else None
+        span.count_chunks(len(chunks))
+        started = span.clock()
         if not text:
             logging.warning(f"No text extracted from {pdf_file}.")
-            return
-        chunks = split_text_into_chunks(text, chunk_size=chunk_size)
-        if not chunks:
+        elif not chunks:
             logging.warning(f"No chunks created for {pdf_file}.")
-            return
-        store_chunks_in_db(pdf_file, chunks, db_name)
+        elif writer is not None:
+            writer.put_chunks(pdf_file, chunks, positions)
+            if levels:
+                writer.put_levels(pdf_file, levels)
+        else:
+            store_chunks_in_db(pdf_file, chunks, db_name, positions)
+        span.add("store", started)
+    except Exception as e:
+        logging.error(f"Error processing {pdf_file}: {e}")
+        if writer is not None:
+            writer.set_state(pdf_file, journal.FAILED, describe_error(e))
+        return
+    if writer is not None:
+        writer.set_state(pdf_file, journal.DONE)
+
+# Extract, split and store a PDF file page by page, keeping memory bounded by the window size
+def extract_split_and_stream_pdf(pdf_file, chunk_size, writer: ChunkWriter, memory_budget=DEFAULT_MEMORY_BUDGET, page_source=iter_pdf_pages,
+                                granularities=()):
+    with metrics.file_span(pdf_file) as span:
+        _extract_split_and_stream_pdf(pdf_file, chunk_size, writer, memory_budget, page_source, granularities, span)
+
+def _extract_split_and_stream_pdf(pdf_file, chunk_size, writer, memory_budget, page_source, granularities, span):
+    logging.info(f"Streaming text from {pdf_file}...")
+    writer.set_state(pdf_file, journal.IN_PROGRESS)
+    window_size = stream_window_size(chunk_size, memory_budget)
+    page_index = PageIndex()
+    level_splitter = LevelSplitter(granularities, page_index) if granularities else None
+    sub_batch = []
+    sub_positions = []
+    sub_batch_chars = 0
+    chunk_count = 0
+    try:
+        for chunk, position in iter_located_chunks(metrics.timed_pages(span, page_source(pdf_file)), chunk_size, window_size, page_index):
+            sub_batch.append(chunk)
+            sub_positions.append(position)
+            sub_batch_chars += len(chunk)
+            if sub_batch_chars >= window_size:
+                levels = level_splitter.split(sub_batch, sub_positions, chunk_count) if level_splitter else None
+                started = span.clock()
+                writer.stage_chunks(pdf_file, chunk_count, sub_batch, sub_positions)
+                if levels:
+                    writer.put_levels(pdf_file, levels)
+                span.add("store", started)
+                chunk_count += len(sub_batch)
+                sub_batch = []
+                sub_positions = []
+                sub_batch_chars = 0
+        if sub_batch:
+            levels = level_splitter.split(sub_batch, sub_positions, chunk_count) if level_splitter else None
+            started = span.clock()
+            writer.stage_chunks(pdf_file, chunk_count, sub_batch, sub_positions)
+            if levels:
+                writer.put_levels(pdf_file, levels)
+            span.add("store", started)
+            chunk_count += len(sub_batch)
     except Exception as e:
         logging.error(f"Error processing {pdf_file}: {e}")
+        span.count_chunks(chunk_count)
+        writer.discard_file(pdf_file)
+        writer.set_state(pdf_file, journal.FAILED, describe_error(e))
+        return
+
+    span.count_chunks(chunk_count)
+    if not chunk_count:
+        logging.warning(f"No chunks created for {pdf_file}.")
+    else:
+        writer.finish_file(pdf_file)
+        logging.info(f"Streamed {chunk_count} chunks for {pdf_file}.")
+    writer.set_state(pdf_file, journal.DONE)
 
 # Store text chunks in the SQLite database
-def store_chunks_in_db(file_name, chunks, db_name):
+def store_chunks_in_db(file_name, chunks, db_name, positions=None):
     def _store_chunks(cursor, file_name, chunks):
         for index, chunk in enumerate(chunks):
             cursor.execute('''
-                INSERT INTO pdf_chunks (file_name, chunk_index, chunk_text) VALUES (?, ?, ?)
-            ''', (file_name, index, chunk))
+                INSERT INTO pdf_chunks (file_name, chunk_index, chunk_text, start_page, end_page, start_offset, end_offset) VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (file_name, index, chunk, *(positions[index] if positions else NO_POSITION)))
     
     execute_db_operation(db_name, _store_chunks, file_name, chunks)
     logging.info(f"Stored {len(chunks)} chunks for {file_name} in the database.")
 
-# Process multiple PDF files concurrently
-def process_files_in_parallel(pdf_files: str, chunk_size: int, db_name: str) -> None:
-    total_files = len(pdf_files)
+# Cancel the futures that have not started yet once a stop is requested
+def cancel_pending(futures, stop_event: threading.Event = None) -> bool:
+    if stop_event is None or not stop_event.is_set():
+        return False
+    for future in futures:
+        future.cancel()
+    return True
+
+# Default estimated bytes of the files submitted to the thread pool and not finished yet
+DEFAULT_IN_FLIGHT_BYTES = 256 * 1024 * 1024
+
+# Smallest estimate of a file, so a folder of tiny files does not flood the pool queue
+MIN_FILE_ESTIMATE = 64 * 1024
+
+# Seconds between checks for a stop request while waiting on the files in flight
+STOP_POLL_INTERVAL = 0.2
 
-    with ThreadPoolExecutor() as executor:
-        future_to_file = {executor.submit(extract_split_and_store_pdf, pdf_file, chunk_size, db_name): pdf_file for pdf_file in pdf_files}
+# Memory a file takes while it is processed, estimated from its size on disk
+def estimate_file_bytes(pdf_file) -> int:
+    try:
+        return max(getsize(pdf_file), MIN_FILE_ESTIMATE)
+    except OSError:
+        return MIN_FILE_ESTIMATE
+
+def submit_bounded(submit, files: Iterable[str], max_in_flight_bytes=DEFAULT_IN_FLIGHT_BYTES,
+                   stop_event: threading.Event = None, max_in_flight_files: int = None) -> Generator[tuple, None, None]:
+    """
+    Submit files as earlier ones complete, keeping the estimated bytes of the files in
+    flight within max_in_flight_bytes. A file larger than the budget is submitted
+    alone. Files are drawn from the iterable only when there is room for them, and no
+    file waits for a whole batch to finish.
+
+    :param submit: Function submitting a file, returning its future.
+    :param files: Iterable of file paths, consumed lazily.
+    :param max_in_flight_bytes: Budget of estimated bytes, see estimate_file_bytes().
+    :param stop_event: Once set, no more files are submitted and the submitted files
+                       that have not started are cancelled; the running ones finish.
+    :param max_in_flight_files: Limit on the number of files in flight as well; no file is
+                                drawn from the iterable while it is reached.
+    :yield: (pdf_file, future) of every file in completion order, cancelled ones included.
+    """
+    files = iter(files)
+    in_flight = {}
+    in_flight_bytes = 0
+    next_file = None
+    while True:
+        while stop_event is None or not stop_event.is_set():
+            # A dispatcher choosing files by the running ones must not be drawn from before a worker is free
+            if len(in_flight) == max_in_flight_files:
+                break
+            if next_file is None:
+                pdf_file = next(files, None)
+                if pdf_file is None:
+                    break
+                next_file = (pdf_file, estimate_file_bytes(pdf_file))
+            if in_flight and in_flight_bytes + next_file[1] > max_in_flight_bytes:
+                break
+            in_flight[submit(next_file[0])] = next_file
+            in_flight_bytes += next_file[1]
+            next_file = None
+        if not in_flight:
+            return
+        done, _ = wait(in_flight, timeout=None if stop_event is None else STOP_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+        if cancel_pending(in_flight, stop_event):
+            done, _ = wait(in_flight, timeout=0)
+        for future in done:
+            pdf_file, estimate = in_flight.pop(future)
+            in_flight_bytes -= estimate
+            yield pdf_file, future
 
-        for future in as_completed(future_to_file):
-            pdf_file = future_to_file[future]
+# Process multiple PDF files concurrently, submitting them as earlier ones finish. Files
+# drawn from an LptDispatcher are only submitted to free workers, in its order; the
+# prefetcher reads its upcoming files without drawing them.
+def process_files_in_parallel(pdf_files: Iterable[str], chunk_size: int, db_name: str, workers: int = None, writer: ChunkWriter = None, memory_budget: int = None, page_source=iter_pdf_pages,
+                              stop_event: threading.Event = None, max_in_flight_bytes: int = DEFAULT_IN_FLIGHT_BYTES,
+                              prefetcher: Prefetcher = None, granularities=()) -> None:
+    dispatcher = pdf_files if isinstance(pdf_files, LptDispatcher) else None
+    if prefetcher is not None:
+        pdf_files = prefetcher.ahead(pdf_files) if dispatcher is None else prefetcher.ahead_of(dispatcher)
+    with ThreadPoolExecutor(max_workers=workers if dispatcher is None else dispatcher.workers) as executor:
+        if memory_budget is not None:
+            submit = partial(executor.submit, extract_split_and_stream_pdf, chunk_size=chunk_size, writer=writer, memory_budget=memory_budget, page_source=page_source,
+                             granularities=granularities)
+        else:
+            submit = partial(executor.submit, extract_split_and_store_pdf, chunk_size=chunk_size, db_name=db_name, writer=writer, page_source=page_source,
+                             granularities=granularities)
+        # Files are timed from their submission, a drawn file may wait for the byte budget
+        if dispatcher is not None:
+            submit_file = submit
+
+            def submit(pdf_file):
+                dispatcher.started(pdf_file)
+                return submit_file(pdf_file)
+
+        for pdf_file, future in submit_bounded(submit, pdf_files, max_in_flight_bytes, stop_event,
+                                               max_in_flight_files=None if dispatcher is None else dispatcher.workers):
+            if dispatcher is not None:
+                dispatcher.finished(pdf_file, completed=not future.cancelled())
+            if prefetcher is not None:
+                prefetcher.release(pdf_file)
+            # Cancelled by a stop before it started, the file stays pending in the journal
+            if future.cancelled():
+                continue
             try:
                 future.result()
                 logging.info(f"Processed {pdf_file}")
@@ -139,58 +761,744 @@ def process_files_in_parallel(pdf_files: str, chunk_size: int, db_name: str) ->
             except Exception as e:
                 logging.error(f"Error processing {pdf_file}: {e}")
 
-def batch_collect_files(folder_path: str, extension='.pdf', batch_size=100) -> Generator[list[str], None, None]:
+# Per-process shard database and chunk encoder, set up once by the pool initializer
+_shard_conn = None
+_shard_encoder = None
+
+def create_chunk_table(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS pdf_chunks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        file_name TEXT,
+        chunk_index INTEGER,
+        chunk_text TEXT,
+        codec TEXT,
+        start_page INTEGER,
+        end_page INTEGER,
+        start_offset INTEGER,
+        end_offset INTEGER)
+    """)
+    ensure_codec_column(conn)
+    ensure_position_columns(conn)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pdf_chunks_file_name ON pdf_chunks (file_name)")
+    chunk_levels.create_level_table(conn)
+
+# Journal state of the files a shard worker has started, in_progress until it finishes
+# them, copied into ingest_journal by the merge. Chunks of files without a done row are
+# not merged.
+def create_shard_journal_table(conn, schema="main"):
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {schema}.shard_journal (
+        file_name TEXT PRIMARY KEY,
+        state TEXT NOT NULL,
+        finished_at REAL NOT NULL,
+        error TEXT)
+    """)
+
+# Pool workers leave Ctrl-C to the parent, which stops the run gracefully
+def ignore_sigint():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+# Open a private shard database for the current process (pool workers, or the parent
+# when it stores documents extracted in page ranges). Workers are told so explicitly:
+# with spawn every worker re-imports this module and cannot tell itself from the parent.
+def init_shard_worker(shard_folder, codec="none", profile=False, is_worker=False):
+    global _shard_conn, _shard_encoder
+    if is_worker:
+        ignore_sigint()
+        metrics.enable(profile)
+    _shard_encoder = ChunkEncoder(codec)
+    setup_logging()
+    shard_path = join(shard_folder, f"shard_{getpid()}.db")
+    _shard_conn = sqlite3.connect(shard_path)
+    # Shards are scratch files merged at the end of the run, durability is not needed; the
+    # rollback journal is kept, as a broken pool kills its workers in mid-transaction
+    _shard_conn.execute("PRAGMA synchronous = OFF")
+    create_chunk_table(_shard_conn)
+    create_shard_journal_table(_shard_conn)
+    metrics.create_metrics_table(_shard_conn)
+    text_cache.create_text_cache_table(_shard_conn)
+    manifest.create_manifest_table(_shard_conn)
+    _shard_conn.commit()
+
+def close_shard():
+    global _shard_conn
+    if _shard_conn is not None:
+        _shard_conn.close()
+        _shard_conn = None
+
+def store_chunks_in_shard(pdf_file, start_index, chunks, positions):
+    with _shard_conn:
+        _shard_conn.executemany(
+            "INSERT INTO pdf_chunks (file_name, chunk_index, chunk_text, codec, start_page, end_page, start_offset, end_offset) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            ((pdf_file, start_index + index, *_shard_encoder.encode(chunk), *position) for index, (chunk, position) in enumerate(zip(chunks, positions))))
+
+# Text cache sink of the shard, see text_cache.cache_pages()
+def store_text_in_shard(entry):
+    with _shard_conn:
+        text_cache.store_entries(_shard_conn, [entry])
+
+# Signature sink of the shard, see signed_pages(); the merge records the signatures of
+# the files done in the manifest
+def store_signature_in_shard(pdf_file, signature):
+    manifest.record_files(_shard_conn, {pdf_file: signature})
+
+def store_levels_in_shard(pdf_file, rows):
+    with _shard_conn:
+        chunk_levels.store_levels(_shard_conn, pdf_file, rows)
+
+def record_shard_state(pdf_file, state, error=None):
+    with _shard_conn:
+        _shard_conn.execute("INSERT OR REPLACE INTO shard_journal (file_name, state, finished_at, error) VALUES (?, ?, ?, ?)",
+                            (pdf_file, state, time.time(), error))
+
+# Extract and split a PDF file inside a worker process and store the chunks in its shard
+def extract_split_and_store_shard(pdf_file, chunk_size, memory_budget=None, page_source=iter_pdf_pages, granularities=()):
+    return store_pages_in_shard(pdf_file, page_source(pdf_file), chunk_size, memory_budget, granularities)
+
+# Split the pages of a PDF file and store the chunks in the shard of the current process
+def store_pages_in_shard(pdf_file, pages, chunk_size, memory_budget=None, granularities=()):
+    # Recorded first, so the files a crashed worker was extracting can be told apart
+    record_shard_state(pdf_file, journal.IN_PROGRESS)
+    with metrics.file_span(pdf_file) as span:
+        chunk_count = _store_pages_in_shard(pdf_file, metrics.timed_pages(span, pages), chunk_size, memory_budget, granularities, span)
+    if metrics.enabled:
+        with _shard_conn:
+            metrics.flush(_shard_conn)
+    return chunk_count
+
+def _store_pages_in_shard(pdf_file, pages, chunk_size, memory_budget, granularities, span):
+    try:
+        if memory_budget is not None:
+            chunk_count = stream_pages_to_shard(pdf_file, pages, chunk_size, memory_budget, granularities)
+        else:
+            page_index = PageIndex()
+            text = "".join(page_index.track(pages))
+            started = span.clock()
+            chunks = split_text_into_chunks(text, chunk_size=chunk_size) if text else []
+            positions = locate_chunks(text, chunks, page_index)
+            span.add("split", started)
+            if not text:
+                logging.warning(f"No text extracted from {pdf_file}.")
+            elif not chunks:
+                logging.warning(f"No chunks created for {pdf_file}.")
+            else:
+                levels = LevelSplitter(granularities, page_index).split(chunks, positions) if granularities else None
+                started = span.clock()
+                store_chunks_in_shard(pdf_file, 0, chunks, positions)
+                if levels:
+                    store_levels_in_shard(pdf_file, levels)
+                span.add("store", started)
+                logging.info(f"Stored {len(chunks)} chunks for {pdf_file} in shard {getpid()}.")
+            chunk_count = len(chunks)
+    except Exception as e:
+        logging.error(f"Error processing {pdf_file}: {e}")
+        with _shard_conn:
+            _shard_conn.execute("DELETE FROM pdf_chunks WHERE file_name = ?", (pdf_file,))
+        # The pool extracting its page ranges broke, the caller retries the file
+        if isinstance(e, BrokenProcessPool):
+            raise
+        record_shard_state(pdf_file, journal.FAILED, describe_error(e))
+        return 0
+    span.count_chunks(chunk_count)
+    record_shard_state(pdf_file, journal.DONE)
+    return chunk_count
+
+# Streaming variant writing sub-batches to the shard, the merge keeps them contiguous
+def stream_pages_to_shard(pdf_file, pages, chunk_size, memory_budget, granularities=()):
+    window_size = stream_window_size(chunk_size, memory_budget)
+    page_index = PageIndex()
+    level_splitter = LevelSplitter(granularities, page_index) if granularities else None
+    sub_batch = []
+    sub_positions = []
+    sub_batch_chars = 0
+    chunk_count = 0
+    span = metrics.current_span()
+    for chunk, position in iter_located_chunks(pages, chunk_size, window_size, page_index):
+        sub_batch.append(chunk)
+        sub_positions.append(position)
+        sub_batch_chars += len(chunk)
+        if sub_batch_chars >= window_size:
+            levels = level_splitter.split(sub_batch, sub_positions, chunk_count) if level_splitter else None
+            started = span.clock()
+            store_chunks_in_shard(pdf_file, chunk_count, sub_batch, sub_positions)
+            if levels:
+                store_levels_in_shard(pdf_file, levels)
+            span.add("store", started)
+            chunk_count += len(sub_batch)
+            sub_batch = []
+            sub_positions = []
+            sub_batch_chars = 0
+    if sub_batch:
+        levels = level_splitter.split(sub_batch, sub_positions, chunk_count) if level_splitter else None
+        started = span.clock()
+        store_chunks_in_shard(pdf_file, chunk_count, sub_batch, sub_positions)
+        if levels:
+            store_levels_in_shard(pdf_file, levels)
+        span.add("store", started)
+        chunk_count += len(sub_batch)
+    if not chunk_count:
+        logging.warning(f"No chunks created for {pdf_file}.")
+    else:
+        logging.info(f"Streamed {chunk_count} chunks for {pdf_file} to shard {getpid()}.")
+    return chunk_count
+
+# Process multiple PDF files on a process pool, each worker writing to its own shard.
+# Returns the files lost with the pool when a worker died, see shard_states().
+def process_files_in_processes(pdf_files: list[str], chunk_size: int, executor: ProcessPoolExecutor, memory_budget: int = None,
+                               page_threshold: int = None, pages_per_range: int = DEFAULT_PAGES_PER_RANGE,
+                               stop_event: threading.Event = None, page_source=iter_pdf_pages, text_sink=None, signature_sink=None,
+                               granularities=()) -> list[str]:
+    # Page ranges of large documents are queued first so every worker starts on them,
+    # small files fill the pool while the ranges are reassembled here
+    range_futures = {}
+    future_to_file = {}
+    lost = []
+    try:
+        if page_threshold is not None:
+            for pdf_file in pdf_files:
+                page_count = count_pdf_pages(pdf_file)
+                if page_count > page_threshold:
+                    range_futures[pdf_file] = submit_page_ranges(pdf_file, page_count, executor, pages_per_range)
+
+        for pdf_file in pdf_files:
+            if pdf_file not in range_futures:
+                future_to_file[executor.submit(extract_split_and_store_shard, pdf_file, chunk_size, memory_budget, page_source, granularities)] = pdf_file
+    except BrokenProcessPool:
+        submitted = set(range_futures) | set(future_to_file.values())
+        lost.extend(pdf_file for pdf_file in pdf_files if pdf_file not in submitted)
+
+    for pdf_file, futures in range_futures.items():
+        if cancel_pending(futures, stop_event):
+            continue
+        logging.info(f"Reassembling {pdf_file} from {len(futures)} page ranges.")
+        pages = iter_page_ranges(futures)
+        if signature_sink is not None:
+            pages = signed_pages(pdf_file, pages, signature_sink, text_sink)
+        elif text_sink is not None:
+            pages = cache_pages(pdf_file, pages, text_sink)
+        try:
+            store_pages_in_shard(pdf_file, pages, chunk_size, memory_budget, granularities)
+        except BrokenProcessPool:
+            lost.append(pdf_file)
+            continue
+        logging.info(f"Processed {pdf_file}")
+        print(pdf_file)
+
+    for future in as_completed(future_to_file):
+        cancel_pending(future_to_file, stop_event)
+        if future.cancelled():
+            continue
+        pdf_file = future_to_file[future]
+        try:
+            future.result()
+            logging.info(f"Processed {pdf_file}")
+            print(pdf_file)
+        except BrokenProcessPool:
+            lost.append(pdf_file)
+        except Exception as e:
+            logging.error(f"Error processing {pdf_file}: {e}")
+    if lost:
+        logging.error(f"A worker process died, {len(lost)} files were lost with the pool.")
+    return lost
+
+# State of every file in the shard journals: a final state recorded by any shard wins
+# over in_progress, which a shard left behind by a worker that died while extracting it
+def shard_states(shard_folder: str) -> dict:
+    states = {}
+    for shard_file in sorted(f for f in listdir(shard_folder) if f.endswith(".db")):
+        conn = sqlite3.connect(join(shard_folder, shard_file))
+        try:
+            create_shard_journal_table(conn)
+            for pdf_file, state in conn.execute("SELECT file_name, state FROM shard_journal"):
+                if state != journal.IN_PROGRESS or pdf_file not in states:
+                    states[pdf_file] = state
+        finally:
+            conn.close()
+    return states
+
+# Delete a shard with the rollback journal a killed worker may have left next to it
+def remove_shard(shard_file: str) -> None:
+    for path in (shard_file, f"{shard_file}-journal"):
+        if exists(path):
+            remove(path)
+
+def merge_shard_databases(shard_folder: str, db_name: str, run_id: float = None) -> None:
+    """
+    Copy the chunks of every shard database into the master pdf_chunks table.
+
+    Rows are inserted ordered by file and chunk index in a single statement per shard,
+    so every file receives a contiguous block of ids and file_info.starting_id and
+    chunk_count computed from pdf_chunks stay valid. Only files the shard journal marks
+    done are copied, and their states are written to ingest_journal in the same
+    transaction, with their chunk_levels rows and the manifest rows their workers
+    signed them with. Profiling spans of the shard are copied to extract_metrics under
+    run_id, and its text_cache rows to text_cache.
+
+    :param shard_folder: Folder holding the shard_<pid>.db files.
+    :param db_name: Path to the master database.
+    :param run_id: Run the profiling spans are recorded under.
+    """
+    if not exists(shard_folder):
+        return
+    shard_files = sorted(join(shard_folder, f) for f in listdir(shard_folder) if f.endswith(".db"))
+
+    conn = sqlite3.connect(db_name)
+    try:
+        create_chunk_table(conn)
+        journal.create_journal_table(conn)
+        metrics.create_metrics_table(conn)
+        text_cache.create_text_cache_table(conn)
+        manifest.create_manifest_table(conn)
+        conn.commit()
+        for shard_file in shard_files:
+            try:
+                conn.execute("ATTACH DATABASE ? AS shard", (shard_file,))
+            except sqlite3.DatabaseError as e:
+                if isinstance(e, sqlite3.OperationalError):
+                    raise
+                # A shard corrupted by a killed worker; its files stay unfinished in the
+                # journal and are extracted again
+                logging.error(f"Dropping shard {shard_file}, which cannot be read: {e}")
+                remove_shard(shard_file)
+                continue
+            # A worker killed while it opened its shard left no tables to merge
+            if conn.execute("SELECT 1 FROM shard.sqlite_master WHERE name = 'pdf_chunks'").fetchone() is None:
+                conn.execute("DETACH DATABASE shard")
+                remove_shard(shard_file)
+                continue
+            try:
+                with conn:
+                    create_shard_journal_table(conn, schema="shard")
+                    metrics.create_metrics_table(conn, schema="shard")
+                    text_cache.create_text_cache_table(conn, schema="shard")
+                    # Shards left by a run from before chunk locations were recorded
+                    ensure_position_columns(conn, schema="shard")
+                    chunk_levels.create_level_table(conn, schema="shard")
+                    manifest.create_manifest_table(conn, schema="shard")
+                    conn.execute("""
+                        INSERT INTO pdf_chunks (file_name, chunk_index, chunk_text, codec, start_page, end_page, start_offset, end_offset)
+                        SELECT file_name, chunk_index, chunk_text, codec, start_page, end_page, start_offset, end_offset FROM shard.pdf_chunks
+                        WHERE file_name IN (SELECT file_name FROM shard.shard_journal WHERE state = ?)
+                        ORDER BY file_name, chunk_index
+                    """, (journal.DONE,))
+                    columns = ", ".join(chunk_levels.LEVEL_COLUMNS)
+                    conn.execute(f"""
+                        INSERT OR REPLACE INTO chunk_levels ({columns}) SELECT {columns} FROM shard.chunk_levels
+                        WHERE file_name IN (SELECT file_name FROM shard.shard_journal WHERE state = ?)""", (journal.DONE,))
+                    conn.execute("""
+                        INSERT OR REPLACE INTO file_manifest (file_path, file_size, mtime_ns, content_hash)
+                        SELECT file_path, file_size, mtime_ns, content_hash FROM shard.file_manifest
+                        WHERE file_path IN (SELECT file_name FROM shard.shard_journal WHERE state = ?)""", (journal.DONE,))
+                    conn.executemany("UPDATE ingest_journal SET state = ?, finished_at = ?, error = ? WHERE file_path = ?",
+                                     conn.execute("SELECT state, finished_at, error, file_name FROM shard.shard_journal WHERE state != ?",
+                                                  (journal.IN_PROGRESS,)).fetchall())
+                    # A file a dead worker left in progress stays so, unless another shard
+                    # or the run has finished it; finished_at is then the time it started
+                    conn.executemany("UPDATE ingest_journal SET state = ?, started_at = ? WHERE file_path = ? AND state = ?",
+                                     conn.execute("SELECT state, finished_at, file_name, ? FROM shard.shard_journal WHERE state = ?",
+                                                  (journal.PENDING, journal.IN_PROGRESS)).fetchall())
+                    columns = ", ".join(metrics.METRIC_COLUMNS)
+                    conn.execute(f"INSERT INTO extract_metrics (run_id, {columns}) SELECT ?, {columns} FROM shard.extract_metrics", (run_id,))
+                    columns = ", ".join(text_cache.TEXT_CACHE_COLUMNS)
+                    conn.execute(f"INSERT OR REPLACE INTO text_cache ({columns}) SELECT {columns} FROM shard.text_cache")
+            finally:
+                conn.execute("DETACH DATABASE shard")
+            remove_shard(shard_file)
+            logging.info(f"Merged shard {shard_file} into {db_name}.")
+    finally:
+        conn.close()
+
+def batch_collect_files(folder_path: str, extension='.pdf', batch_size=100, db_name=None) -> Generator[list[str], None, None]:
     """
     Generator function that yields batches of files from the specified folder.
 
     :param folder_path: Path to the folder containing the files.
-    :param extensions: File extension to filter by (default is '.pdf').
+    :param extension: File extension to filter by (default is '.pdf').
     :param batch_size: Number of files to include in each batch (default is 100).
+    :param db_name: Database caching directory listings between runs, see scan.scan_folder().
     :yield: List of file paths.
     """
-    current_batch = []
+    return scan.scan_folder(folder_path, extension, batch_size, db_name=db_name)
+
+# Journal error of a file whose worker process died while extracting it
+WORKER_CRASH_ERROR = "BrokenProcessPool: the worker process died while extracting the file"
+
+# Install a SIGINT handler asking the run to stop after its in-flight files; a second
+# Ctrl-C aborts at once. Returns the previous handler, or None outside the main thread.
+def install_stop_handler(stop_event: threading.Event):
+    if threading.current_thread() is not threading.main_thread():
+        return None
 
-    for root, _, files in walk(folder_path):
-        for file in files:
-            if file.lower().endswith(extension):
-                current_batch.append(join(root, file))
-                if len(current_batch) == batch_size:
-                    yield current_batch
-                    current_batch = []
+    def request_stop(signum, frame):
+        if stop_event.is_set():
+            raise KeyboardInterrupt
+        stop_event.set()
+        logging.warning("Interrupt received, stopping after the in-flight files.")
+        print("Interrupt received: finishing in-flight files (Ctrl-C again to abort)...")
 
-    if current_batch:
-        yield current_batch
+    return signal.signal(signal.SIGINT, request_stop)
 
 # Extract text from PDF files in batches and store in DB
-def extract_text(FOLDER_PATH, CHUNK_SIZE, chunk_database_path, reset_db):
+def extract_text(FOLDER_PATH, CHUNK_SIZE, chunk_database_path, reset_db, mode="thread", workers=None, memory_budget=None,
+                 page_threshold=None, pages_per_range=DEFAULT_PAGES_PER_RANGE, codec="none", resume=False,
+                 file_timeout=None, file_memory_limit=None, retry_quarantined=False,
+                 autotune=False, worker_bounds=None, batch_bounds=DEFAULT_BATCH_BOUNDS, profile=False,
+                 dedup_chunks=False, pdf_files=None, removed_files=None, max_in_flight_bytes=DEFAULT_IN_FLIGHT_BYTES,
+                 schedule="scan", schedule_cost="size", reserved_workers=0, prefetch=0, prefetch_bytes=DEFAULT_PREFETCH_BYTES,
+                 cache_text=False, granularities=(), page_profile: PageProfile = None):
+    """
+    Extract, split and store the text of the PDF files of FOLDER_PATH.
+
+    pdf_files and removed_files scope an incremental run (reset_db False) to the files
+    a caller knows have changed, see watch.watch_folder(): only pdf_files are checked
+    for changes and only removed_files for deletion, instead of scanning the folder.
+
+    Files are dispatched in scan order by default, starting while the folder is still
+    being scanned. With schedule "lpt" the scan completes first and files are
+    dispatched largest first by schedule_cost ("size" or "pages"); in thread mode
+    reserved_workers of the workers then take the smallest files instead.
+
+    With prefetch, thread mode workers open files from memory buffers read up to
+    prefetch files ahead, within prefetch_bytes, see prefetch.Prefetcher.
+
+    With cache_text, the page text of every file extracted is kept compressed in the
+    text_cache table under its content hash, so rechunk.rechunk() can split it again at
+    another chunk size without parsing the PDF files.
+
+    granularities are chunk sizes smaller than CHUNK_SIZE: every chunk is split again
+    at each of them in the same pass, into the chunk_levels table.
+
+    With page_profile, only the pages it selects are read from every file, e.g. the
+    front matter; give each profile its own database, see page_profile.profile_database_path().
+    """
+    setup_logging()
+    granularities = chunk_levels.check_granularities(granularities, CHUNK_SIZE)
     conn = sqlite3.connect(chunk_database_path)
+    # Profiling spans of this run are stored in extract_metrics under its start time
+    metrics.enable(profile)
+    run_id = time.time()
 
     def create_table():
         conn.execute("DROP TABLE IF EXISTS pdf_chunks")
-        conn.execute("""CREATE TABLE pdf_chunks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            file_name TEXT,
-            chunk_index INTEGER,
-            chunk_text TEXT)
-        """)
+        conn.execute("DROP TABLE IF EXISTS chunk_blobs")
+        conn.execute("DROP TABLE IF EXISTS chunk_levels")
+        create_chunk_table(conn)
 
-    logging.info(f"Starting processing of PDF files in batches...")
+    logging.info(f"Starting processing of PDF files in batches ({mode} mode)...")
+    create_chunk_table(conn)
+    journal.create_journal_table(conn)
+    quarantine.create_quarantine_table(conn)
+    metrics.create_metrics_table(conn)
+    text_cache.create_text_cache_table(conn)
+    conn.commit()
 
-    if reset_db:
+    rebuild_search_index = False
+    signatures = {}
+    # Files that failed before are skipped until their content changes
+    skipped = []
+    if resume:
+        if not journal.has_unfinished(conn):
+            print("Nothing to resume: the last extraction run completed.")
+            conn.close()
+            return
+        manifest.create_manifest_table(conn)
+        conn.commit()
+        # Shards of an interrupted process mode run still hold its finished files
+        merge_shard_databases(shard_folder_path, chunk_database_path, run_id)
+        journal.recover_interrupted(conn)
+        # Files the interrupted run had not found yet
+        scan_folder = journal.unscanned_folder(conn)
+        if scan_folder is not None:
+            found = [pdf for pdf_batch in batch_collect_files(scan_folder, db_name=chunk_database_path) for pdf in pdf_batch]
+            if not retry_quarantined:
+                found, quarantined = quarantine.filter_quarantined(conn, found)
+                skipped.extend(quarantined)
+            with conn:
+                journal.add_files(conn, found)
+            journal.finish_scan(conn)
+        pdf_to_process = journal.files_in_states(conn, (journal.PENDING,))
+        print(f"Resuming extraction: {len(pdf_to_process)} PDF files left.")
+    elif reset_db:
+        # The full-text index is rebuilt in one pass after a reset instead of row by row
+        rebuild_search_index = search.has_search_index(conn)
+        search.drop_search_index(conn)
         create_table()
-        for pdf_batch in batch_collect_files(FOLDER_PATH, batch_size=100):
-            process_files_in_parallel(pdf_batch, chunk_size=CHUNK_SIZE, db_name=chunk_database_path)
+        manifest.create_manifest_table(conn, reset=True)
+        conn.commit()
+        # Files are extracted while the rest of the folder is still being scanned, unless
+        # they are ordered first
+        pdf_to_process = None
+        if schedule == "lpt":
+            pdf_to_process = [pdf for pdf_batch in batch_collect_files(FOLDER_PATH, db_name=chunk_database_path) for pdf in pdf_batch]
     else:
-        # Fetch existing file names from the database as a set for quick lookup
-        pdf_in_db = set(row[0] for row in conn.execute("SELECT DISTINCT file_name FROM pdf_chunks"))
+        manifest.create_manifest_table(conn)
+        conn.commit()
+        # Compare the folder against the manifest, then re-point renamed files and purge
+        # the chunks of deleted and modified files before anything is re-extracted
+        if pdf_files is None:
+            pdf_files = [pdf for pdf_batch in batch_collect_files(FOLDER_PATH, db_name=chunk_database_path) for pdf in pdf_batch]
+        changes = manifest.scan_changes(conn, [pdf for pdf in pdf_files if exists(pdf)], removed_files)
+        manifest.apply_changes(conn, changes)
+
+        pdf_to_process = changes["new"] + changes["modified"]
+        signatures = {pdf: changes["signatures"][pdf] for pdf in pdf_to_process}
+        print(f"PDF files to process: {len(pdf_to_process)}")
+
+    def admit(files):
+        if resume or retry_quarantined:
+            return files
+        files, quarantined = quarantine.filter_quarantined(conn, files)
+        skipped.extend(quarantined)
+        return files
+
+    if pdf_to_process is not None:
+        pdf_to_process = admit(pdf_to_process)
+        if not resume:
+            journal.start_run(conn, pdf_to_process)
+    else:
+        journal.start_run(conn, [], scanning_folder=FOLDER_PATH)
+
+    # Largest files first, so no long document found late becomes the tail of the run
+    costs = None
+    scan_order = pdf_to_process
+    if schedule == "lpt" and pdf_to_process:
+        costs = estimate_costs(pdf_to_process, schedule_cost)
+        pdf_to_process = lpt_order(costs)
+
+    # Files to extract in order; during a scan, each batch found is journaled as it is
+    # queued, and the scan is marked complete once the last one is
+    def queued_files():
+        if pdf_to_process is not None:
+            yield from pdf_to_process
+            return
+        for pdf_batch in batch_collect_files(FOLDER_PATH, db_name=chunk_database_path):
+            pdf_batch = admit(pdf_batch)
+            with conn:
+                journal.add_files(conn, pdf_batch)
+            yield from pdf_batch
+        journal.finish_scan(conn)
 
-        # Process files in the folder incrementally
-        for pdf_batch in batch_collect_files(FOLDER_PATH, batch_size=100):
-            pdf_to_process = [pdf for pdf in pdf_batch if basename(pdf) not in pdf_in_db]
-            # print(f"PDF files to process in this batch: {len(pdf_to_process)}")
-            process_files_in_parallel(pdf_to_process, chunk_size=CHUNK_SIZE, db_name=chunk_database_path)
+    # Workers hash the files they extract for the manifest, except in incremental runs
+    # which hashed them when comparing the folder against it
+    sign = resume or reset_db
 
+    # With limits, PDF files are read in killable watchdog worker processes
+    watched = file_timeout is not None or file_memory_limit is not None
+    base_page_source = iter_pdf_pages if page_profile is None else partial(iter_pdf_pages, profile=page_profile)
+    if watched:
+        base_page_source = partial(watchdog.iter_watched_pages, timeout=file_timeout or DEFAULT_FILE_TIMEOUT, memory_limit=file_memory_limit,
+                                   profile=page_profile)
+    # A profile reads few pages of a document, which are not worth splitting into ranges
+    if page_profile is not None and page_threshold is not None:
+        logging.info(f"Page ranges are not used with the {page_profile.name} page profile.")
+        page_threshold = None
+
+    # Worker count and batch size start from the configured values and follow the measured throughput
+    autotuner = None
+    if autotune:
+        worker_bounds = worker_bounds or default_worker_bounds(mode)
+        autotuner = Autotuner(workers or min(32, (cpu_count() or 1) + 4), worker_bounds, DEFAULT_BATCH_SIZE, batch_bounds)
+        logging.info(f"Autotuning workers within {worker_bounds} and batch size within {batch_bounds}.")
+
+    if mode == "process":
+        # Leftover shards from an interrupted run would be merged twice
+        makedirs(shard_folder_path, exist_ok=True)
+        for f in listdir(shard_folder_path):
+            remove(join(shard_folder_path, f))
+        def start_executor(max_workers):
+            return ProcessPoolExecutor(max_workers=max_workers, initializer=init_shard_worker, initargs=(shard_folder_path, codec, profile, True))
+
+        executor_workers = workers if autotuner is None else autotuner.workers
+        executor = start_executor(executor_workers)
+        if page_threshold is not None:
+            # Documents reassembled from page ranges are stored in the parent's own shard
+            init_shard_worker(shard_folder_path, codec, is_worker=False)
+
+        # Workers sign and cache the text of their files in their shard, merged with the chunks
+        text_sink = store_text_in_shard if cache_text else None
+        signature_sink = store_signature_in_shard if sign else None
+        page_source = base_page_source
+        if sign:
+            page_source = partial(signed_page_source, page_source=base_page_source, sink=store_signature_in_shard, text_sink=text_sink)
+        elif cache_text:
+            page_source = partial(cached_page_source, page_source=base_page_source, sink=store_text_in_shard)
+
+        def restart_executor(max_workers):
+            nonlocal executor, executor_workers
+            executor.shutdown(wait=True)
+            executor = start_executor(max_workers)
+            executor_workers = max_workers
+
+        def run_files(pdf_files):
+            return process_files_in_processes(pdf_files, chunk_size=CHUNK_SIZE, executor=executor, memory_budget=memory_budget,
+                                              page_threshold=page_threshold, pages_per_range=pages_per_range, stop_event=stop_event,
+                                              page_source=page_source, text_sink=text_sink, signature_sink=signature_sink,
+                                              granularities=granularities)
+
+        # Files stay pending until the merge records the states their workers wrote in the
+        # shards, in_progress from when a worker starts them
+        def process_batch(pdf_batch):
+            # An autotuned worker count takes effect by replacing the idle pool between batches;
+            # each new worker opens its own shard, all of them are merged at the end
+            if autotuner is not None and autotuner.workers != executor_workers:
+                restart_executor(autotuner.workers)
+            lost = run_files(pdf_batch)
+            # A worker died (MuPDF crashing on a PDF file) and the pool with it. The files
+            # the workers had started are retried alone on a new pool, which finds the one
+            # crashing it and fails it; the files no worker had started are run again.
+            while lost and not stop_event.is_set():
+                restart_executor(executor_workers)
+                states = shard_states(shard_folder_path)
+                lost = [pdf for pdf in lost if states.get(pdf) not in (journal.DONE, journal.FAILED)]
+                suspects = [pdf for pdf in lost if states.get(pdf) == journal.IN_PROGRESS]
+                if not suspects:
+                    # The pool broke before any file started, none can be blamed alone
+                    fail_crashed(lost)
+                    break
+                for pdf_file in suspects:
+                    if run_files([pdf_file]):
+                        fail_crashed([pdf_file])
+                        restart_executor(executor_workers)
+                lost = run_files([pdf for pdf in lost if pdf not in suspects])
+
+        def fail_crashed(pdf_files):
+            for pdf_file in pdf_files:
+                logging.error(f"Error processing {pdf_file}: {WORKER_CRASH_ERROR}")
+            with conn:
+                journal.update_states(conn, pdf_files, journal.FAILED, WORKER_CRASH_ERROR)
+    else:
+        # A single writer thread owns every insert into pdf_chunks
+        writer = ChunkWriter(chunk_database_path, codec=codec)
+        writer.start()
+
+        # Upcoming files are read into memory while workers parse earlier ones; watchdog
+        # workers read files in their own process, which a buffer here cannot feed
+        prefetcher = None
+        file_source = base_page_source
+        if prefetch and not watched:
+            prefetcher = Prefetcher(prefetch, prefetch_bytes)
+            file_source = partial(iter_prefetched_pages, prefetcher=prefetcher, profile=page_profile)
+        elif prefetch:
+            logging.warning("Prefetching is not used with watchdog workers.")
+
+        # Large documents are split into page ranges extracted on a process pool
+        page_pool = None
+        page_source = file_source
+        if page_threshold is not None:
+            page_pool = ProcessPoolExecutor(max_workers=workers, initializer=ignore_sigint)
+            page_source = partial(iter_document_pages, page_pool=page_pool, page_threshold=page_threshold, pages_per_range=pages_per_range,
+                                  page_source=file_source)
+
+        # Files are signed as they are read and their text cached, committed by the writer with their chunks
+        text_sink = writer.cache_text if cache_text else None
+        if sign:
+            page_source = partial(signed_page_source, page_source=page_source, sink=signatures.__setitem__, text_sink=text_sink)
+        elif cache_text:
+            page_source = partial(cached_page_source, page_source=page_source, sink=text_sink)
+
+        def process_batch(pdf_batch):
+            batch_workers = workers if autotuner is None else autotuner.workers
+            if costs is not None:
+                # Reserved workers need a definite pool size, ThreadPoolExecutor's default is used
+                batch_workers = batch_workers or min(32, (cpu_count() or 1) + 4)
+                pdf_batch = LptDispatcher(list(pdf_batch), costs, batch_workers, reserved_workers)
+                dispatchers.append(pdf_batch)
+            process_files_in_parallel(pdf_batch, chunk_size=CHUNK_SIZE, db_name=chunk_database_path,
+                                      workers=batch_workers, writer=writer,
+                                      memory_budget=memory_budget, page_source=page_source, stop_event=stop_event,
+                                      max_in_flight_bytes=max_in_flight_bytes, prefetcher=prefetcher, granularities=granularities)
+
+    # Ctrl-C stops submitting files and lets the in-flight ones finish and commit
+    stop_event = threading.Event()
+    previous_handler = install_stop_handler(stop_event)
+    pdf_stream = queued_files()
+    dispatchers = []
+    started = time.perf_counter()
+    try:
+        if autotuner is None and mode != "process":
+            # Without measurement windows nothing needs batch boundaries: files are
+            # submitted as earlier ones finish, within the in-flight budget
+            process_batch(pdf_stream)
+        else:
+            while not stop_event.is_set():
+                batch_size = DEFAULT_BATCH_SIZE if autotuner is None else autotuner.batch_size
+                pdf_batch = list(islice(pdf_stream, batch_size))
+                if not pdf_batch:
+                    break
+                if autotuner is None:
+                    process_batch(pdf_batch)
+                    continue
+                batch_started = autotuner.start_batch()
+                process_batch(pdf_batch)
+                # A batch cut short by Ctrl-C would skew the measurement
+                if not stop_event.is_set():
+                    autotuner.record(batch_started, len(pdf_batch), batch_bytes(pdf_batch))
+        makespan = time.perf_counter() - started
+
+        if mode != "process":
+            if page_pool is not None:
+                page_pool.shutdown(wait=True, cancel_futures=True)
+            if prefetcher is not None:
+                prefetcher.close()
+                print(prefetcher.summary())
+            writer.close()
+            print(writer.summary())
+        if autotuner is not None:
+            print(autotuner.summary())
+        if costs is not None:
+            durations = {pdf: seconds for dispatcher in dispatchers for pdf, seconds in dispatcher.durations.items()}
+            pool_size = dispatchers[-1].workers if dispatchers else workers or cpu_count() or 1
+            print(schedule_report(scan_order, costs, pool_size, reserved_workers if dispatchers else 0, schedule_cost,
+                                  durations, makespan))
+    finally:
+        pdf_stream.close()
+        if mode == "process":
+            # Wait for the workers to exit so every shard connection is closed before merging;
+            # the files finished so far are merged even when the run fails
+            executor.shutdown(wait=True, cancel_futures=True)
+            close_shard()
+            merge_shard_databases(shard_folder_path, chunk_database_path, run_id)
+        watchdog.shutdown_watchdog()
+        if previous_handler is not None:
+            signal.signal(signal.SIGINT, previous_handler)
+
+    # Extracted files are recorded once their chunks are in the database. Failed files
+    # stay out of the manifest so the next incremental run retries them. Files done by
+    # an earlier, interrupted run were signed by no worker of this one.
+    done_files = manifest.unrecorded_files(conn, journal.files_in_states(conn, (journal.DONE,)))
+    unsigned = [pdf for pdf in done_files if pdf not in signatures and exists(pdf)]
+    if unsigned:
+        signatures.update(manifest.sign_files(unsigned, workers))
+    manifest.record_files(conn, {pdf: signatures[pdf] for pdf in done_files if pdf in signatures})
     conn.commit()
-    logging.info("Processing complete: Extracting text from PDF files.")
-    conn.close()
+    # Text of files since modified, deleted or failed
+    text_cache.prune_text_cache(conn)
+    if cache_text:
+        print(text_cache.cache_summary(conn))
+    # A deduplicated store stays so: the new chunks are moved to chunk_blobs after every ingest
+    if dedup_chunks or dedup.is_deduplicated(conn):
+        print(dedup.format_report(dedup.dedup_chunk_store(conn)))
+    if rebuild_search_index:
+        search.build_search_index(conn)
+    elif search.has_search_index(conn):
+        search.sync_search_index(conn)
 
+    if profile:
+        metrics.flush(conn, run_id)
+    conn.commit()
+    if profile:
+        print(metrics.summary(conn, run_id))
+    if skipped:
+        print(f"Skipped {len(skipped)} quarantined PDF files (use --retry-quarantined to try them again).")
+    if quarantine.quarantine_failed(conn):
+        print("Quarantined files by error: " + ", ".join(f"{name} {count}" for name, count in quarantine.summary(conn).items()))
+    states = journal.summary(conn)
+    unfinished = states.get(journal.PENDING, 0) + states.get(journal.IN_PROGRESS, 0)
+    scan_left = journal.unscanned_folder(conn) is not None
+    print(f"Journal: {states.get(journal.DONE, 0)} done, {states.get(journal.FAILED, 0)} failed, {unfinished} unfinished"
+          + (", folder scan not finished." if scan_left else "."))
+    if unfinished or scan_left:
+        print("Extraction stopped early, run again with --resume to finish it.")
+        logging.info(f"Processing interrupted with {unfinished} files left.")
+    else:
+        logging.info("Processing complete: Extracting text from PDF files.")
+    conn.close()
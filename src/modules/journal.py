@@ -0,0 +1,117 @@
+import logging
+import sqlite3
+import time
+
+# Life cycle of a file in an extraction run
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+
+# Runs a file may be in progress in when they are interrupted before it is failed, as
+# the likely cause of the interruptions (a PDF file crashing the process)
+MAX_INTERRUPTIONS = 2
+
+def create_journal_table(conn: sqlite3.Connection) -> None:
+    conn.execute("""CREATE TABLE IF NOT EXISTS ingest_journal (
+        file_path TEXT PRIMARY KEY,
+        state TEXT NOT NULL,
+        queued_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        error TEXT,
+        interruptions INTEGER NOT NULL DEFAULT 0)
+    """)
+    ensure_interruptions_column(conn)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ingest_journal_state ON ingest_journal (state)")
+    # Folder a run is still scanning while it extracts: files not found yet are in no
+    # journal row, so a resumed run has to scan the folder again for them
+    conn.execute("""CREATE TABLE IF NOT EXISTS ingest_scan (
+        folder_path TEXT NOT NULL)
+    """)
+
+# Journals created before interrupted runs were counted
+def ensure_interruptions_column(conn: sqlite3.Connection) -> None:
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(ingest_journal)")}
+    if "interruptions" not in columns:
+        conn.execute("ALTER TABLE ingest_journal ADD COLUMN interruptions INTEGER NOT NULL DEFAULT 0")
+
+# Replace the journal with a new run over the given files, all pending. A run that
+# extracts while scanning_folder is scanned adds the files it finds with add_files()
+# and calls finish_scan() once the scan is complete.
+def start_run(conn: sqlite3.Connection, files: list[str], scanning_folder: str = None) -> None:
+    now = time.time()
+    with conn:
+        conn.execute("DELETE FROM ingest_journal")
+        conn.executemany("INSERT INTO ingest_journal (file_path, state, queued_at) VALUES (?, ?, ?)",
+                         [(file_path, PENDING, now) for file_path in files])
+        conn.execute("DELETE FROM ingest_scan")
+        if scanning_folder is not None:
+            conn.execute("INSERT INTO ingest_scan (folder_path) VALUES (?)", (scanning_folder,))
+
+def finish_scan(conn: sqlite3.Connection) -> None:
+    with conn:
+        conn.execute("DELETE FROM ingest_scan")
+
+# Folder whose scan the last run did not finish, or None
+def unscanned_folder(conn: sqlite3.Connection):
+    row = conn.execute("SELECT folder_path FROM ingest_scan LIMIT 1").fetchone()
+    return None if row is None else row[0]
+
+# Add files found while a run is already going as pending, inside the caller's transaction
+def add_files(conn: sqlite3.Connection, files: list[str]) -> None:
+    now = time.time()
+    conn.executemany("INSERT OR IGNORE INTO ingest_journal (file_path, state, queued_at) VALUES (?, ?, ?)",
+                     [(file_path, PENDING, now) for file_path in files])
+
+def update_states(conn: sqlite3.Connection, files: list[str], state: str, error: str = None) -> None:
+    """
+    Set the state of files, stamping started_at when they go in progress and
+    finished_at when they are done or failed. Runs inside the caller's transaction,
+    so a state can be committed together with the chunks it describes.
+    """
+    now = time.time()
+    if state == IN_PROGRESS:
+        conn.executemany("UPDATE ingest_journal SET state = ?, started_at = ?, finished_at = NULL, error = NULL WHERE file_path = ?",
+                         [(state, now, file_path) for file_path in files])
+    elif state == PENDING:
+        conn.executemany("UPDATE ingest_journal SET state = ?, started_at = NULL, finished_at = NULL, error = NULL WHERE file_path = ?",
+                         [(state, file_path) for file_path in files])
+    else:
+        conn.executemany("UPDATE ingest_journal SET state = ?, finished_at = ?, error = ? WHERE file_path = ?",
+                         [(state, now, error, file_path) for file_path in files])
+
+def files_in_states(conn: sqlite3.Connection, states: tuple[str, ...]) -> list[str]:
+    placeholders = ", ".join("?" * len(states))
+    return [row[0] for row in conn.execute(
+        f"SELECT file_path FROM ingest_journal WHERE state IN ({placeholders}) ORDER BY queued_at, rowid", states)]
+
+def has_unfinished(conn: sqlite3.Connection) -> bool:
+    if unscanned_folder(conn) is not None:
+        return True
+    return conn.execute("SELECT 1 FROM ingest_journal WHERE state IN (?, ?) LIMIT 1", (PENDING, IN_PROGRESS)).fetchone() is not None
+
+def recover_interrupted(conn: sqlite3.Connection) -> list[str]:
+    """
+    Roll back the files an interrupted run left in progress: their partial chunks are
+    purged and they go back to pending, in one transaction. A file that was in progress
+    in MAX_INTERRUPTIONS interrupted runs is failed instead, so it gets quarantined.
+
+    :return: The recovered file paths.
+    """
+    interrupted = dict(conn.execute("SELECT file_path, interruptions FROM ingest_journal WHERE state = ?", (IN_PROGRESS,)).fetchall())
+    recovered = [file_path for file_path, count in interrupted.items() if count + 1 < MAX_INTERRUPTIONS]
+    failed = [file_path for file_path, count in interrupted.items() if count + 1 >= MAX_INTERRUPTIONS]
+    with conn:
+        conn.executemany("DELETE FROM pdf_chunks WHERE file_name = ?", [(file_path,) for file_path in interrupted])
+        conn.executemany("UPDATE ingest_journal SET interruptions = interruptions + 1 WHERE file_path = ?", [(file_path,) for file_path in interrupted])
+        update_states(conn, recovered, PENDING)
+        update_states(conn, failed, FAILED, f"Interrupted: in progress in {MAX_INTERRUPTIONS} interrupted runs")
+    if recovered:
+        logging.info(f"Rolled back {len(recovered)} files interrupted in the previous run.")
+    if failed:
+        logging.warning(f"Failed {len(failed)} files in progress in {MAX_INTERRUPTIONS} interrupted runs.")
+    return recovered
+
+def summary(conn: sqlite3.Connection) -> dict:
+    return dict(conn.execute("SELECT state, COUNT(*) FROM ingest_journal GROUP BY state").fetchall())
@@ -0,0 +1,138 @@
+import hashlib
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from os import stat
+from os.path import exists
+
+# Read size used when hashing file contents
+HASH_BLOCK_SIZE = 1 << 20
+
+def create_manifest_table(conn: sqlite3.Connection, reset: bool = False, schema="main") -> None:
+    if reset:
+        conn.execute(f"DROP TABLE IF EXISTS {schema}.file_manifest")
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {schema}.file_manifest (
+        file_path TEXT PRIMARY KEY,
+        file_size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        content_hash TEXT NOT NULL)
+    """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_file_manifest_hash ON file_manifest (content_hash)")
+
+# Hash the content of a file without loading it in memory at once
+def hash_file(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Size, mtime and content hash of a file, as stored in the manifest
+def file_signature(file_path: str) -> tuple[int, int, str]:
+    info = stat(file_path)
+    return info.st_size, info.st_mtime_ns, hash_file(file_path)
+
+# Signatures of files read and hashed in parallel (hashlib releases the GIL on large
+# blocks), skipping files that can no longer be read
+def sign_files(files: list[str], workers: int = None) -> dict:
+    def sign(file_path):
+        try:
+            return file_path, file_signature(file_path)
+        except OSError as e:
+            logging.warning(f"Cannot record {file_path} in the manifest: {e}")
+            return file_path, None
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return {file_path: signature for file_path, signature in executor.map(sign, files) if signature is not None}
+
+def scan_changes(conn: sqlite3.Connection, pdf_files: list[str], removed_files: list[str] = None) -> dict:
+    """
+    Compare the files on disk against the manifest.
+
+    Files whose size and mtime match their manifest row are taken as unchanged without
+    being hashed. Any other file is hashed: a hash belonging to a manifest path that is
+    no longer on disk is a rename, a known path with a new hash is a modification, and
+    anything else is new. Files that already have chunks but no manifest row (databases
+    built before the manifest existed) are adopted as unchanged.
+
+    :param conn: Connection to the chunk database.
+    :param pdf_files: Paths of every PDF currently in the folder.
+    :param removed_files: When given, pdf_files only holds the files known to have changed
+                          and just these paths are checked for deletion, instead of every
+                          manifest path missing from pdf_files.
+    :return: Dict with 'new', 'modified', 'deleted' and 'adopted' path lists, 'renamed' as a
+             list of (old_path, new_path) pairs and 'signatures' mapping each hashed path to
+             its (size, mtime_ns, hash).
+    """
+    manifest = {row[0]: row[1:] for row in conn.execute(
+        "SELECT file_path, file_size, mtime_ns, content_hash FROM file_manifest")}
+    on_disk = set(pdf_files)
+    if removed_files is None:
+        missing = {path for path in manifest if path not in on_disk}
+    else:
+        missing = {path for path in removed_files if path in manifest and path not in on_disk and not exists(path)}
+    missing_by_hash = {}
+    for path in missing:
+        missing_by_hash.setdefault(manifest[path][2], []).append(path)
+
+    pdf_in_db = set()
+    if len(manifest) < len(on_disk):
+        pdf_in_db = set(row[0] for row in conn.execute("SELECT DISTINCT file_name FROM pdf_chunks"))
+
+    changes = {"new": [], "modified": [], "renamed": [], "deleted": [], "adopted": [], "signatures": {}}
+    for path in pdf_files:
+        info = stat(path)
+        known = manifest.get(path)
+        if known is not None and known[0] == info.st_size and known[1] == info.st_mtime_ns:
+            continue
+
+        signature = (info.st_size, info.st_mtime_ns, hash_file(path))
+        changes["signatures"][path] = signature
+        if known is not None:
+            # Touched but identical content only needs its stats refreshed
+            changes["adopted" if known[2] == signature[2] else "modified"].append(path)
+        elif missing_by_hash.get(signature[2]):
+            old_path = missing_by_hash[signature[2]].pop()
+            missing.discard(old_path)
+            changes["renamed"].append((old_path, path))
+        elif path in pdf_in_db:
+            changes["adopted"].append(path)
+        else:
+            changes["new"].append(path)
+
+    changes["deleted"] = sorted(missing)
+    return changes
+
+def apply_changes(conn: sqlite3.Connection, changes: dict) -> None:
+    """
+    Re-point renamed files, purge the chunks of deleted and modified files and refresh
+    the manifest rows of renamed and adopted files, all in one transaction.
+
+    New and modified files get their manifest row from record_files once extracted.
+    """
+    signatures = changes["signatures"]
+    with conn:
+        for old_path, new_path in changes["renamed"]:
+            conn.execute("UPDATE pdf_chunks SET file_name = ? WHERE file_name = ?", (new_path, old_path))
+            conn.execute("DELETE FROM file_manifest WHERE file_path = ?", (old_path,))
+        for path in changes["deleted"] + changes["modified"]:
+            conn.execute("DELETE FROM pdf_chunks WHERE file_name = ?", (path,))
+            conn.execute("DELETE FROM file_manifest WHERE file_path = ?", (path,))
+        conn.executemany(
+            "INSERT OR REPLACE INTO file_manifest (file_path, file_size, mtime_ns, content_hash) VALUES (?, ?, ?, ?)",
+            [(path, *signatures[path]) for path in [new for _, new in changes["renamed"]] + changes["adopted"]])
+
+    logging.info(f"Manifest scan: {len(changes['new'])} new, {len(changes['modified'])} modified, "
+                 f"{len(changes['renamed'])} renamed, {len(changes['deleted'])} deleted, "
+                 f"{len(changes['adopted'])} refreshed.")
+
+# Record the signatures of extracted files so the next scan sees them as unchanged
+def record_files(conn: sqlite3.Connection, signatures: dict) -> None:
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO file_manifest (file_path, file_size, mtime_ns, content_hash) VALUES (?, ?, ?, ?)",
+            [(path, *signature) for path, signature in signatures.items()])
+
+# Files of a list that have no manifest row yet
+def unrecorded_files(conn: sqlite3.Connection, files: list[str]) -> list[str]:
+    recorded = set(row[0] for row in conn.execute("SELECT file_path FROM file_manifest"))
+    return [path for path in files if path not in recorded]
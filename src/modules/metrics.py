@@ -0,0 +1,173 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from os.path import getsize
+
+# Sub-timers of a file span, in pipeline order
+TIMERS = ("open", "get_text", "split", "store", "retry_sleep")
+
+# Profiling is off by default; spans are then the shared no-op NULL_SPAN
+enabled = False
+
+_local = threading.local()
+_finished = []
+_finished_lock = threading.Lock()
+
+def enable(on: bool = True) -> None:
+    global enabled
+    enabled = on
+
+class FileSpan:
+    """
+    Timings and counters of one file going through the extraction pipeline.
+
+    Timers accumulate wall time of the thread processing the file: open (fitz.open),
+    get_text (waiting for page text, excluding open), split, store (inserting or
+    queueing chunks, blocked time included) and retry_sleep (sleeps of the database
+    lock retries, also part of store).
+    """
+    __slots__ = ("file_path", "timers", "pages", "chunks", "bytes_read", "retries", "started")
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.timers = dict.fromkeys(TIMERS, 0.0)
+        self.pages = 0
+        self.chunks = 0
+        self.retries = 0
+        try:
+            self.bytes_read = getsize(file_path)
+        except OSError:
+            self.bytes_read = 0
+        self.started = time.perf_counter()
+
+    def clock(self) -> float:
+        return time.perf_counter()
+
+    # Add the time elapsed since started, a value returned by clock(), to a timer
+    def add(self, name: str, started: float) -> None:
+        self.timers[name] += time.perf_counter() - started
+
+    def add_retry(self, delay: float) -> None:
+        self.retries += 1
+        self.timers["retry_sleep"] += delay
+
+    def count_chunks(self, chunks: int) -> None:
+        self.chunks += chunks
+
+    def row(self) -> tuple:
+        return (self.file_path, time.perf_counter() - self.started, *self.timers.values(),
+                self.bytes_read, self.pages, self.chunks, self.retries)
+
+class _NullSpan:
+    """Span used while profiling is off: every call is a no-op."""
+    __slots__ = ()
+
+    def clock(self) -> float:
+        return 0.0
+
+    def add(self, name: str, started: float) -> None:
+        pass
+
+    def add_retry(self, delay: float) -> None:
+        pass
+
+    def count_chunks(self, chunks: int) -> None:
+        pass
+
+NULL_SPAN = _NullSpan()
+
+# Span of the file processed by the current thread
+def current_span():
+    return getattr(_local, "span", NULL_SPAN)
+
+@contextmanager
+def file_span(file_path: str):
+    """
+    Open the span of a file for the current thread. The finished span is kept until
+    flush() writes it to a database.
+    """
+    if not enabled:
+        yield NULL_SPAN
+        return
+    span = FileSpan(file_path)
+    previous = current_span()
+    _local.span = span
+    try:
+        yield span
+    finally:
+        _local.span = previous
+        with _finished_lock:
+            _finished.append(span.row())
+
+def timed_pages(span, pages):
+    """
+    Wrap a page iterator so the time spent waiting for each page goes to the get_text
+    timer of span, minus the time the page source itself reported as open.
+    """
+    if span is NULL_SPAN:
+        return pages
+
+    def generate():
+        iterator = iter(pages)
+        while True:
+            started = time.perf_counter()
+            opened = span.timers["open"]
+            try:
+                page_text = next(iterator)
+            except StopIteration:
+                return
+            span.timers["get_text"] += time.perf_counter() - started - (span.timers["open"] - opened)
+            span.pages += 1
+            yield page_text
+
+    return generate()
+
+def create_metrics_table(conn: sqlite3.Connection, schema="main") -> None:
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {schema}.extract_metrics (
+        run_id REAL,
+        file_path TEXT NOT NULL,
+        total_s REAL NOT NULL,
+        {", ".join(f"{name}_s REAL NOT NULL" for name in TIMERS)},
+        bytes_read INTEGER NOT NULL,
+        pages INTEGER NOT NULL,
+        chunks INTEGER NOT NULL,
+        retries INTEGER NOT NULL)
+    """)
+
+METRIC_COLUMNS = ("file_path", "total_s", *(f"{name}_s" for name in TIMERS), "bytes_read", "pages", "chunks", "retries")
+
+# Write the spans finished so far to extract_metrics, inside the caller's transaction
+def flush(conn: sqlite3.Connection, run_id: float = None) -> int:
+    global _finished
+    with _finished_lock:
+        rows, _finished = _finished, []
+    if rows:
+        conn.executemany(f"INSERT INTO extract_metrics (run_id, {', '.join(METRIC_COLUMNS)}) VALUES ({', '.join('?' * (len(METRIC_COLUMNS) + 1))})",
+                         [(run_id, *row) for row in rows])
+    return len(rows)
+
+def summary(conn: sqlite3.Connection, run_id: float, slowest: int = 5) -> str:
+    """
+    Summary of a run: totals, every timer with its share of the file time and its
+    average per file or page, and the slowest files. Timers are summed over workers.
+    """
+    totals = conn.execute(f"""SELECT COUNT(*), SUM(total_s), {", ".join(f"SUM({name}_s)" for name in TIMERS)},
+        SUM(bytes_read), SUM(pages), SUM(chunks), SUM(retries) FROM extract_metrics WHERE run_id = ?""", (run_id,)).fetchone()
+    files, total = totals[0], totals[1] or 0.0
+    if not files:
+        return "Extraction profile: no files recorded."
+    timers = dict(zip(TIMERS, totals[2:2 + len(TIMERS)]))
+    bytes_read, pages, chunks, retries = totals[2 + len(TIMERS):]
+
+    lines = [f"Extraction profile: {files} files, {pages} pages, {chunks} chunks, {bytes_read / 1e6:.1f} MB read, {retries} retries, "
+             f"{total:.2f} s summed over workers"]
+    for name, seconds in timers.items():
+        unit, count = ("page", pages) if name == "get_text" else ("file", files)
+        share = seconds / total if total else 0.0
+        lines.append(f"  {name:<12} {seconds:9.3f} s {share:6.1%}  {seconds / max(count, 1) * 1000:9.2f} ms/{unit}")
+    lines.append("  Slowest files:")
+    for file_path, seconds, pages in conn.execute("SELECT file_path, total_s, pages FROM extract_metrics WHERE run_id = ? ORDER BY total_s DESC LIMIT ?",
+                                                  (run_id, slowest)):
+        lines.append(f"    {seconds:8.3f} s {pages:6d} pages  {file_path}")
+    return "\n".join(lines)
@@ -0,0 +1,114 @@
+import re
+from collections import Counter
+from os.path import splitext
+from collections.abc import Generator
+
+# Profiles an extraction can read PDF files with, as given on the command line:
+#   full      every page
+#   front     front matter: table of contents and introduction, found from the outline
+#   first:N   the first N pages
+#   every:K   every K-th page, starting with the first
+PROFILE_KINDS = ("full", "front", "first", "every")
+
+# Front matter pages read from a document whose outline does not locate it
+DEFAULT_FRONT_PAGES = 20
+
+# Front matter never runs past this page, whatever the outline says
+MAX_FRONT_PAGES = 60
+
+FRONT_MATTER_TITLE = re.compile(r"\b(introduction|preface|foreword|overview|getting started|contents|prologue|acknowledge?ments?|dedication"
+                                r"|about (this|the) (book|authors?)|title page|copyright|cover|list of (figures|tables|illustrations)"
+                                r"|abbreviations|notation|how to (use|read) this book)\b", re.IGNORECASE)
+FIRST_CHAPTER_TITLE = re.compile(r"^\s*((chapter|part|unit|lesson)\s+(1|one|i)\b|1(\.|:|\s|$))", re.IGNORECASE)
+PART_TITLE = re.compile(r"^\s*part\b", re.IGNORECASE)
+
+def front_matter_pages(toc: list, page_count: int) -> int:
+    """
+    Number of leading pages holding the front matter of a document, from its outline
+    as returned by doc.get_toc(simple=True).
+
+    The front matter ends right before the first chapter: the first entry after the
+    first page that is not front matter (table of contents, preface, introduction...)
+    and either sits at chapter level, the top level holding more than one entry, or is
+    numbered as chapter one. When that entry is a part opening with front matter, as in
+    Part I > Introduction > Chapter 1, the front matter runs to its first chapter.
+    Documents whose outline locates no chapter get their first DEFAULT_FRONT_PAGES pages.
+    """
+    levels = Counter(level for level, _, _ in toc)
+    chapter_level = min((level for level, count in levels.items() if count > 1), default=1)
+    first_chapter = next((i for i, (level, title, page) in enumerate(toc) if page > 1 and not FRONT_MATTER_TITLE.search(title)
+                          and (level <= chapter_level or FIRST_CHAPTER_TITLE.search(title))), None)
+    if first_chapter is None or toc[first_chapter][2] > MAX_FRONT_PAGES + 1:
+        return max(1, min(DEFAULT_FRONT_PAGES, page_count))
+    part_level, part_title, end = toc[first_chapter]
+    end -= 1
+    if PART_TITLE.search(part_title):
+        for level, title, page in toc[first_chapter + 1:]:
+            if level <= part_level or not FRONT_MATTER_TITLE.search(title):
+                end = max(end, page - 1)
+                break
+    return max(1, min(end, MAX_FRONT_PAGES, page_count))
+
+class PageProfile:
+    """
+    Pages of every PDF file an extraction reads, so tagging and triage passes can skip
+    the bulk of long documents.
+
+    :param kind: One of PROFILE_KINDS but "full", which is no profile at all.
+    :param count: N of first:N or K of every:K.
+    """
+
+    def __init__(self, kind: str, count: int = None):
+        if kind not in PROFILE_KINDS[1:]:
+            raise ValueError(f"unknown profile {kind}, expected one of {', '.join(PROFILE_KINDS)}")
+        if kind == "front" and count is not None:
+            raise ValueError("front takes no page count")
+        if kind != "front" and (count is None or count < 1):
+            raise ValueError(f"{kind} needs a page count of at least 1, e.g. {kind}:10")
+        self.kind = kind
+        self.count = count
+
+    # Namespace of the chunks extracted with the profile, e.g. "front" or "first-30"
+    @property
+    def name(self) -> str:
+        return self.kind if self.count is None else f"{self.kind}-{self.count}"
+
+    # Page numbers of an open document to read, in order
+    def pages(self, doc) -> range:
+        if self.kind == "front":
+            return range(front_matter_pages(doc.get_toc(simple=True), doc.page_count))
+        if self.kind == "first":
+            return range(min(self.count, doc.page_count))
+        return range(0, doc.page_count, self.count)
+
+# Profile of a command line spec such as "front", "first:30" or "every:10"; None for "full"
+def parse_profile(spec: str):
+    kind, _, count = spec.partition(":")
+    if kind == "full" and not count:
+        return None
+    try:
+        return PageProfile(kind, int(count) if count else None)
+    except ValueError as e:
+        raise ValueError(f"Invalid page profile '{spec}': {e}") from None
+
+# Database of a profile's chunks, next to the database of full extractions
+def profile_database_path(db_name: str, profile: PageProfile = None) -> str:
+    if profile is None:
+        return db_name
+    root, extension = splitext(db_name)
+    return f"{root}.{profile.name}{extension}"
+
+def iter_page_numbers(doc, start=0, end=None, profile: PageProfile = None) -> Generator[int, None, None]:
+    """
+    Page numbers of [start, end) of an open document to read in order, None standing
+    for a page the profile skips. Skipped pages are read as empty text, so pages keep
+    their numbers in chunk locations; reading stops after the last selected page.
+    """
+    last = doc.page_count if end is None else min(end, doc.page_count)
+    if profile is None:
+        yield from range(start, last)
+        return
+    selected = profile.pages(doc)
+    last = min(last, selected[-1] + 1 if selected else 0)
+    for page_num in range(start, last):
+        yield page_num if page_num in selected else None
@@ -1,11 +1,14 @@
 from os import getcwd
+from os.path import join
 
-StudyApp_root_path = getcwd() + "\\"
+StudyApp_root_path = getcwd()
 
 pdf_path = "D:\\READING LIST"
-chunk_database_path = StudyApp_root_path + "data\\pdf_text.db"
-token_json_path = StudyApp_root_path + "data\\token_json"
+chunk_database_path = join(StudyApp_root_path, "data", "pdf_text.db")
+token_json_path = join(StudyApp_root_path, "data", "token_json")
 
-log_file_path = StudyApp_root_path + "data\\process.log"
-log_database_path = StudyApp_root_path + "data\\log_message.db"
-buffer_json_path = StudyApp_root_path + "data\\buffer.json"
\ No newline at end of file
+log_file_path = join(StudyApp_root_path, "data", "process.log")
+log_database_path = join(StudyApp_root_path, "data", "log_message.db")
+buffer_json_path = join(StudyApp_root_path, "data", "buffer.json")
+shard_folder_path = join(StudyApp_root_path, "data", "shards")
+prompt_text_path = join(StudyApp_root_path, "PROMPT.txt")
@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from os.path import getsize
+from collections.abc import Generator, Iterable
+
+# Files read ahead of the extraction workers by default
+DEFAULT_PREFETCH_WINDOW = 8
+
+# Default cap on the bytes of files read ahead and not yet taken by a worker
+DEFAULT_PREFETCH_BYTES = 256 * 1024 * 1024
+
+# Threads reading files ahead; reads are bound by disk or network latency
+DEFAULT_PREFETCH_READERS = 4
+
+def read_file(file_path: str) -> bytes:
+    with open(file_path, "rb") as f:
+        return f.read()
+
+class Prefetcher:
+    """
+    Reads upcoming PDF files into memory on reader threads while the extraction
+    workers parse earlier ones, so disk or network reads overlap with MuPDF parsing.
+
+    Files enter the read-ahead window as they are drawn from ahead(), or as a dispatcher
+    choosing each file when it is drawn lists them with ahead_of(). Reads are started
+    in order while the buffered bytes stay within max_bytes (a single file larger than
+    the cap is read alone); the others wait for buffers to be taken. A worker takes the
+    buffer of its file with take(): a hit if the read had finished, a stall if it had to
+    wait for it, a miss if the file was never read ahead and must be opened by path.
+
+    :param window: Files drawn ahead of the files handed out.
+    :param max_bytes: Cap on the bytes of buffers read and not yet taken.
+    :param readers: Number of reader threads.
+    """
+
+    def __init__(self, window: int = DEFAULT_PREFETCH_WINDOW, max_bytes: int = DEFAULT_PREFETCH_BYTES,
+                 readers: int = DEFAULT_PREFETCH_READERS):
+        self.window = window
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="Prefetch")
+        self.lock = threading.Lock()
+        # path -> (future of the read, size), for reads started and not taken
+        self.reads = {}
+        self.buffered_bytes = 0
+        self.waiting = deque()
+
+        self.hits = 0
+        self.stalls = 0
+        self.misses = 0
+        self.stall_time = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def ahead(self, files: Iterable[str]) -> Generator[str, None, None]:
+        """Yield files in order, drawing up to window files ahead and reading them."""
+        files = iter(files)
+        lookahead = deque()
+        exhausted = False
+        while True:
+            while not exhausted and len(lookahead) <= self.window:
+                pdf_file = next(files, None)
+                if pdf_file is None:
+                    exhausted = True
+                    break
+                lookahead.append(pdf_file)
+                with self.lock:
+                    self.waiting.append(pdf_file)
+                    self._fill()
+            if not lookahead:
+                return
+            yield lookahead.popleft()
+
+    def ahead_of(self, dispatcher) -> Generator[str, None, None]:
+        """
+        Yield the files of a dispatcher as it hands them out, reading the window files
+        its upcoming() lists ahead without drawing them, so it still chooses every file
+        when a worker is free.
+        """
+        for pdf_file in dispatcher:
+            with self.lock:
+                for upcoming_file in (pdf_file, *dispatcher.upcoming(self.window)):
+                    if upcoming_file not in self.reads and upcoming_file not in self.waiting:
+                        self.waiting.append(upcoming_file)
+                self._fill()
+            yield pdf_file
+
+    # Start reads of waiting files while the buffer cap allows, in order; under the lock
+    def _fill(self) -> None:
+        while self.waiting:
+            pdf_file = self.waiting[0]
+            try:
+                size = getsize(pdf_file)
+            except OSError:
+                # Left to the worker, which reports the error
+                self.waiting.popleft()
+                continue
+            if self.reads and self.buffered_bytes + size > self.max_bytes:
+                return
+            self.waiting.popleft()
+            self.reads[pdf_file] = (self.executor.submit(read_file, pdf_file), size)
+            self.buffered_bytes += size
+
+    def take(self, pdf_file: str):
+        """
+        Buffer of a file read ahead, waiting for its read if needed, or None if the file
+        was not read ahead or its read failed.
+        """
+        with self.lock:
+            read = self.reads.pop(pdf_file, None)
+            if read is None:
+                if pdf_file in self.waiting:
+                    self.waiting.remove(pdf_file)
+                self.misses += 1
+                return None
+        future, size = read
+        if future.done():
+            self.hits += 1
+        else:
+            self.stalls += 1
+            started = time.perf_counter()
+            future.exception()
+            self.stall_time += time.perf_counter() - started
+        with self.lock:
+            self.buffered_bytes -= size
+            self._fill()
+        try:
+            return future.result()
+        except OSError as e:
+            logging.warning(f"Prefetch of {pdf_file} failed: {e}")
+            return None
+
+    # Drop the buffer of a file that was processed without taking it
+    def release(self, pdf_file: str) -> None:
+        with self.lock:
+            read = self.reads.pop(pdf_file, None)
+            if read is not None:
+                read[0].cancel()
+                self.buffered_bytes -= read[1]
+                self._fill()
+            elif pdf_file in self.waiting:
+                self.waiting.remove(pdf_file)
+
+    def close(self) -> None:
+        with self.lock:
+            for future, _ in self.reads.values():
+                future.cancel()
+            self.reads.clear()
+            self.waiting.clear()
+            self.buffered_bytes = 0
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def summary(self) -> str:
+        taken = self.hits + self.stalls + self.misses
+        hit_rate = self.hits / taken if taken else 0.0
+        return (f"Prefetch: {self.hits} hits, {self.stalls} stalls ({self.stall_time:.2f} s waiting), "
+                f"{self.misses} misses, hit rate {hit_rate:.0%}")
@@ -0,0 +1,74 @@
+import logging
+import sqlite3
+import time
+from os import stat
+import modules.journal as journal
+from modules.manifest import file_signature, hash_file
+
+def create_quarantine_table(conn: sqlite3.Connection) -> None:
+    conn.execute("""CREATE TABLE IF NOT EXISTS file_quarantine (
+        file_path TEXT PRIMARY KEY,
+        file_size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        content_hash TEXT NOT NULL,
+        error_class TEXT NOT NULL,
+        error TEXT,
+        quarantined_at REAL NOT NULL)
+    """)
+
+# Error class of a journal error text, formatted as "<class>: <message>"
+def error_class(error: str) -> str:
+    return (error or "").partition(":")[0] or "Unknown"
+
+def quarantine_failed(conn: sqlite3.Connection) -> int:
+    """
+    Quarantine the files the journal marks failed, with the signature of their current
+    content and their error class, and release the files that are now done.
+
+    :return: Number of quarantined files.
+    """
+    failed = conn.execute("SELECT file_path, error FROM ingest_journal WHERE state = ?", (journal.FAILED,)).fetchall()
+    rows = []
+    now = time.time()
+    for file_path, error in failed:
+        try:
+            rows.append((file_path, *file_signature(file_path), error_class(error), error, now))
+        except OSError:
+            continue
+    with conn:
+        conn.executemany("""INSERT OR REPLACE INTO file_quarantine
+            (file_path, file_size, mtime_ns, content_hash, error_class, error, quarantined_at) VALUES (?, ?, ?, ?, ?, ?, ?)""", rows)
+        conn.execute("DELETE FROM file_quarantine WHERE file_path IN (SELECT file_path FROM ingest_journal WHERE state = ?)", (journal.DONE,))
+    if rows:
+        logging.warning(f"Quarantined {len(rows)} files that failed to extract.")
+    return len(rows)
+
+def filter_quarantined(conn: sqlite3.Connection, files: list[str]) -> tuple[list[str], list[str]]:
+    """
+    Split files into those to extract and those still quarantined. A quarantined file is
+    released once its content changes: files with the same size and mtime are taken as
+    unchanged, others are hashed.
+
+    :return: (files_to_extract, quarantined_files)
+    """
+    quarantined = {row[0]: row[1:] for row in conn.execute(
+        "SELECT file_path, file_size, mtime_ns, content_hash FROM file_quarantine")}
+    if not quarantined:
+        return files, []
+
+    to_extract, skipped = [], []
+    for file_path in files:
+        known = quarantined.get(file_path)
+        if known is not None:
+            info = stat(file_path)
+            unchanged = (known[0] == info.st_size and known[1] == info.st_mtime_ns) or known[2] == hash_file(file_path)
+            if unchanged:
+                skipped.append(file_path)
+                continue
+        to_extract.append(file_path)
+    if skipped:
+        logging.info(f"Skipping {len(skipped)} quarantined files.")
+    return to_extract, skipped
+
+def summary(conn: sqlite3.Connection) -> dict:
+    return dict(conn.execute("SELECT error_class, COUNT(*) FROM file_quarantine GROUP BY error_class").fetchall())
@@ -0,0 +1,126 @@
+import logging
+import sqlite3
+import time
+from os.path import exists
+import modules.manifest as manifest
+import modules.search as search
+import modules.dedup as dedup
+import modules.text_cache as text_cache
+import modules.chunk_levels as chunk_levels
+from modules.chunk_codec import ChunkEncoder, ensure_blob_column, store_encoder
+from modules.chunk_position import PageIndex
+from modules.page_profile import PageProfile
+from modules.extract_text import setup_logging, create_chunk_table, iter_pdf_pages, iter_located_chunks, stream_window_size, LevelSplitter
+
+# Files of the manifest with their content hash, in the order their chunks are stored
+def manifest_files(conn: sqlite3.Connection) -> list[tuple[str, str]]:
+    return conn.execute("""
+        SELECT m.file_path, m.content_hash FROM file_manifest m
+        LEFT JOIN (SELECT file_name, MIN(id) AS first_id FROM pdf_chunks GROUP BY file_name) c ON c.file_name = m.file_path
+        ORDER BY c.first_id IS NULL, c.first_id, m.file_path""").fetchall()
+
+# Read the pages of an uncached file from its PDF and cache them, returns False if the
+# file changed since it was extracted or can no longer be read
+def cache_from_pdf(conn: sqlite3.Connection, pdf_file: str, content_hash: str, page_profile: PageProfile = None) -> bool:
+    entries = []
+    try:
+        for _ in text_cache.cache_pages(pdf_file, iter_pdf_pages(pdf_file, profile=page_profile), entries.append):
+            pass
+    except Exception:
+        return False
+    if not entries or entries[0][0] != content_hash:
+        return False
+    with conn:
+        text_cache.store_entries(conn, entries)
+    return True
+
+def rechunk(db_name: str, chunk_size: int, codec: str = None, granularities=(), page_profile: PageProfile = None) -> None:
+    """
+    Rebuild pdf_chunks at another chunk size from the text cache, without parsing the
+    PDF files.
+
+    Every file of the manifest is split again from its cached page texts, with the
+    chunks and locations an extraction at chunk_size would give, and files keep the
+    order of their chunks. Files extracted without the cache are read from their PDF
+    once, at the pages of page_profile, and cached. chunk_levels is rebuilt at
+    granularities, or left empty without them. The old chunks are replaced in one
+    transaction, so an interrupted rechunk leaves them untouched. The full-text index is rebuilt and a deduplicated
+    store deduplicated again; like a full extraction, ids change, so file_info must be
+    rebuilt by the indexer.
+
+    :param db_name: Path to the chunk database.
+    :param chunk_size: Maximum number of characters per chunk.
+    :param codec: Codec the chunks are compressed with, one of chunk_codec.CODECS, or
+                  None to keep the codec the database stores them with.
+    :param granularities: Chunk sizes of the finer levels, see chunk_levels.check_granularities().
+    :param page_profile: Profile the database was extracted with, None for every page.
+    """
+    setup_logging()
+    granularities = chunk_levels.check_granularities(granularities, chunk_size)
+    conn = sqlite3.connect(db_name)
+    try:
+        create_chunk_table(conn)
+        ensure_blob_column(conn)
+        manifest.create_manifest_table(conn)
+        text_cache.create_text_cache_table(conn)
+        conn.commit()
+
+        files = manifest_files(conn)
+        cached = set(row[0] for row in conn.execute("SELECT content_hash FROM text_cache"))
+        uncached = [(pdf_file, content_hash) for pdf_file, content_hash in files if content_hash not in cached]
+        if uncached:
+            print(f"Caching the text of {len(uncached)} PDF files extracted without the text cache...")
+        stale = []
+        for pdf_file, content_hash in uncached:
+            if not exists(pdf_file) or not cache_from_pdf(conn, pdf_file, content_hash, page_profile):
+                stale.append(pdf_file)
+        if stale:
+            # Their chunks would be lost, an incremental extraction brings the manifest up to date first
+            logging.warning(f"Rechunk aborted: {len(stale)} files were moved, deleted or modified since they were extracted.")
+            print(f"Cannot rechunk: {len(stale)} PDF files were moved, deleted or modified since they were extracted "
+                  f"(e.g. {stale[0]}), run --extractText --incremental first.")
+            return
+
+        started = time.perf_counter()
+        rebuild_search_index = search.has_search_index(conn)
+        deduplicated = dedup.is_deduplicated(conn)
+        # Read before the old chunks are dropped
+        encoder = ChunkEncoder(codec) if codec is not None else store_encoder(conn)
+        window_size = stream_window_size(chunk_size)
+        chunk_count = 0
+        text_chars = 0
+        conn.execute("BEGIN")
+        try:
+            # The index is rebuilt in one pass afterwards instead of row by row
+            search.drop_search_index(conn)
+            conn.execute("DROP TABLE IF EXISTS pdf_chunks")
+            conn.execute("DROP TABLE IF EXISTS chunk_blobs")
+            conn.execute("DROP TABLE IF EXISTS chunk_levels")
+            create_chunk_table(conn)
+            for pdf_file, content_hash in files:
+                pages = text_cache.load_pages(conn, content_hash)
+                text_chars += sum(len(page_text) for page_text in pages)
+                page_index = PageIndex()
+                located = list(iter_located_chunks(pages, chunk_size, window_size, page_index))
+                conn.executemany(
+                    "INSERT INTO pdf_chunks (file_name, chunk_index, chunk_text, codec, start_page, end_page, start_offset, end_offset) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(pdf_file, index, *encoder.encode(chunk), *position) for index, (chunk, position) in enumerate(located)])
+                if granularities and located:
+                    chunks, positions = zip(*located)
+                    chunk_levels.store_levels(conn, pdf_file, LevelSplitter(granularities, page_index).split(chunks, positions))
+                chunk_count += len(located)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        elapsed = time.perf_counter() - started
+        logging.info(f"Rechunked {len(files)} files into {chunk_count} chunks of {chunk_size} characters in {elapsed:.2f} s.")
+        print(f"Rechunked {len(files)} PDF files into {chunk_count} chunks of up to {chunk_size} characters "
+              f"in {elapsed:.2f} s ({text_chars / 1e6 / elapsed if elapsed else 0.0:.1f} M characters/s).")
+
+        if deduplicated:
+            print(dedup.format_report(dedup.dedup_chunk_store(conn)))
+        if rebuild_search_index:
+            search.build_search_index(conn)
+    finally:
+        conn.close()
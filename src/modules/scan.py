@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from os.path import join
+from collections.abc import Generator
+
+# Directories listed at once; listing is bound by I/O latency, on network shares most of all
+DEFAULT_SCAN_WORKERS = 16
+
+# A directory modified this close to the start of a scan may change again within the
+# same mtime tick, so it is not trusted by the next scan (as git does with racy entries)
+RACY_WINDOW_NS = 2 * 10**9
+
+def create_dir_manifest_table(conn: sqlite3.Connection) -> None:
+    conn.execute("""CREATE TABLE IF NOT EXISTS dir_manifest (
+        dir_path TEXT NOT NULL,
+        extension TEXT NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        files TEXT NOT NULL,
+        subdirs TEXT NOT NULL,
+        PRIMARY KEY (dir_path, extension))
+    """)
+
+# Cached listings of the directories under folder: dir_path -> (mtime_ns, files, subdirs)
+def load_dir_manifest(conn: sqlite3.Connection, folder: str, extension: str) -> dict:
+    prefix = join(folder, "")
+    return {dir_path: (mtime_ns, json.loads(files), json.loads(subdirs)) for dir_path, mtime_ns, files, subdirs in conn.execute("""
+        SELECT dir_path, mtime_ns, files, subdirs FROM dir_manifest
+        WHERE extension = ? AND (dir_path = ? OR substr(dir_path, 1, ?) = ?)""", (extension, folder, len(prefix), prefix))}
+
+# Replace the cached listings under folder with those of a complete scan
+def save_dir_manifest(conn: sqlite3.Connection, folder: str, extension: str, listings: dict, started_ns: int) -> None:
+    prefix = join(folder, "")
+    with conn:
+        conn.execute("DELETE FROM dir_manifest WHERE extension = ? AND (dir_path = ? OR substr(dir_path, 1, ?) = ?)",
+                     (extension, folder, len(prefix), prefix))
+        conn.executemany("INSERT INTO dir_manifest (dir_path, extension, mtime_ns, files, subdirs) VALUES (?, ?, ?, ?, ?)",
+                         [(dir_path, extension, mtime_ns if mtime_ns < started_ns - RACY_WINDOW_NS else 0, json.dumps(files), json.dumps(subdirs))
+                          for dir_path, (mtime_ns, files, subdirs) in listings.items()])
+
+def list_directory(dir_path: str, extension: str, cached=None):
+    """
+    Files with the extension and subdirectories of a directory. A cached listing is
+    reused without reading the directory when its mtime has not changed, which is the
+    case unless entries were added, removed or renamed in it.
+
+    :return: (dir_path, mtime_ns, file_names, subdir_names, listed), or None if the
+             directory cannot be read.
+    """
+    try:
+        mtime_ns = os.stat(dir_path).st_mtime_ns
+        if cached is not None and cached[0] == mtime_ns:
+            return dir_path, mtime_ns, cached[1], cached[2], False
+        files, subdirs = [], []
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                # Like os.walk: symlinks to directories are not followed, the rest are files
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        subdirs.append(entry.name)
+                elif entry.name.lower().endswith(extension):
+                    files.append(entry.name)
+        return dir_path, mtime_ns, files, subdirs, True
+    except OSError as e:
+        logging.warning(f"Cannot scan {dir_path}: {e}")
+        return None
+
+def scan_folder(folder_path: str, extension='.pdf', batch_size=100, workers=DEFAULT_SCAN_WORKERS, db_name=None) -> Generator[list[str], None, None]:
+    """
+    Scan a folder tree for files with an extension, listing directories in parallel.
+
+    Batches are yielded as soon as they fill up, while the remaining directories are
+    still being listed, so callers can start on the first files early. With db_name,
+    the listing of every directory is cached in its dir_manifest table together with
+    the directory mtime, and unchanged directories are only stat'ed by later scans. The
+    cache is written once a scan completes.
+
+    :param folder_path: Root of the tree.
+    :param extension: Lowercase file extension to collect (default is '.pdf').
+    :param batch_size: Number of files per batch (default is 100).
+    :param workers: Number of directories listed at once.
+    :param db_name: Database holding the directory cache, None to list everything.
+    :yield: Lists of file paths.
+    """
+    cache = {}
+    if db_name is not None:
+        conn = sqlite3.connect(db_name)
+        try:
+            create_dir_manifest_table(conn)
+            conn.commit()
+            cache = load_dir_manifest(conn, folder_path, extension)
+        finally:
+            conn.close()
+
+    started_ns = time.time_ns()
+    listings = {}
+    listed = 0
+    batch = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(list_directory, folder_path, extension, cache.get(folder_path))}
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    if result is None:
+                        continue
+                    dir_path, mtime_ns, files, subdirs, was_listed = result
+                    listings[dir_path] = (mtime_ns, files, subdirs)
+                    listed += was_listed
+                    for name in subdirs:
+                        subdir = join(dir_path, name)
+                        pending.add(pool.submit(list_directory, subdir, extension, cache.get(subdir)))
+                    for name in files:
+                        batch.append(join(dir_path, name))
+                        if len(batch) == batch_size:
+                            yield batch
+                            batch = []
+        finally:
+            # A consumer stopping early leaves directories that were never listed
+            for future in pending:
+                future.cancel()
+
+    if batch:
+        yield batch
+    logging.info(f"Scanned {folder_path}: {len(listings)} directories, {listed} listed, {len(listings) - listed} unchanged.")
+    if db_name is not None:
+        conn = sqlite3.connect(db_name)
+        try:
+            save_dir_manifest(conn, folder_path, extension, listings, started_ns)
+        finally:
+            conn.close()
@@ -0,0 +1,131 @@
+import heapq
+import logging
+import time
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from os.path import getsize
+import fitz  # PyMuPDF
+
+# Files whose cost is estimated at once; page counts need an open of every file
+DEFAULT_ESTIMATE_WORKERS = 16
+
+def estimate_cost(pdf_file: str, measure: str = "size") -> int:
+    """
+    Estimated processing cost of a PDF file. Page counts come from the page tree,
+    without reading any page. A file that cannot be read costs 0, it fails fast.
+    """
+    try:
+        if measure == "pages":
+            with fitz.open(pdf_file) as doc:
+                return doc.page_count
+        return getsize(pdf_file)
+    except Exception as e:
+        logging.warning(f"Cannot estimate the cost of {pdf_file}: {e}")
+        return 0
+
+def estimate_costs(pdf_files: list[str], measure: str = "size", workers: int = DEFAULT_ESTIMATE_WORKERS) -> dict:
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(pdf_files, executor.map(estimate_cost, pdf_files, [measure] * len(pdf_files))))
+
+# Largest first, ties in path order so runs are repeatable
+def lpt_order(costs: dict) -> list[str]:
+    return sorted(costs, key=lambda pdf_file: (-costs[pdf_file], pdf_file))
+
+class LptDispatcher:
+    """
+    Hands out files largest first (longest processing time first) to a pool of
+    workers, with the option to reserve some workers for the small files: once
+    workers - reserved large files are running, the next file is taken from the small
+    end instead, so small files keep flowing behind long documents.
+
+    The pool must draw a file only when a worker is free, report when it submits it
+    and report every finished file, which gives the time each file took. order lists
+    the files in the order they were submitted.
+    """
+
+    def __init__(self, pdf_files: list[str], costs: dict, workers: int, reserved: int = 0):
+        self.queue = deque(lpt_order({pdf_file: costs.get(pdf_file, 0) for pdf_file in pdf_files}))
+        self.workers = workers
+        self.large_slots = max(1, workers - reserved)
+        self.large_running = set()
+        self.submitted = {}
+        self.durations = {}
+        self.order = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.queue:
+            raise StopIteration
+        if len(self.large_running) < self.large_slots:
+            pdf_file = self.queue.popleft()
+            self.large_running.add(pdf_file)
+        else:
+            pdf_file = self.queue.pop()
+        return pdf_file
+
+    def upcoming(self, count: int) -> list[str]:
+        """
+        Files likely to be handed out next, without drawing them: from the large end, and
+        from the small end in proportion to the reserved workers.
+        """
+        if len(self.queue) <= count:
+            return list(self.queue)
+        small = count * (self.workers - self.large_slots) // self.workers
+        return list(islice(self.queue, count - small)) + list(islice(reversed(self.queue), small))
+
+    def started(self, pdf_file: str) -> None:
+        self.order.append(pdf_file)
+        self.submitted[pdf_file] = time.perf_counter()
+
+    # A file cancelled before it started takes no time
+    def finished(self, pdf_file: str, completed: bool = True) -> None:
+        self.large_running.discard(pdf_file)
+        submitted = self.submitted.pop(pdf_file)
+        if completed:
+            self.durations[pdf_file] = time.perf_counter() - submitted
+
+def simulate_makespan(costs: list, workers: int, reserved: int = 0) -> float:
+    """
+    Makespan of files with the given costs dispatched in order to workers, each file
+    going to the first worker that is free. With reserved workers the LptDispatcher
+    policy is followed, the costs must then be sorted largest first.
+    """
+    queue = deque(costs)
+    large_slots = max(1, workers - reserved) if reserved else workers
+    running = []
+    large_running = 0
+    now = 0.0
+    while queue or running:
+        while queue and len(running) < workers:
+            large = large_running < large_slots
+            cost = queue.popleft() if large else queue.pop()
+            large_running += large
+            heapq.heappush(running, (now + cost, large))
+        now, large = heapq.heappop(running)
+        large_running -= large
+    return now
+
+def schedule_report(scan_order: list[str], costs: dict, workers: int, reserved: int, measure: str,
+                    durations: dict = None, actual_makespan: float = None) -> str:
+    """
+    Predicted makespan of the LPT schedule against the scan order. Costs are converted
+    to seconds at the rate measured over the files of the run when their durations are
+    known, otherwise the prediction is relative.
+    """
+    scan_costs = [costs[pdf_file] for pdf_file in scan_order]
+    lpt_costs = [costs[pdf_file] for pdf_file in lpt_order(costs)]
+    scan_makespan = simulate_makespan(scan_costs, workers)
+    lpt_makespan = simulate_makespan(lpt_costs, workers, reserved)
+    header = f"Schedule: LPT by {measure} on {workers} workers ({reserved} reserved for small files)"
+    if not scan_makespan:
+        return f"{header}: nothing to schedule."
+
+    actual = f", actual {actual_makespan:.2f} s" if actual_makespan is not None else ""
+    timed_cost = sum(costs[pdf_file] for pdf_file in durations or ())
+    if not timed_cost:
+        return f"{header}: predicted makespan {lpt_makespan / scan_makespan:.0%} of the scan order{actual}."
+    rate = sum(durations.values()) / timed_cost
+    return f"{header}: predicted makespan {lpt_makespan * rate:.2f} s ({scan_makespan * rate:.2f} s in scan order){actual}."
@@ -0,0 +1,210 @@
+import logging
+import re
+import sqlite3
+from modules.chunk_codec import ensure_codec_column, ensure_blob_column, chunk_columns, decode_chunk
+
+# FTS5 index over the chunk text. It is contentless: chunks may be stored compressed,
+# which SQLite cannot read, so the index is filled from the text decoded in Python and
+# keeps no copy of it. The triggers below only log the rows inserted into and deleted
+# from pdf_chunks, with the stored value of deleted rows since a contentless index needs
+# the old text to remove it; sync_search_index() applies the logs. Rewriting the codec or
+# deduplicating rows never changes their text and leaves the index alone.
+SEARCH_TABLE = "pdf_chunks_fts"
+SEARCH_PENDING_TABLE = "pdf_chunks_fts_pending"
+# Also named in chunk_codec.migrate_chunk_store, which keeps the dictionaries it needs
+SEARCH_REMOVED_TABLE = "pdf_chunks_fts_removed"
+# View of the external content index of earlier versions
+SEARCH_VIEW = "pdf_chunks_text"
+
+SEARCH_TOKENIZER = "porter unicode61"
+
+# (chunk_text, codec) of a pdf_chunks row given as new or old in a trigger
+def _stored_chunk(row: str) -> str:
+    return f"""SELECT {row}.chunk_text AS chunk_text, {row}.codec AS codec WHERE {row}.blob_id IS NULL
+        UNION ALL SELECT chunk_text, codec FROM chunk_blobs WHERE id = {row}.blob_id"""
+
+SEARCH_SCHEMA = f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        chunk_text,
+        content='',
+        tokenize='{SEARCH_TOKENIZER}'
+    );
+
+    CREATE TABLE IF NOT EXISTS {SEARCH_PENDING_TABLE} (id INTEGER PRIMARY KEY);
+
+    CREATE TABLE IF NOT EXISTS {SEARCH_REMOVED_TABLE} (
+        id INTEGER PRIMARY KEY,
+        chunk_text,
+        codec TEXT);
+
+    CREATE TRIGGER IF NOT EXISTS pdf_chunks_fts_insert AFTER INSERT ON pdf_chunks BEGIN
+        INSERT INTO {SEARCH_PENDING_TABLE} (id) VALUES (new.id);
+    END;
+
+    -- A row deleted before it was indexed only leaves the pending log
+    CREATE TRIGGER IF NOT EXISTS pdf_chunks_fts_delete AFTER DELETE ON pdf_chunks BEGIN
+        INSERT INTO {SEARCH_REMOVED_TABLE} (id, chunk_text, codec)
+        SELECT old.id, chunk_text, codec FROM ({_stored_chunk("old")})
+        WHERE NOT EXISTS (SELECT 1 FROM {SEARCH_PENDING_TABLE} WHERE id = old.id);
+        DELETE FROM {SEARCH_PENDING_TABLE} WHERE id = old.id;
+    END;
+"""
+
+# Sync triggers, including those of older indexes
+SEARCH_TRIGGERS = ("pdf_chunks_fts_insert", "pdf_chunks_fts_delete", "pdf_chunks_fts_update", "chunk_blobs_fts_update",
+                   "pdf_chunks_fts_update_old", "pdf_chunks_fts_update_new")
+
+# Chunk hits fetched per query before they are grouped by file
+MAX_CHUNK_HITS = 500
+
+def has_search_index(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (SEARCH_TABLE,)).fetchone() is not None
+
+# Indexes of earlier versions read their text from pdf_chunks and skip compressed chunks
+def is_search_index_outdated(conn: sqlite3.Connection) -> bool:
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE name = ?", (SEARCH_TABLE,)).fetchone()
+    return row is not None and "content=''" not in row[0]
+
+# Drop the index, its logs and its sync triggers
+def drop_search_index(conn: sqlite3.Connection) -> None:
+    for trigger in SEARCH_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+    conn.execute(f"DROP TABLE IF EXISTS {SEARCH_PENDING_TABLE}")
+    conn.execute(f"DROP TABLE IF EXISTS {SEARCH_REMOVED_TABLE}")
+    conn.execute(f"DROP VIEW IF EXISTS {SEARCH_VIEW}")
+
+# Index the decoded text of the pdf_chunks rows with the given ids in an FTS5 table,
+# returns the number of rows indexed
+def _index_chunks(conn: sqlite3.Connection, chunk_ids: list[int], table: str = SEARCH_TABLE) -> int:
+    placeholders = ", ".join("?" * len(chunk_ids))
+    rows = conn.execute(f"SELECT id, {chunk_columns(conn)} FROM pdf_chunks WHERE id IN ({placeholders})", chunk_ids).fetchall()
+    conn.executemany(f"INSERT INTO {table} (rowid, chunk_text) VALUES (?, ?)",
+                     [(chunk_id, decode_chunk(value, codec, conn)) for chunk_id, value, codec in rows])
+    return len(rows)
+
+def build_search_index(conn: sqlite3.Connection, batch_size: int = 1000) -> None:
+    """
+    Create the FTS5 index and its sync triggers if needed, and (re)index the text of
+    every chunk of pdf_chunks, whatever its codec, in one transaction.
+    """
+    ensure_codec_column(conn)
+    ensure_blob_column(conn)
+    if is_search_index_outdated(conn):
+        drop_search_index(conn)
+    conn.commit()
+    conn.executescript(SEARCH_SCHEMA)
+    indexed = 0
+    with conn:
+        conn.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('delete-all')")
+        conn.execute(f"DELETE FROM {SEARCH_PENDING_TABLE}")
+        conn.execute(f"DELETE FROM {SEARCH_REMOVED_TABLE}")
+        last_id = 0
+        while batch := [row[0] for row in conn.execute(
+                "SELECT id FROM pdf_chunks WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size))]:
+            last_id = batch[-1]
+            indexed += _index_chunks(conn, batch)
+        conn.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+    logging.info(f"Built full-text index over {indexed} chunks.")
+
+def sync_search_index(conn: sqlite3.Connection, batch_size: int = 1000) -> None:
+    """
+    Apply the rows inserted into and deleted from pdf_chunks since the index was last
+    synced, in one transaction. Removed rows go first, a contentless index must be given
+    the exact text it indexed to remove it.
+    """
+    if is_search_index_outdated(conn):
+        build_search_index(conn, batch_size)
+        return
+    removed = indexed = 0
+    with conn:
+        while batch := conn.execute(f"SELECT id, chunk_text, codec FROM {SEARCH_REMOVED_TABLE} LIMIT ?", (batch_size,)).fetchall():
+            conn.executemany(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, chunk_text) VALUES ('delete', ?, ?)",
+                             [(chunk_id, decode_chunk(value, codec, conn)) for chunk_id, value, codec in batch])
+            conn.executemany(f"DELETE FROM {SEARCH_REMOVED_TABLE} WHERE id = ?", [(row[0],) for row in batch])
+            removed += len(batch)
+        while batch := [row[0] for row in conn.execute(f"SELECT id FROM {SEARCH_PENDING_TABLE} LIMIT ?", (batch_size,))]:
+            indexed += _index_chunks(conn, batch)
+            conn.executemany(f"DELETE FROM {SEARCH_PENDING_TABLE} WHERE id = ?", [(chunk_id,) for chunk_id in batch])
+    if removed or indexed:
+        logging.info(f"Synced full-text index: {indexed} chunks indexed, {removed} removed.")
+
+# Quote every word so free text never trips over FTS5 query syntax
+def quote_query(query: str) -> str:
+    return " ".join(f'"{word}"' for word in re.findall(r"\w+", query))
+
+# A contentless index has no text to build snippets from: the decoded text of the chunks
+# shown is matched again in a temporary FTS5 table with the same tokenizer
+def _snippets(conn: sqlite3.Connection, query: str, chunk_ids: list[int]) -> dict:
+    conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS temp.search_snippets USING fts5(chunk_text, tokenize='{SEARCH_TOKENIZER}')")
+    conn.execute("DELETE FROM temp.search_snippets")
+    _index_chunks(conn, chunk_ids, "temp.search_snippets")
+    rows = conn.execute("""
+        SELECT rowid, snippet(search_snippets, 0, '[', ']', '...', 16)
+        FROM temp.search_snippets WHERE search_snippets MATCH ?""", (query,))
+    return dict(rows.fetchall())
+
+def search_chunks(conn: sqlite3.Connection, query: str, max_files: int = 10, snippets_per_file: int = 3) -> list[dict]:
+    """
+    Rank files by their best matching chunk for a keyword query.
+
+    The query uses FTS5 syntax (AND, OR, NOT, "phrases", prefix*). If it is not valid
+    FTS5 syntax, its words are searched as plain terms instead.
+
+    :param conn: Connection to the chunk database.
+    :param query: Keyword query.
+    :param max_files: Number of files returned.
+    :param snippets_per_file: Number of chunk snippets returned per file.
+    :return: List of {'file_name', 'score', 'hits', 'snippets'} dicts, best first. Each
+             snippet is a (chunk_index, snippet_text) pair. Lower bm25 scores are better.
+    """
+    sql = f"""
+        SELECT c.id, c.file_name, c.chunk_index, bm25({SEARCH_TABLE}) AS score
+        FROM {SEARCH_TABLE}
+        JOIN pdf_chunks c ON c.id = {SEARCH_TABLE}.rowid
+        WHERE {SEARCH_TABLE} MATCH ?
+        ORDER BY score
+        LIMIT ?"""
+    try:
+        rows = conn.execute(sql, (query, MAX_CHUNK_HITS)).fetchall()
+    except sqlite3.OperationalError:
+        query = quote_query(query)
+        if not query:
+            return []
+        rows = conn.execute(sql, (query, MAX_CHUNK_HITS)).fetchall()
+
+    # Rows come best first, so the first row of each file holds its best score
+    results = {}
+    for chunk_id, file_name, chunk_index, score in rows:
+        result = results.get(file_name)
+        if result is None:
+            if len(results) == max_files:
+                continue
+            result = results[file_name] = {"file_name": file_name, "score": score, "hits": 0, "snippets": []}
+        result["hits"] += 1
+        if len(result["snippets"]) < snippets_per_file:
+            result["snippets"].append((chunk_index, chunk_id))
+
+    snippets = _snippets(conn, query, [chunk_id for result in results.values() for _, chunk_id in result["snippets"]])
+    for result in results.values():
+        result["snippets"] = [(chunk_index, snippets.get(chunk_id, "")) for chunk_index, chunk_id in result["snippets"]]
+    return list(results.values())
+
+def search(db_name: str, query: str, max_files: int = 10) -> None:
+    conn = sqlite3.connect(db_name)
+    try:
+        if not has_search_index(conn):
+            print("No full-text index found, building it first...")
+            build_search_index(conn)
+        else:
+            sync_search_index(conn)
+
+        results = search_chunks(conn, query, max_files=max_files)
+        if not results:
+            print(f"No matches for: {query}")
+        for rank, result in enumerate(results, start=1):
+            print(f"{rank}. {result['file_name']} (score {result['score']:.2f}, {result['hits']} matching chunks)")
+            for chunk_index, snippet in result["snippets"]:
+                print(f"   #{chunk_index}: {' '.join(snippet.split())}")
+    finally:
+        conn.close()
@@ -0,0 +1,111 @@
+import json
+import logging
+import sqlite3
+import zlib
+from collections.abc import Callable, Generator, Iterable
+import modules.manifest as manifest
+from modules.chunk_codec import ZLIB_LEVEL, ZSTD_LEVEL, zstandard
+
+# Extracted page text of every PDF file, keyed by the content hash of the file as in
+# file_manifest, so chunks can be rebuilt at any chunk size without parsing the PDFs
+# again. The pages of a document are stored as one compressed text with the length of
+# every page, in characters, which keeps page numbers and offsets of chunks exact.
+TEXT_CACHE_COLUMNS = ("content_hash", "page_lengths", "text", "codec")
+
+# zstd compresses text better and faster, zlib is always available
+DEFAULT_CACHE_CODEC = "zstd" if zstandard is not None else "zlib"
+
+def create_text_cache_table(conn: sqlite3.Connection, schema="main") -> None:
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {schema}.text_cache (
+        content_hash TEXT PRIMARY KEY,
+        page_lengths TEXT NOT NULL,
+        text BLOB NOT NULL,
+        codec TEXT NOT NULL)
+    """)
+
+def store_entries(conn: sqlite3.Connection, entries: list[tuple]) -> None:
+    conn.executemany(f"INSERT OR REPLACE INTO text_cache ({', '.join(TEXT_CACHE_COLUMNS)}) VALUES (?, ?, ?, ?)", entries)
+
+class PageCollector:
+    """
+    Compresses the pages of a document as they are read, so caching the text of a
+    streamed document only holds its compressed form in memory.
+    """
+
+    def __init__(self, codec: str = DEFAULT_CACHE_CODEC):
+        self.codec = codec
+        self.page_lengths = []
+        self.parts = []
+        if codec == "zstd":
+            self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        else:
+            self._compressor = zlib.compressobj(ZLIB_LEVEL)
+
+    # Pass pages through, compressing their text
+    def track(self, pages: Iterable[str]) -> Generator[str, None, None]:
+        for page_text in pages:
+            self.page_lengths.append(len(page_text))
+            self.parts.append(self._compressor.compress(page_text.encode("utf-8")))
+            yield page_text
+
+    # text_cache row of the pages read, under the content hash of their file
+    def entry(self, content_hash: str) -> tuple:
+        self.parts.append(self._compressor.flush())
+        return content_hash, json.dumps(self.page_lengths), b"".join(self.parts), self.codec
+
+def cache_pages(pdf_file: str, pages: Iterable[str], sink: Callable, content_hash: str = None) -> Generator[str, None, None]:
+    """
+    Pass the pages of a PDF file through, handing its text_cache row to sink once every
+    page was read. A file whose pages are not all read, or that cannot be hashed, is
+    not cached. content_hash spares hashing a file the caller already hashed.
+    """
+    if content_hash is None:
+        try:
+            # Hashed before its pages are read, like the manifest hashes what was extracted
+            content_hash = manifest.hash_file(pdf_file)
+        except OSError as e:
+            logging.warning(f"Not caching the text of {pdf_file}: {e}")
+            yield from pages
+            return
+    collector = PageCollector()
+    yield from collector.track(pages)
+    sink(collector.entry(content_hash))
+
+# Page source caching the text of every file it reads
+def cached_page_source(pdf_file: str, page_source: Callable, sink: Callable) -> Generator[str, None, None]:
+    return cache_pages(pdf_file, page_source(pdf_file), sink)
+
+def decode_pages(page_lengths: str, value: bytes, codec: str) -> list[str]:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("The text cache holds zstd entries, which need the 'zstandard' package (pip install zstandard)")
+        # Streamed frames carry no content size, so they are decompressed as a stream too
+        data = zstandard.ZstdDecompressor().decompressobj().decompress(value)
+    elif codec == "zlib":
+        data = zlib.decompress(value)
+    else:
+        raise ValueError(f"Unknown text cache codec: {codec}")
+    text = data.decode("utf-8")
+    pages = []
+    offset = 0
+    for length in json.loads(page_lengths):
+        pages.append(text[offset:offset + length])
+        offset += length
+    return pages
+
+# Cached page texts of a file content, or None if it is not cached
+def load_pages(conn: sqlite3.Connection, content_hash: str):
+    row = conn.execute("SELECT page_lengths, text, codec FROM text_cache WHERE content_hash = ?", (content_hash,)).fetchone()
+    return None if row is None else decode_pages(*row)
+
+# Drop the entries of contents no file of the manifest has any more, returns their number
+def prune_text_cache(conn: sqlite3.Connection) -> int:
+    with conn:
+        pruned = conn.execute("DELETE FROM text_cache WHERE content_hash NOT IN (SELECT content_hash FROM file_manifest)").rowcount
+    if pruned:
+        logging.info(f"Pruned {pruned} text cache entries no longer in the manifest.")
+    return pruned
+
+def cache_summary(conn: sqlite3.Connection) -> str:
+    entries, stored_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(text)), 0) FROM text_cache").fetchone()
+    return f"Text cache: {entries} files, {stored_bytes / 1e6:.1f} MB compressed."
@@ -0,0 +1,338 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import sqlite3
+import struct
+import sys
+import time
+from os.path import join
+import modules.extract_text as extract_text
+import modules.journal as journal
+
+# Seconds a file's size and mtime must stay unchanged before it is ingested
+DEFAULT_SETTLE_SECONDS = 5.0
+
+# A settled PDF without an %%EOF trailer may still be copying; it is ingested anyway
+# once stable this many times the settle time
+INCOMPLETE_SETTLE_FACTOR = 12
+
+# Seconds between snapshots of the polling watcher
+DEFAULT_POLL_INTERVAL = 5.0
+
+# Bytes at the end of a PDF searched for the %%EOF trailer
+TRAILER_BYTES = 1024
+
+# Size and mtime of a file, None once it is gone
+def stat_signature(file_path: str):
+    try:
+        info = os.stat(file_path)
+    except OSError:
+        return None
+    return info.st_size, info.st_mtime_ns
+
+def has_pdf_trailer(file_path: str) -> bool:
+    try:
+        with open(file_path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - TRAILER_BYTES))
+            return b"%%EOF" in f.read()
+    except OSError:
+        return False
+
+def is_pdf(name: str) -> bool:
+    return name.lower().endswith(".pdf")
+
+class PollingWatcher:
+    """
+    Detects changed PDF files by comparing stat snapshots of the folder, taken with
+    batch_collect_files at most every interval seconds. Only sizes and mtimes are read,
+    files are not opened.
+    """
+
+    def __init__(self, folder: str, interval: float = DEFAULT_POLL_INTERVAL):
+        self.folder = folder
+        self.interval = interval
+        self.snapshot = self._take_snapshot()
+        self.last_poll = time.monotonic()
+
+    def _take_snapshot(self) -> dict:
+        snapshot = {}
+        for pdf_batch in extract_text.batch_collect_files(self.folder):
+            for pdf in pdf_batch:
+                signature = stat_signature(pdf)
+                if signature is not None:
+                    snapshot[pdf] = signature
+        return snapshot
+
+    # Wait up to timeout seconds, return the (changed, removed) paths since the last call
+    def poll(self, timeout: float) -> tuple[set, set]:
+        time.sleep(max(0.0, min(timeout, self.last_poll + self.interval - time.monotonic())))
+        if time.monotonic() - self.last_poll < self.interval:
+            return set(), set()
+        snapshot = self._take_snapshot()
+        self.last_poll = time.monotonic()
+        changed = {path for path, signature in snapshot.items() if self.snapshot.get(path) != signature}
+        removed = set(self.snapshot) - set(snapshot)
+        self.snapshot = snapshot
+        return changed, removed
+
+    def close(self) -> None:
+        pass
+
+class InotifyWatcher:
+    """
+    Detects changed PDF files with Linux inotify, watching the folder and every
+    subfolder. Events carry the changed paths, so the folder is never rescanned; only
+    a folder created or moved in is listed once.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.folders = {}
+        self.overflowed = False
+        try:
+            self._watch_tree(folder)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watch(self, folder: str) -> None:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), self.MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {folder}")
+        self.folders[wd] = folder
+
+    # Watch a folder and its subfolders, returning the PDF files already in them
+    def _watch_tree(self, folder: str) -> set:
+        found = set()
+        for root, subfolders, files in os.walk(folder):
+            self._add_watch(root)
+            found.update(join(root, f) for f in files if is_pdf(f))
+        return found
+
+    def poll(self, timeout: float) -> tuple[set, set]:
+        changed, removed = set(), set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return changed, removed
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed, removed
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                self.overflowed = True
+                continue
+            if mask & self.IN_IGNORED:
+                self.folders.pop(wd, None)
+                continue
+            folder = self.folders.get(wd)
+            if folder is None or not name:
+                continue
+            path = join(folder, name)
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    # Files may land in a new folder before it is watched
+                    changed.update(self._watch_tree(path))
+                elif mask & self.IN_MOVED_FROM:
+                    # Files of a folder moved away are unknown here, the folder prefix
+                    # stands for all of them
+                    self._forget_tree(path)
+                    removed.add(path + os.sep)
+            elif is_pdf(name):
+                if mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                    removed.add(path)
+                    changed.discard(path)
+                else:
+                    changed.add(path)
+                    removed.discard(path)
+        return changed, removed
+
+    def _forget_tree(self, folder: str) -> None:
+        prefix = folder + os.sep
+        for wd in [wd for wd, path in self.folders.items() if path == folder or path.startswith(prefix)]:
+            self.libc.inotify_rm_watch(self.fd, wd)
+            self.folders.pop(wd, None)
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+class PendingFiles:
+    """Changed files waiting for their size and mtime to settle before they are ingested."""
+
+    def __init__(self, settle: float = DEFAULT_SETTLE_SECONDS):
+        self.settle = settle
+        # path -> (signature, monotonic time it was first seen with that signature)
+        self.files = {}
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def add(self, paths) -> None:
+        for path in paths:
+            self.files[path] = (None, time.monotonic())
+
+    def discard(self, paths) -> None:
+        for path in paths:
+            self.files.pop(path, None)
+
+    # Files stable for the settle time and complete, or stable for much longer
+    def ready(self) -> list[str]:
+        now = time.monotonic()
+        ready = []
+        for path, (signature, since) in list(self.files.items()):
+            current = stat_signature(path)
+            if current is None:
+                del self.files[path]
+            elif current != signature:
+                self.files[path] = (current, now)
+            elif now - since >= self.settle and (has_pdf_trailer(path) or now - since >= self.settle * INCOMPLETE_SETTLE_FACTOR):
+                ready.append(path)
+                del self.files[path]
+        return sorted(ready)
+
+# Lower the CPU priority of the daemon and of the extraction workers it starts
+def lower_priority() -> None:
+    try:
+        if hasattr(os, "nice"):
+            os.nice(10)
+        elif sys.platform == "win32":
+            # BELOW_NORMAL_PRIORITY_CLASS
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), 0x00004000)
+    except OSError as e:
+        logging.warning(f"Could not lower the process priority: {e}")
+
+# inotify on Linux unless polling is asked for or unavailable, stat snapshots elsewhere
+def open_watcher(folder: str, polling: bool = False, poll_interval: float = DEFAULT_POLL_INTERVAL):
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folder)
+        except (OSError, AttributeError) as e:
+            logging.warning(f"inotify unavailable ({e}), polling {folder} instead.")
+    return PollingWatcher(folder, poll_interval)
+
+# Manifest paths of removed files, expanding the folder prefixes of folders moved away
+def expand_removed(db_name: str, removed: set) -> list[str]:
+    paths = {path for path in removed if not path.endswith(os.sep)}
+    prefixes = [path for path in removed if path.endswith(os.sep)]
+    if prefixes:
+        conn = sqlite3.connect(db_name)
+        try:
+            for prefix in prefixes:
+                paths.update(row[0] for row in conn.execute(
+                    "SELECT file_path FROM file_manifest WHERE substr(file_path, 1, ?) = ?", (len(prefix), prefix)))
+        finally:
+            conn.close()
+    return sorted(paths)
+
+def has_unfinished_run(db_name: str) -> bool:
+    conn = sqlite3.connect(db_name)
+    try:
+        journal.create_journal_table(conn)
+        return journal.has_unfinished(conn)
+    finally:
+        conn.close()
+
+def watch_folder(folder: str, db_name: str, chunk_size: int, settle: float = DEFAULT_SETTLE_SECONDS,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL, polling: bool = False, low_priority: bool = True,
+                 **extract_options) -> None:
+    """
+    Keep the chunk database in sync with a folder until interrupted.
+
+    The database first catches up with the folder in one incremental run (finishing an
+    interrupted run before). Afterwards only the files reported changed by the watcher
+    are ingested, once their size and mtime have been stable for settle seconds and the
+    PDF trailer is written, so partially copied files are not read. Files removed or
+    moved away are purged with the next ingest; a file moved within the folder is
+    re-pointed, not extracted again.
+
+    Ctrl-C stops watching; during an ingest it first lets the in-flight files finish.
+
+    :param folder: Folder of the PDF files.
+    :param db_name: Path to the chunk database.
+    :param chunk_size: Maximum number of characters per chunk.
+    :param settle: Seconds a changed file must stay unchanged before it is ingested.
+    :param poll_interval: Seconds between folder snapshots when polling.
+    :param polling: Poll with stat snapshots even where inotify is available.
+    :param low_priority: Run the daemon and its workers at a lowered CPU priority.
+    :param extract_options: Further keyword arguments of extract_text.extract_text().
+    """
+    if low_priority:
+        lower_priority()
+    # Changes made while catching up are reported by the watcher afterwards
+    watcher = open_watcher(folder, polling, poll_interval)
+
+    # Returns False when the ingest was stopped by Ctrl-C
+    def ingest(**scope) -> bool:
+        extract_text.extract_text(folder, chunk_size, db_name, reset_db=False, **extract_options, **scope)
+        return not has_unfinished_run(db_name)
+
+    try:
+        if has_unfinished_run(db_name) and not ingest(resume=True):
+            return
+        print(f"Catching up with {folder}...")
+        if not ingest():
+            return
+
+        pending = PendingFiles(settle)
+        removed = set()
+        print(f"Watching {folder} for new, changed or removed PDF files ({type(watcher).__name__}), Ctrl-C to stop.")
+        while True:
+            changed, gone = watcher.poll(1.0 if pending or removed else poll_interval)
+            pending.add(changed)
+            pending.discard(gone)
+            removed = (removed | gone) - changed
+
+            if getattr(watcher, "overflowed", False):
+                # Events were lost, only a scan of the whole folder is reliable
+                logging.warning("inotify event queue overflowed, scanning the whole folder.")
+                watcher.overflowed = False
+                pending.files.clear()
+                removed.clear()
+                if not ingest():
+                    return
+                continue
+
+            ready = pending.ready()
+            # Removals wait for pending files, so the new path of a moved file arrives with them
+            if ready or (removed and not pending):
+                print(f"Ingesting {len(ready)} changed and {len(removed)} removed PDF files...")
+                logging.info(f"Watch: ingesting {len(ready)} changed and {len(removed)} removed PDF files.")
+                if not ingest(pdf_files=ready, removed_files=expand_removed(db_name, removed)):
+                    return
+                removed.clear()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        print("Stopped watching.")
@@ -0,0 +1,173 @@
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+import fitz  # PyMuPDF
+from collections.abc import Generator
+from modules.page_profile import PageProfile, iter_page_numbers
+
+try:
+    import resource
+except ImportError:  # Windows has no rlimits, memory limits are not enforced there
+    resource = None
+
+# Extraction errors raised in the parent for a file handled by a watchdog worker. The
+# error_class is recorded in the journal and the quarantine table.
+class ExtractionError(Exception):
+    error_class = "ExtractionError"
+
+class ExtractionTimeout(ExtractionError):
+    error_class = "ExtractionTimeout"
+
+class WorkerCrashed(ExtractionError):
+    error_class = "WorkerCrashed"
+
+# Error raised by MuPDF or Python inside the worker, keeping its original class name
+class WorkerError(ExtractionError):
+    def __init__(self, error_class, message):
+        super().__init__(message)
+        self.error_class = error_class
+
+# Worker process: read the pages of the requested files and send them back one by one
+def _serve(conn, memory_limit):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if memory_limit is not None and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        pdf_file, start, end, profile = request
+        try:
+            with fitz.open(pdf_file) as doc:
+                for page_num in iter_page_numbers(doc, start, end, profile):
+                    conn.send(("page", "" if page_num is None else doc.load_page(page_num).get_text()))
+            conn.send(("done", None))
+        except Exception as e:
+            conn.send(("error", (type(e).__name__, str(e))))
+
+class Watchdog:
+    """
+    Pool of killable worker processes reading PDF pages under a time and memory limit.
+
+    Malformed PDF files can make MuPDF hang or allocate without bound, and a thread stuck
+    in fitz cannot be stopped. Each file is read in a worker process instead: when the
+    worker spends more than timeout seconds producing the pages of a file, or dies, it is
+    killed and replaced, and the file fails with ExtractionTimeout or WorkerCrashed.
+    Time spent by the caller consuming the pages does not count against the timeout.
+
+    Idle workers are shared by every thread of the process.
+
+    :param timeout: Seconds a worker may spend on one file.
+    :param memory_limit: Address space limit of a worker in bytes, or None. Not enforced
+                         on platforms without rlimits.
+    """
+
+    def __init__(self, timeout: float, memory_limit: int = None):
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self._context = multiprocessing.get_context("spawn")
+        self._idle = []
+        self._lock = threading.Lock()
+        self.started = 0
+        self.killed = 0
+        if memory_limit is not None and resource is None:
+            logging.warning("Per-file memory limits are not supported on this platform.")
+
+    def _start_worker(self):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_serve, args=(child_conn, self.memory_limit), daemon=True)
+        process.start()
+        child_conn.close()
+        self.started += 1
+        return process, parent_conn
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._start_worker()
+
+    def _release(self, worker) -> None:
+        with self._lock:
+            self._idle.append(worker)
+
+    def _kill(self, worker) -> None:
+        process, conn = worker
+        process.kill()
+        process.join()
+        conn.close()
+        self.killed += 1
+
+    def iter_pages(self, pdf_file, start=0, end=None, profile: PageProfile = None) -> Generator[str, None, None]:
+        worker = self._acquire()
+        process, conn = worker
+        finished = False
+        try:
+            conn.send((pdf_file, start, end, profile))
+            remaining = self.timeout
+            while True:
+                wait_start = time.perf_counter()
+                if not conn.poll(remaining):
+                    raise ExtractionTimeout(f"No result after {self.timeout:g} s")
+                remaining -= time.perf_counter() - wait_start
+                try:
+                    kind, payload = conn.recv()
+                except EOFError:
+                    process.join(1)
+                    raise WorkerCrashed(f"Worker exited with code {process.exitcode}") from None
+                if kind == "page":
+                    yield payload
+                elif kind == "done":
+                    finished = True
+                    return
+                else:
+                    finished = True
+                    raise WorkerError(*payload)
+        finally:
+            # A worker stopped midway still has pages in flight and is not reused
+            if finished:
+                self._release(worker)
+            else:
+                self._kill(worker)
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for process, conn in idle:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            process.join(5)
+            if process.is_alive():
+                process.kill()
+            conn.close()
+        logging.info(f"Watchdog: {self.started} workers started, {self.killed} killed.")
+
+# Watchdog of the current process, created on first use so that pool worker processes
+# get their own
+_watchdog = None
+_watchdog_lock = threading.Lock()
+
+def get_watchdog(timeout: float, memory_limit: int = None) -> Watchdog:
+    global _watchdog
+    with _watchdog_lock:
+        if _watchdog is None:
+            _watchdog = Watchdog(timeout, memory_limit)
+        return _watchdog
+
+# Page source reading a PDF file in a watchdog worker of the current process
+def iter_watched_pages(pdf_file, start=0, end=None, timeout=300.0, memory_limit=None, profile: PageProfile = None) -> Generator[str, None, None]:
+    return get_watchdog(timeout, memory_limit).iter_pages(pdf_file, start, end, profile)
+
+def shutdown_watchdog() -> None:
+    global _watchdog
+    with _watchdog_lock:
+        watchdog, _watchdog = _watchdog, None
+    if watchdog is not None:
+        watchdog.close()
@@ -1,12 +1,11 @@
 import os
 import sqlite3
 import re
-import nltk
 from collections import defaultdict
+from functools import lru_cache
 from shutil import rmtree
 from modules.path import chunk_database_path, token_json_path, buffer_json_path
-from nltk.stem import PorterStemmer
-from nltk.corpus import stopwords
+from modules.chunk_codec import chunk_columns, shared_blob_column, decode_chunk
 from concurrent.futures import ThreadPoolExecutor
 from json import dump
 import string
@@ -14,9 +13,6 @@ import string
 # One-time compiled regex pattern
 REPEATED_CHAR_PATTERN = re.compile(r"([a-zA-Z])\1{2,}")
 
-# Initialize stemmer and stopwords
-stemmer = PorterStemmer()
-stop_words = set(stopwords.words('english'))
 banned_word = {
     'what', 'a', 'when', 'with', 'being', 'at', 'was', 'all', 'is',
     'where', 'not', 'off', 'have', 'you', 'she', 'such', 'me',
@@ -34,9 +30,20 @@ banned_word = {
     'us', 'had', 'on', 'been', 'myself', 'yourself', 'him', 'has',
     'hers', 'both', 'can', 'into', 'by', 'the', 'now', 'having', 'other'
 }
-stop_words.update(banned_word)
-stop_words.update(string.punctuation)
-stop_words = frozenset(stop_words)  # Optimize stopwords lookup
+
+# NLTK and its corpora are loaded on first use, so importing this module stays cheap
+@lru_cache(maxsize=None)
+def get_stemmer():
+    from nltk.stem import PorterStemmer
+    return PorterStemmer()
+
+@lru_cache(maxsize=None)
+def get_stop_words() -> frozenset:
+    from nltk.corpus import stopwords
+    stop_words = set(stopwords.words('english'))
+    stop_words.update(banned_word)
+    stop_words.update(string.punctuation)
+    return frozenset(stop_words)  # Optimize stopwords lookup
 
 def has_repeats_regex(word):
     return bool(REPEATED_CHAR_PATTERN.search(word))
@@ -46,7 +53,10 @@ def clean_text(text: str):
     text = re.sub(r'[^\w\s]', '', text).lower()
 
     # Tokenize text
-    tokens = nltk.word_tokenize(text)
+    from nltk import word_tokenize
+    tokens = word_tokenize(text)
+    stop_words = get_stop_words()
+    stemmer = get_stemmer()
 
     # Initialize filtered tokens
     filtered_tokens = defaultdict(int)
@@ -59,6 +69,10 @@ def clean_text(text: str):
 
     return filtered_tokens
 
+# Token counts of chunks shared by several titles of a deduplicated store, by blob id.
+# Each shared chunk is decoded and tokenized once per run.
+shared_tokens = {}
+
 # Retrieve title IDs from the database
 def get_title_ids(cursor):
     cursor.execute("SELECT id, file_name FROM file_info WHERE chunk_count > 0")
@@ -78,15 +92,23 @@ def retrieve_token_list(title_id, database):
 
         chunk_count, start_id = result
 
-        cursor.execute("""
-            SELECT chunk_text FROM pdf_chunks
-            LIMIT ? OFFSET ?""", (chunk_count, start_id))
+        # Chunks of a title occupy a contiguous id range, which may not start at
+        # row offset start_id once files have been purged or re-extracted
+        cursor.execute(f"""
+            SELECT {chunk_columns(conn)}, {shared_blob_column(conn)} FROM pdf_chunks
+            WHERE id >= ? ORDER BY id
+            LIMIT ?""", (start_id, chunk_count))
 
         clean_text_dict = defaultdict(int)
 
-        # Process each chunk one at a time to minimize memory usage
-        for chunk in cursor:
-            chunk_result = clean_text(chunk[0])
+        # Process each chunk one at a time to minimize memory usage, compressed chunks
+        # are decoded transparently
+        for value, codec, blob_id in cursor:
+            chunk_result = shared_tokens.get(blob_id) if blob_id is not None else None
+            if chunk_result is None:
+                chunk_result = clean_text(decode_chunk(value, codec, conn))
+                if blob_id is not None:
+                    shared_tokens[blob_id] = chunk_result
             for word, freq in chunk_result.items():
                 clean_text_dict[word] += freq
 
@@ -97,17 +119,19 @@ def retrieve_token_list(title_id, database):
 
     return clean_text_dict
 
-# Process chunks in batches and store word frequencies in individual JSON files
-def process_chunks_in_batches(database):
+# Process chunks in batches and store word frequencies in individual JSON files, by
+# default in token_json_path and data/global_word_freq.json
+def process_chunks_in_batches(database, token_folder=token_json_path, global_json_path=None):
     conn = sqlite3.connect(database)
     cursor = conn.cursor()
 
     fetched_result = get_title_ids(cursor)
     pdf_titles = list(fetched_result.keys())
     global_word_freq = defaultdict(int)
+    shared_tokens.clear()
 
     # Ensure the directory exists
-    os.makedirs(token_json_path, exist_ok=True)
+    os.makedirs(token_folder, exist_ok=True)
 
     # Process title IDs in parallel (each thread gets its own connection)
     with ThreadPoolExecutor(max_workers=4) as executor:
@@ -118,23 +142,24 @@ def process_chunks_in_batches(database):
                 global_word_freq[word] += freq
 
             # Dump word frequencies for each title into a separate JSON file immediately
-            json_file_path = os.path.join(token_json_path, f'title_{fetched_result[title_id]}.json')
+            json_file_path = os.path.join(token_folder, f'title_{fetched_result[title_id]}.json')
             with open(json_file_path, 'w', encoding='utf-8') as f:
                 dump(word_freq, f, ensure_ascii=False, indent=4)
 
+    shared_tokens.clear()
     print("All titles processed and word frequencies stored in individual JSON files.")
 
     conn.commit()
     conn.close()
 
-    json_global_path = os.path.join(os.getcwd(), 'data', 'global_word_freq.json')
+    json_global_path = global_json_path or os.path.join(os.getcwd(), 'data', 'global_word_freq.json')
     with open(json_global_path, 'w', encoding='utf-8') as f:
         dump(global_word_freq, f, ensure_ascii=False, indent=4)
     print("Global word frequencies inserted into the database.")
 
 # Main function to process word frequencies in batches
-def process_word_frequencies_in_batches():
-    conn = sqlite3.connect(chunk_database_path, check_same_thread=False)
+def process_word_frequencies_in_batches(database=chunk_database_path):
+    conn = sqlite3.connect(database, check_same_thread=False)
     cursor = conn.cursor()
 
     def empty_folder(folder_path):
@@ -145,7 +170,7 @@ def process_word_frequencies_in_batches():
     empty_folder(folder_path=token_json_path)
 
     print("Starting batch processing of chunks...")
-    process_chunks_in_batches(database=chunk_database_path)
+    process_chunks_in_batches(database=database)
     print("Processing word frequencies complete.")
     conn.commit()
     conn.close()